@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Конфигурация gunicorn для веб-интерфейса (см. backend/api/wsgi.py).
+
+Параметры задаются переменными окружения:
+  PRINTERS_WEB_BIND     - адрес и порт (по умолчанию 0.0.0.0:5000)
+  PRINTERS_WEB_WORKERS  - число процессов (по умолчанию 2 * CPU + 1)
+  PRINTERS_WEB_THREADS  - потоков на процесс (по умолчанию 4)
+  PRINTERS_WEB_TIMEOUT  - таймаут запроса в секундах (по умолчанию 30)
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("PRINTERS_WEB_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("PRINTERS_WEB_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("PRINTERS_WEB_THREADS", 4))
+# Потоковые воркеры: запросы к Moonraker (команды) не блокируют процесс целиком
+worker_class = "gthread"
+timeout = int(os.environ.get("PRINTERS_WEB_TIMEOUT", 30))
+keepalive = 5
+# Перезапуск воркеров ограничивает рост памяти при долгой работе
+max_requests = 10000
+max_requests_jitter = 1000
+accesslog = os.environ.get("PRINTERS_WEB_ACCESS_LOG")
+errorlog = "-"
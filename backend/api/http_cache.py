@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP-кеширование и сжатие ответов веб-интерфейса.
+
+- conditional_json: ETag из версии состояния и ответ 304 на If-None-Match,
+  тело ответа при этом даже не строится;
+- сжатие brotli (если установлен пакет brotli) или gzip для ответов крупнее
+  COMPRESS_MIN_SIZE;
+- asset_url: адреса статики с хешем содержимого (?v=...), такие ответы
+  кешируются браузером на год.
+"""
+
+import gzip
+import hashlib
+import os
+
+from flask import current_app, jsonify, request, url_for
+
+from backend.services.metrics import CACHE_REQUESTS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = {"application/json", "text/html", "text/css", "text/javascript",
+                      "application/javascript", "text/plain"}
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+# путь статического файла -> (mtime_ns, хеш содержимого)
+_asset_hashes = {}
+
+_ETAG_HITS = CACHE_REQUESTS.labels("http_etag", "hit")
+_ETAG_MISSES = CACHE_REQUESTS.labels("http_etag", "miss")
+
+
+def conditional_json(etag, build):
+    """JSON-ответ с ETag; если клиент уже имеет эту версию - 304 без тела.
+
+    build вызывается, только когда тело действительно нужно.
+    """
+    if request.if_none_match.contains_weak(etag):
+        _ETAG_HITS.inc()
+        response = current_app.response_class(status=304)
+    else:
+        _ETAG_MISSES.inc()
+        response = jsonify(build())
+    response.set_etag(etag, weak=True)
+    # Браузер перепроверяет ответ при каждом опросе и получает 304, пока состояние не изменилось
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def asset_hash(path):
+    """Короткий хеш содержимого файла, пересчитывается только при изменении mtime"""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _asset_hashes.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    _asset_hashes[path] = (mtime, digest)
+    return digest
+
+
+def init_http_cache(app):
+    """Подключает к приложению сжатие, кеширование статики и asset_url в шаблонах"""
+
+    @app.template_global()
+    def asset_url(filename):
+        path = os.path.join(app.static_folder, filename)
+        return url_for("static", filename=filename, v=asset_hash(path))
+
+    @app.after_request
+    def cache_and_compress(response):
+        if request.endpoint == "static" and "v" in request.args and response.status_code == 200:
+            # Адрес меняется вместе с содержимым файла, поэтому кешировать можно бессрочно
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        return compress(response)
+
+
+def compress(response):
+    if (response.status_code != 200 or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        encoding, data = "br", brotli.compress(data, quality=BROTLI_QUALITY)
+    elif accepted["gzip"]:
+        encoding, data = "gzip", gzip.compress(data, compresslevel=GZIP_LEVEL)
+    else:
+        return response
+
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
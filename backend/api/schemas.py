@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Типизированные схемы ответов API и JSON-провайдер Flask на быстром кодеке.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from flask.json.provider import DefaultJSONProvider
+
+from backend.services import json_codec
+
+
+@dataclass
+class HeaterTemperatures:
+    extruder: float = 0
+    bed: float = 0
+
+
+@dataclass
+class Position:
+    x: float = 0
+    y: float = 0
+    z: float = 0
+
+
+@dataclass
+class StateResponse:
+    """Ответ /api/state"""
+    status: str
+    temperature: HeaterTemperatures
+    target_temperature: HeaterTemperatures
+    position: Position
+    last_update: Optional[str] = None
+
+
+@dataclass
+class PrinterSummary:
+    """Элемент ответа /api/printers"""
+    id: int
+    name: str
+    model: str
+    status: str
+    percent: int
+    lastServed: str
+    material: str
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """jsonify и request.json через json_codec (orjson, если установлен)"""
+
+    def dumps(self, obj, **kwargs):
+        return json_codec.dumps_str(obj)
+
+    def loads(self, s, **kwargs):
+        return json_codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_codec.dumps(obj), mimetype=self.mimetype)
@@ -1,82 +1,101 @@
 from flask import Flask, render_template, jsonify, request
 import requests
-import json
+import argparse
 from datetime import datetime
-import threading
-import time
 import os
 import sys
-from discovery.pi_discover import scan_no_cli
 
 # Add the project root to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
+from backend.services.state_store import DashboardPresence, PrinterStateStore, StateFileReader
+from backend.services.printer_state import PrinterState
+from backend.services.ingest import Ingest, discover_printers, DEFAULT_PRINTER_PORT
+from backend.api.http_cache import init_http_cache, conditional_json
+from backend.services import logs, metrics, profiler, tracing
+from backend.api.schemas import CodecJSONProvider, HeaterTemperatures, Position, PrinterSummary, StateResponse
+
 app = Flask(__name__, 
             template_folder='../../frontend/templates',
             static_folder='../../frontend/static')
+app.json = CodecJSONProvider(app)
+init_http_cache(app)
+# Интервалы обработчиков API; без PRINTERS_TRACE_FILE / PRINTERS_TRACE_OTLP хуки ничего не делают
+tracing.configure_from_env("printers-web")
+tracing.init_flask(app)
 
-# Конфигурация
-aviable_printers = scan_no_cli()
-if len(aviable_printers) > 0:
-    PRINTER_HOST = aviable_printers[0]
-else:
-    PRINTER_HOST = "172.22.112.68"
-PRINTER_PORT = "7125"
-BASE_URL = f"http://{PRINTER_HOST}:{PRINTER_PORT}"
-
-# Глобальные переменные для хранения состояния
-printer_state = {
-    "status": "Неизвестно",
-    "temperature": {"extruder": 0, "bed": 0},
-    "target_temperature": {"extruder": 0, "bed": 0},
-    "position": {"x": 0, "y": 0, "z": 0},
-    "last_update": None
-}
-
-def get_printer_info():
-    """Получает информацию о принтере через Moonraker API"""
-    try:
-        response = requests.get(f"{BASE_URL}/printer/info", timeout=5)
-        if response.status_code == 200:
-            return response.json()["result"]
-    except Exception as e:
-        print(f"Ошибка при получении информации о принтере: {e}")
-    return None
+# id принтера, которым управляет панель (он же id принтера в базе данных)
+PRINTER_ID = int(os.environ.get("PRINTER_ID", 1))
 
-def get_server_info():
-    """Получает информацию о сервере через Moonraker API"""
-    try:
-        response = requests.get(f"{BASE_URL}/server/info", timeout=5)
-        if response.status_code == 200:
-            return response.json()["result"]
-    except Exception as e:
-        print(f"Ошибка при получении информации о сервере: {e}")
-    return None
-
-def update_printer_state():
-    """Фоновая задача для обновления состояния принтера"""
-    while True:
-        try:
-            # Получаем информацию о состоянии принтера
-            response = requests.get(f"{BASE_URL}/printer/objects/query?print_stats&extruder&heater_bed&toolhead", timeout=5)
-            if response.status_code == 200:
-                data = response.json()["result"]["status"]
-                
-                printer_state["status"] = data["print_stats"]["state"]
-                printer_state["temperature"]["extruder"] = data["extruder"]["temperature"]
-                printer_state["temperature"]["bed"] = data["heater_bed"]["temperature"]
-                printer_state["target_temperature"]["extruder"] = data["extruder"]["target"]
-                printer_state["target_temperature"]["bed"] = data["heater_bed"]["target"]
-                printer_state["position"] = {
-                    "x": data["toolhead"]["position"][0],
-                    "y": data["toolhead"]["position"][1],
-                    "z": data["toolhead"]["position"][2]
-                }
-                printer_state["last_update"] = datetime.now().strftime("%H:%M:%S")
-        except Exception as e:
-            print(f"Ошибка при обновлении состояния: {e}")
-        
-        time.sleep(1)
+# Источник живого состояния: кеш в процессе (режим разработки) или снимок,
+# опубликованный процессом сбора данных (production, см. backend/api/wsgi.py)
+state_source = PrinterStateStore()
+# Отметки открытых панелей для процесса сбора: по ним он подписывается на поля панелей
+presence = None
+
+def use_state_file(path):
+    """Переключает веб-интерфейс на чтение состояния из общего файла"""
+    global state_source, presence
+    state_source = StateFileReader(path)
+    presence = DashboardPresence(path)
+
+def mark_panel(name):
+    if presence is not None:
+        presence.touch(name)
+
+# Состояние парка в /metrics читается из текущего источника при каждом опросе
+metrics.REGISTRY.register(metrics.printer_metrics(lambda: state_source))
+
+# База данных открывается при первом обращении: воркеры только читают ее,
+# схему обновляет процесс сбора данных (или python -m backend.db.migrations)
+_db = None
+
+def get_db():
+    global _db
+    if _db is None:
+        from backend.db.data_model import DBModel
+        _db = DBModel(read_only=True)
+    return _db
+
+def get_base_url(printer_id=None):
+    """Адрес Moonraker принтера из снимка состояния или из переменных окружения"""
+    state = state_source.get(PRINTER_ID if printer_id is None else printer_id)
+    meta = state.meta if state is not None else {}
+    host = meta.get("host") or os.environ.get("PRINTER_HOST", "172.22.112.68")
+    port = meta.get("port") or os.environ.get("PRINTER_PORT", DEFAULT_PRINTER_PORT)
+    return f"http://{host}:{port}"
+
+def build_state(state):
+    """Ответ /api/state из состояния принтера"""
+    state = state or PrinterState()
+    extruder = state.extruder
+    heater_bed = state.heater_bed
+    position = state.toolhead.position or [0, 0, 0]
+    return StateResponse(
+        status=state.print_stats.state or "Неизвестно",
+        temperature=HeaterTemperatures(extruder.temperature or 0, heater_bed.temperature or 0),
+        target_temperature=HeaterTemperatures(extruder.target or 0, heater_bed.target or 0),
+        position=Position(position[0], position[1], position[2]),
+        last_update=state.meta.get("last_update")
+    )
+
+def build_printer(printer_id, state):
+    """Элемент списка /api/printers из состояния принтера"""
+    meta = state.meta
+    printer = PrinterSummary(
+        id=printer_id,
+        name=meta.get("hostname") or "Принтер",
+        model=meta.get("model") or "Неизвестная модель",
+        status="work" if meta.get("online") and meta.get("klippy_state") == "ready" else "error",
+        percent=0,
+        lastServed=datetime.now().strftime("%d.%m.%Y"),
+        material="PLA"  # Default material
+    )
+    progress = state.virtual_sdcard.progress or 0
+    if progress > 0:
+        printer.percent = int(progress * 100)
+        printer.status = "work"
+    return printer
 
 @app.route('/')
 def index():
@@ -88,38 +107,16 @@ def printer_control():
 
 @app.route('/api/printers')
 def get_printers():
-    """API endpoint to get list of printers (for now just one)"""
-    try:
-        printer_info = get_printer_info()
-        server_info = get_server_info()
-        
-        if printer_info and server_info:
-            printer = {
-                "id": 1,
-                "name": printer_info.get("hostname", "Принтер"),
-                "model": printer_info.get("model", "Неизвестная модель"),
-                "status": "work" if server_info.get("klippy_state") == "ready" else "error",
-                "percent": 0,  # Will be updated with real data
-                "lastServed": datetime.now().strftime("%d.%m.%Y"),
-                "material": "PLA"  # Default material
-            }
-            
-            # Try to get print progress if printing
-            try:
-                response = requests.get(f"{BASE_URL}/printer/objects/query?virtual_sdcard&print_stats", timeout=5)
-                if response.status_code == 200:
-                    data = response.json()["result"]["status"]
-                    if "virtual_sdcard" in data and data["virtual_sdcard"]["progress"] > 0:
-                        printer["percent"] = int(data["virtual_sdcard"]["progress"] * 100)
-                        printer["status"] = "work"
-            except:
-                pass
-                
-            return jsonify([printer])
-    except Exception as e:
-        print(f"Ошибка при получении списка принтеров: {e}")
-    
-    # Return default printer if API fails
+    """API endpoint to get list of printers"""
+    mark_panel("fleet")
+    version, states = state_source.snapshot()
+    if states:
+        # В ответе есть дата обслуживания, поэтому она тоже входит в ETag
+        etag = f"printers-{state_source.epoch}-{version}-{datetime.now():%Y%m%d}"
+        return conditional_json(etag, lambda: [build_printer(printer_id, state)
+                                               for printer_id, state in sorted(states.items())])
+
+    # Return default printer if no data collected yet
     return jsonify([{
         "id": 1,
         "name": "Принтер 1",
@@ -132,13 +129,50 @@ def get_printers():
 
 @app.route('/api/state')
 def get_state():
-    return jsonify(printer_state)
+    mark_panel(f"printer-{PRINTER_ID}")
+    state = state_source.get(PRINTER_ID)
+    version = state.meta.get("version", 0) if state is not None else 0
+    # Эпоха источника: после перезапуска сбора версии начинаются заново
+    return conditional_json(f"state-{state_source.epoch}-{PRINTER_ID}-{version}", lambda: build_state(state))
+
+@app.route('/metrics')
+def get_metrics():
+    """Метрики парка и процесса в формате Prometheus"""
+    return app.response_class(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/debug/profile')
+def get_profile():
+    """Профиль процесса за ?seconds=N в свернутом формате (только при PRINTERS_PROFILER=1)"""
+    if not profiler.enabled():
+        return jsonify({"success": False, "message": "Профилирование выключено"}), 404
+    status, text = profiler.handle_request(request.args)
+    return app.response_class(text, status=status, content_type="text/plain; charset=utf-8")
+
+@app.route('/api/tasks')
+def get_tasks():
+    """История задач с keyset-пагинацией: ?cursor=&limit=&printer_id=&project_id=&status=&since=&until=&columns="""
+    args = request.args
+    columns = args.get('columns')
+    try:
+        rows, next_cursor = get_db().get_tasks_page(
+            printer_id=args.get('printer_id', type=int),
+            project_id=args.get('project_id', type=int),
+            status=args.get('status'),
+            since=args.get('since'),
+            until=args.get('until'),
+            columns=columns.split(',') if columns else None,
+            cursor=args.get('cursor', type=int),
+            limit=args.get('limit', 50, type=int)
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"tasks": rows, "next_cursor": next_cursor})
 
 @app.route('/api/command', methods=['POST'])
 def send_command():
     command = request.json.get('command')
     try:
-        response = requests.post(f"{BASE_URL}/printer/gcode/script", json={"script": command})
+        response = requests.post(f"{get_base_url()}/printer/gcode/script", json={"script": command})
         return jsonify({"success": True, "message": "Команда отправлена"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
@@ -148,7 +182,7 @@ def home_axis():
     axis = request.json.get('axis', 'all')
     try:
         command = f"G28 {axis.upper()}" if axis != 'all' else "G28"
-        response = requests.post(f"{BASE_URL}/printer/gcode/script", json={"script": command})
+        response = requests.post(f"{get_base_url()}/printer/gcode/script", json={"script": command})
         return jsonify({"success": True, "message": "Команда отправлена"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
@@ -168,14 +202,32 @@ def set_temperature():
         else:
             return jsonify({"success": False, "message": "Неверный параметр target"})
             
-        response = requests.post(f"{BASE_URL}/printer/gcode/script", json={"script": command})
+        response = requests.post(f"{get_base_url()}/printer/gcode/script", json={"script": command})
         return jsonify({"success": True, "message": "Температура установлена"})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)})
 
 if __name__ == '__main__':
-    # Запускаем фоновую задачу обновления состояния
-    update_thread = threading.Thread(target=update_printer_state, daemon=True)
-    update_thread.start()
-    
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Веб-интерфейс управления принтерами (режим разработки)")
+    parser.add_argument("--host", action="append",
+                        help="Хост Moonraker или хост:порт (можно несколько; по умолчанию - поиск в сети)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PRINTER_PORT, help="Порт Moonraker (по умолчанию: 7125)")
+    parser.add_argument("--listen", default="0.0.0.0", help="Адрес веб-сервера (по умолчанию: 0.0.0.0)")
+    parser.add_argument("--web-port", type=int, default=5000, help="Порт веб-сервера (по умолчанию: 5000)")
+    parser.add_argument("--debug", action="store_true", help="Режим отладки Flask")
+    args = parser.parse_args()
+    logs.setup_logging()
+
+    # Сбор данных, запись прогресса задач и учет филамента в этом же процессе;
+    # он же обновляет схему и пишет в базу, API читает через эту же модель
+    from backend.db.data_model import DBModel
+    _db = DBModel()
+    printers, sweep = discover_printers(args.host, args.port)
+    ingest = Ingest(printers, store=state_source, db=_db)
+    ingest.start()
+    if sweep is not None:
+        sweep.on_found = ingest.source.add_printer
+        sweep.start()
+
+    # Перезагрузчик запустил бы второй экземпляр сбора данных
+    app.run(host=args.listen, port=args.web_port, debug=args.debug, use_reloader=False)
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Точка входа WSGI для production-режима веб-интерфейса.
+
+HTTP-воркеры не опрашивают принтеры сами: состояние публикует отдельный
+процесс сбора данных (backend/services/ingest.py) в общий файл, а воркеры
+только читают его. Поэтому воркеров и потоков может быть сколько угодно.
+
+    python backend/services/ingest.py --host 192.168.10.14 &
+    gunicorn -c backend/api/gunicorn.conf.py backend.api.wsgi:app
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.api.web_interface import app, use_state_file
+from backend.services import logs
+from backend.services.state_store import DEFAULT_STATE_FILE
+
+logs.setup_logging()
+use_state_file(os.environ.get("PRINTERS_STATE_FILE", DEFAULT_STATE_FILE))
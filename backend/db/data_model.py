@@ -1,7 +1,19 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Text, DateTime, Index, bindparam, update
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-import os
+from dataclasses import replace
+from datetime import datetime
+import csv
+import io
+
+from backend.db.migrations import migrate, parse_datetime, parse_number
+from backend.db.storage import StorageConfig, WriteQueue, create_storage_engine
+
+# Максимальный размер страницы для постраничных запросов
+MAX_PAGE_SIZE = 500
+
+# Статусы задач, по которым можно фильтровать историю
+TASK_STATUSES = ('queued', 'active', 'done', 'error')
 
 Base = declarative_base()
 
@@ -15,8 +27,11 @@ class Material(Base):
     __tablename__ = 'materials'
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    nozzle_tmp = Column(String)
-    table_tmp = Column(String)
+    nozzle_tmp = Column(Float)
+    table_tmp = Column(Float)
+    # Плотность, г/см³, и диаметр нити, мм - для перевода длины нити в массу
+    density = Column(Float)
+    diameter = Column(Float)
 
 class Coil(Base):
     __tablename__ = 'coils'
@@ -26,6 +41,10 @@ class Coil(Base):
     remains = Column(Float)
     material = relationship('Material')
 
+    __table_args__ = (
+        Index('ix_coils_material_id', 'material_id'),
+    )
+
 class Project(Base):
     __tablename__ = 'projects'
     id = Column(Integer, primary_key=True)
@@ -39,8 +58,9 @@ class Task(Base):
     coil_id = Column(Integer, ForeignKey('coils.id'))
     material_amount = Column(Float)
     project_id = Column(Integer, ForeignKey('projects.id'))
-    time_start = Column(String)
-    time_end = Column(String)
+    time_start = Column(DateTime)
+    time_end = Column(DateTime)
+    status = Column(String(16), nullable=False, default='queued')
     progress = Column(Integer)
     model_gcode = Column(Text)
 
@@ -48,14 +68,70 @@ class Task(Base):
     coil = relationship('Coil')
     project = relationship('Project')
 
+    # Индексы под запросы планировщика (очередь принтера) и истории (по времени)
+    __table_args__ = (
+        Index('ix_tasks_printer_id', 'printer_id', 'id'),
+        Index('ix_tasks_printer_status', 'printer_id', 'status'),
+        Index('ix_tasks_printer_time_start', 'printer_id', 'time_start'),
+        Index('ix_tasks_project_time_start', 'project_id', 'time_start'),
+        Index('ix_tasks_time_start', 'time_start'),
+        Index('ix_tasks_coil_id', 'coil_id'),
+    )
+
+class TelemetrySample(Base):
+    __tablename__ = 'telemetry'
+    id = Column(Integer, primary_key=True)
+    printer_id = Column(Integer, ForeignKey('printers.id'), nullable=False)
+    ts = Column(DateTime, nullable=False)
+    state = Column(String(16))
+    extruder_temp = Column(Float)
+    extruder_target = Column(Float)
+    bed_temp = Column(Float)
+    bed_target = Column(Float)
+    progress = Column(Float)
+
+    __table_args__ = (
+        Index('ix_telemetry_printer_ts', 'printer_id', 'ts'),
+    )
+
 class DBModel:
-    def __init__(self, db_path='database.db'):
-        self.db_path = db_path
-        db_exists = os.path.exists(self.db_path)
-        self.engine = create_engine(f'sqlite:///{self.db_path}')
-        if not db_exists:
-            Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
+    def __init__(self, db_path=None, config=None, url=None, read_only=False):
+        """read_only - только чтение (HTTP-воркеры): без миграций, без писателя,
+        соединения не могут менять базу. Схему обновляет процесс сбора данных
+        или команда python -m backend.db.migrations.
+        """
+        self.config = config or StorageConfig.from_env(db_path=db_path, url=url)
+        if read_only:
+            self.config = replace(self.config, read_only=True)
+        self.db_path = self.config.db_path
+        self.backend = self.config.backend
+        self.engine = create_storage_engine(self.config)
+        # expire_on_commit=False: объекты остаются читаемыми после закрытия сессии
+        self.Session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.writer = None
+        if not self.config.read_only:
+            # Создает новую базу или обновляет схему существующей
+            migrate(self.engine, Base.metadata)
+            # Фоновые записи идут через единственного писателя с групповыми коммитами
+            self.writer = WriteQueue(self.Session, self.config.batch_max_size,
+                                     self.config.batch_max_delay, self.config.write_queue_size)
+        self._task_listeners = []
+
+    def subscribe_tasks(self, listener):
+        """listener(task_id, values) вызывается при добавлении и изменении задачи через эту модель.
+
+        values - записанные поля задачи (status, coil_id, ...). Задачи,
+        измененные в других процессах, сюда не попадают.
+        """
+        self._task_listeners.append(listener)
+
+    def unsubscribe_tasks(self, listener):
+        if listener in self._task_listeners:
+            self._task_listeners.remove(listener)
+
+    def _task_changed(self, task_id, values):
+        for listener in list(self._task_listeners):
+            listener(task_id, values)
 
     def get_session(self):
         return self.Session()
@@ -68,9 +144,10 @@ class DBModel:
         session.close()
         return printer
 
-    def add_material(self, name, nozzle_tmp, table_tmp):
+    def add_material(self, name, nozzle_tmp, table_tmp, density=None, diameter=None):
         session = self.get_session()
-        material = Material(name=name, nozzle_tmp=nozzle_tmp, table_tmp=table_tmp)
+        material = Material(name=name, nozzle_tmp=parse_number(nozzle_tmp), table_tmp=parse_number(table_tmp),
+                            density=parse_number(density), diameter=parse_number(diameter))
         session.add(material)
         session.commit()
         session.close()
@@ -92,13 +169,20 @@ class DBModel:
         session.close()
         return project
 
-    def add_task(self, printer_id, coil_id, material_amount, project_id, time_start, time_end, progress, model_gcode):
+    def add_task(self, printer_id, coil_id, material_amount, project_id, time_start, time_end, progress, model_gcode,
+                 status=None):
         session = self.get_session()
+        time_start = parse_datetime(time_start)
+        time_end = parse_datetime(time_end)
+        if status is None:
+            status = 'done' if time_end else 'active' if time_start else 'queued'
         task = Task(printer_id=printer_id, coil_id=coil_id, material_amount=material_amount, 
-                    project_id=project_id, time_start=time_start, time_end=time_end, progress=progress, model_gcode=model_gcode)
+                    project_id=project_id, time_start=time_start, time_end=time_end, status=status,
+                    progress=progress, model_gcode=model_gcode)
         session.add(task)
         session.commit()
         session.close()
+        self._task_changed(task.id, {'status': status, 'coil_id': coil_id, 'material_amount': material_amount})
         return task
 
     def get_printers(self):
@@ -130,3 +214,201 @@ class DBModel:
         tasks = session.query(Task).all()
         session.close()
         return tasks
+
+    def record_telemetry(self, printer_id, ts=None, **values):
+        """Ставит в очередь запись отсчета телеметрии (поля TelemetrySample)"""
+        values.update(printer_id=printer_id, ts=ts or datetime.now())
+        self.writer.insert(TelemetrySample, values)
+
+    def bulk_load_telemetry(self, rows):
+        """Синхронная массовая загрузка телеметрии (например, импорт истории).
+
+        rows - словари с полями TelemetrySample. На PostgreSQL используется COPY,
+        на SQLite - executemany в одной транзакции. Возвращает число строк.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        if self.backend == 'postgresql':
+            self._copy_telemetry(rows)
+        else:
+            session = self.get_session()
+            try:
+                session.execute(TelemetrySample.__table__.insert(), rows)
+                session.commit()
+            finally:
+                session.close()
+        return len(rows)
+
+    def _copy_telemetry(self, rows):
+        columns = [c.name for c in TelemetrySample.__table__.columns if c.name != 'id']
+        sql = f"COPY {TelemetrySample.__tablename__} ({', '.join(columns)}) FROM STDIN"
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if self.engine.dialect.driver == 'psycopg':
+                # psycopg 3: построчная запись в COPY-поток
+                with cursor.copy(sql) as copy:
+                    for row in rows:
+                        copy.write_row([row.get(name) for name in columns])
+            else:
+                # psycopg2: COPY из текстового буфера в формате CSV
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows([row.get(name) for name in columns] for row in rows)
+                buffer.seek(0)
+                cursor.copy_expert(f"{sql} WITH (FORMAT csv)", buffer)
+            cursor.close()
+            connection.commit()
+        finally:
+            connection.close()
+
+    def get_coil_stock(self, coil_ids=None):
+        """Остаток катушек и параметры нити их материала: {coil_id: {remains, material, density, diameter}}"""
+        session = self.get_session()
+        try:
+            query = session.query(Coil.id, Coil.remains, Material.name, Material.density, Material.diameter) \
+                .outerjoin(Material, Coil.material_id == Material.id)
+            if coil_ids is not None:
+                query = query.filter(Coil.id.in_(list(coil_ids)))
+            return {row.id: {'remains': row.remains, 'material': row.name,
+                             'density': row.density, 'diameter': row.diameter}
+                    for row in query}
+        finally:
+            session.close()
+
+    def consume_coils(self, grams_by_coil):
+        """Ставит в очередь списание массы с катушек одним пакетным UPDATE"""
+        rows = [{'coil_id': coil_id, 'grams': grams} for coil_id, grams in grams_by_coil.items() if grams]
+        if not rows:
+            return
+        statement = update(Coil.__table__) \
+            .where(Coil.__table__.c.id == bindparam('coil_id')) \
+            .values(remains=Coil.__table__.c.remains - bindparam('grams'))
+        self.writer.call(lambda session: session.execute(statement, rows))
+
+    def update_task(self, task_id, **values):
+        """Ставит в очередь обновление задачи; обновления одной задачи в пачке сливаются"""
+        for key in ('time_start', 'time_end'):
+            if key in values:
+                values[key] = parse_datetime(values[key])
+        self.writer.update(Task, dict(values, id=task_id))
+        self._task_changed(task_id, values)
+
+    def flush(self, timeout=None):
+        """Дожидается записи всех поставленных в очередь изменений"""
+        return self.writer.flush(timeout)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.engine.dispose()
+
+    @staticmethod
+    def _columns(model, columns=None):
+        """Возвращает список колонок для выборки.
+
+        По умолчанию берутся все колонки, кроме тяжелых текстовых (например,
+        model_gcode) - их нужно запрашивать явно. Колонка id добавляется
+        всегда, так как по ней строится курсор пагинации.
+        """
+        table_columns = model.__table__.columns
+        if columns is None:
+            names = [c.name for c in table_columns if not isinstance(c.type, Text)]
+        else:
+            unknown = [name for name in columns if name not in table_columns]
+            if unknown:
+                raise ValueError(f"Неизвестные колонки {model.__tablename__}: {', '.join(unknown)}")
+            names = list(columns)
+        if 'id' not in names:
+            names.insert(0, 'id')
+        return [table_columns[name] for name in names]
+
+    @staticmethod
+    def _task_filters(printer_id=None, project_id=None, status=None, since=None, until=None):
+        """Собирает условия фильтрации задач"""
+        filters = []
+        if printer_id is not None:
+            filters.append(Task.printer_id == printer_id)
+        if project_id is not None:
+            filters.append(Task.project_id == project_id)
+        if status is not None:
+            if status not in TASK_STATUSES:
+                raise ValueError(f"Неизвестный статус задачи: {status}")
+            filters.append(Task.status == status)
+        if since is not None:
+            filters.append(Task.time_start >= parse_datetime(since))
+        if until is not None:
+            filters.append(Task.time_start < parse_datetime(until))
+        return filters
+
+    def _query(self, session, model, columns, filters, cursor=None, descending=True):
+        query = session.query(*columns).filter(*filters)
+        if cursor is not None:
+            query = query.filter(model.id < cursor if descending else model.id > cursor)
+        return query.order_by(model.id.desc() if descending else model.id.asc())
+
+    def get_page(self, model, filters=(), columns=None, cursor=None, limit=50, descending=True):
+        """Возвращает одну страницу строк модели с keyset-пагинацией.
+
+        cursor - id последней строки предыдущей страницы. Возвращает кортеж
+        (rows, next_cursor), где rows - список словарей с запрошенными
+        колонками, а next_cursor равен None, если страниц больше нет.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        session = self.get_session()
+        try:
+            query = self._query(session, model, self._columns(model, columns), filters, cursor, descending)
+            rows = [row._asdict() for row in query.limit(limit + 1)]
+        finally:
+            session.close()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1]['id']
+        return rows, next_cursor
+
+    def iter_rows(self, model, filters=(), columns=None, batch_size=1000, descending=False):
+        """Потоково выдает строки модели, не загружая всю таблицу в память.
+
+        yield_per включает stream_results, поэтому на PostgreSQL используется
+        серверный курсор.
+        """
+        session = self.get_session()
+        try:
+            query = self._query(session, model, self._columns(model, columns), filters,
+                                descending=descending)
+            for row in query.yield_per(batch_size):
+                yield row._asdict()
+        finally:
+            session.close()
+
+    def get_tasks_page(self, printer_id=None, project_id=None, status=None, since=None, until=None,
+                       columns=None, cursor=None, limit=50):
+        """Страница истории задач (сначала новые) с фильтрами и выбором колонок"""
+        filters = self._task_filters(printer_id, project_id, status, since, until)
+        return self.get_page(Task, filters, columns, cursor, limit)
+
+    def iter_tasks(self, printer_id=None, project_id=None, status=None, since=None, until=None,
+                   columns=None, batch_size=1000):
+        """Потоковый обход задач с фильтрами и выбором колонок"""
+        filters = self._task_filters(printer_id, project_id, status, since, until)
+        return self.iter_rows(Task, filters, columns, batch_size)
+
+    def get_row(self, model, row_id, columns=None):
+        """Одна строка модели по id в виде словаря с запрошенными колонками или None"""
+        rows, _ = self.get_page(model, [model.id == row_id], columns, limit=1)
+        return rows[0] if rows else None
+
+    def find_task_for_printer(self, printer_id):
+        """id задачи, которую печатает принтер: активной, иначе самой старой в очереди"""
+        for status in ('active', 'queued'):
+            filters = self._task_filters(printer_id=printer_id, status=status)
+            rows, _ = self.get_page(Task, filters, columns=['id'], limit=1, descending=False)
+            if rows:
+                return rows[0]['id']
+        return None
+
+    def get_coils_page(self, material_id=None, columns=None, cursor=None, limit=50):
+        """Страница катушек с фильтром по материалу"""
+        filters = [Coil.material_id == material_id] if material_id is not None else []
+        return self.get_page(Coil, filters, columns, cursor, limit)
@@ -0,0 +1,214 @@
+"""
+Встроенные миграции схемы базы данных.
+
+Версия схемы хранится в таблице schema_version. Новая база создается сразу
+в актуальной схеме, существующая - последовательно проходит шаги MIGRATIONS.
+
+Схему обновляет процесс сбора данных при старте; без него (например, перед
+запуском одних HTTP-воркеров, которые открывают базу только на чтение) -
+отдельной командой с настройками из PRINTERS_DB_*:
+
+    python -m backend.db.migrations
+"""
+
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, MetaData, Table, inspect, select, text
+
+# Форматы дат, которые встречаются в старых строковых колонках
+DATETIME_FORMATS = (
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y %H:%M",
+    "%d.%m.%Y",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+)
+
+_version_metadata = MetaData()
+schema_version = Table('schema_version', _version_metadata,
+                       Column('version', Integer, nullable=False))
+
+
+def parse_datetime(value):
+    """Приводит значение к datetime. Пустые значения дают None, нераспознанные - ValueError"""
+    if value is None or isinstance(value, datetime):
+        return value
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"Неизвестный формат даты: {value}")
+
+
+def parse_number(value):
+    """Приводит значение к float (например, "210", "210°C", "60,5"). Пустые значения дают None"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = str(value).replace('°C', '').replace('°', '').replace(',', '.').strip()
+    if not value:
+        return None
+    return float(value)
+
+
+def _lenient(parser, value):
+    """Конвертация для миграции: нераспознанные значения теряются, а не ломают миграцию"""
+    try:
+        return parser(value)
+    except (TypeError, ValueError):
+        print(f"Миграция: значение {value!r} не распознано, заменено на NULL")
+        return None
+
+
+def _task_status(row):
+    if row['time_end'] is not None:
+        return 'done'
+    if row['time_start'] is not None:
+        return 'active'
+    return 'queued'
+
+
+def _rebuild_table(conn, table, convert):
+    """Пересоздает таблицу по актуальному описанию, конвертируя старые строки.
+
+    Новая таблица создается под временным именем и затем переименовывается,
+    поэтому внешние ключи других таблиц продолжают ссылаться на исходное имя.
+    """
+    old_columns = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    rows = [dict(row._mapping) for row in conn.execute(text(f'SELECT * FROM {table.name}'))]
+
+    # Временная таблица живет в той же metadata, чтобы разрешались внешние ключи
+    tmp_name = f'{table.name}_new'
+    tmp_table = table.to_metadata(table.metadata, name=tmp_name)
+    try:
+        # Индексы создаются после переименования, уже под штатными именами
+        tmp_table.indexes.clear()
+        tmp_table.create(conn)
+
+        new_rows = []
+        for row in rows:
+            row = {key: value for key, value in row.items() if key in tmp_table.columns}
+            new_rows.append(convert(row, old_columns))
+        if new_rows:
+            conn.execute(tmp_table.insert(), new_rows)
+    finally:
+        table.metadata.remove(tmp_table)
+
+    conn.execute(text(f'DROP TABLE {table.name}'))
+    conn.execute(text(f'ALTER TABLE {tmp_name} RENAME TO {table.name}'))
+    for index in table.indexes:
+        index.create(conn)
+
+
+def _typed_columns_and_indexes(conn, metadata):
+    """Версия 1: даты задач в DateTime, температуры материалов во Float, статус задач и индексы"""
+    def convert_task(row, old_columns):
+        row['time_start'] = _lenient(parse_datetime, row.get('time_start'))
+        row['time_end'] = _lenient(parse_datetime, row.get('time_end'))
+        if 'status' not in old_columns or row.get('status') is None:
+            row['status'] = _task_status(row)
+        return row
+
+    def convert_material(row, old_columns):
+        row['nozzle_tmp'] = _lenient(parse_number, row.get('nozzle_tmp'))
+        row['table_tmp'] = _lenient(parse_number, row.get('table_tmp'))
+        return row
+
+    _rebuild_table(conn, metadata.tables['tasks'], convert_task)
+    _rebuild_table(conn, metadata.tables['materials'], convert_material)
+    for index in metadata.tables['coils'].indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _pagination_indexes(conn, metadata):
+    """Версия 2: индекс (printer_id, id) для постраничной истории принтера без сортировки"""
+    for index in metadata.tables['tasks'].indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _add_columns(conn, table, names):
+    """Добавляет в существующую таблицу недостающие колонки из описания модели"""
+    existing = {c['name'] for c in inspect(conn).get_columns(table.name)}
+    for name in names:
+        if name in existing:
+            continue
+        column = table.columns[name]
+        column_type = column.type.compile(dialect=conn.dialect)
+        conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {name} {column_type}'))
+
+
+def _material_filament_params(conn, metadata):
+    """Версия 3: плотность и диаметр нити материала для учета расхода"""
+    _add_columns(conn, metadata.tables['materials'], ['density', 'diameter'])
+
+
+# Шаги миграции по порядку: MIGRATIONS[i] переводит схему из версии i в i + 1
+MIGRATIONS = [
+    _typed_columns_and_indexes,
+    _pagination_indexes,
+    _material_filament_params,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn):
+    if not inspect(conn).has_table('schema_version'):
+        return 0
+    version = conn.execute(select(schema_version.c.version)).scalar()
+    return version or 0
+
+
+def _set_version(conn, version):
+    conn.execute(schema_version.delete())
+    conn.execute(schema_version.insert(), {'version': version})
+
+
+def migrate(engine, metadata):
+    """Приводит схему базы к актуальной версии. Возвращает номер версии"""
+    with engine.begin() as conn:
+        existing = set(inspect(conn).get_table_names())
+        _version_metadata.create_all(conn)
+
+        if not existing - {'schema_version'}:
+            # Новая база: создаем сразу актуальную схему
+            metadata.create_all(conn)
+            _set_version(conn, SCHEMA_VERSION)
+            return SCHEMA_VERSION
+
+        version = get_version(conn)
+        for step in MIGRATIONS[version:]:
+            print(f"Миграция схемы базы данных до версии {version + 1}: {step.__doc__}")
+            step(conn, metadata)
+            version += 1
+            _set_version(conn, version)
+
+        # Новые таблицы, добавленные в модель без изменения существующих
+        metadata.create_all(conn)
+    return version
+
+
+def main():
+    from backend.db.data_model import Base
+    from backend.db.storage import StorageConfig, create_storage_engine
+
+    config = StorageConfig.from_env()
+    engine = create_storage_engine(config)
+    try:
+        version = migrate(engine, Base.metadata)
+    finally:
+        engine.dispose()
+    print(f"Схема базы данных {config.database_url}: версия {version}")
+
+
+if __name__ == "__main__":
+    main()
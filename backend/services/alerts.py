@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Оповещения по живому состоянию парка.
+
+Правило - выражение над полями объектов Moonraker, например
+"print_stats.state == 'printing' and abs(extruder.temperature - extruder.target) > 15".
+Выражения компилируются один раз при загрузке, а правила индексируются по
+полям, которые они читают: на каждую дельту вычисляются только правила,
+чьи поля в ней изменились, сколько бы правил ни было в парке.
+
+Дополнительно правило может требовать, чтобы условие держалось for секунд,
+или следить, что поле stale не меняется for секунд (остановка печати).
+Такие правила досматриваются таймером раз в секунду, но только пока их
+условие выполняется.
+
+Правило с arm начинает проверяться, только когда выражение arm хотя бы раз
+выполнилось (например, нагреватель дошел до целевой температуры), и снова
+ждет его после изменения любого из полей rearm: иначе обычный нагрев в
+начале печати выглядел бы как отклонение температуры.
+"""
+
+import ast
+import json
+import logging
+import string
+import threading
+import time
+from datetime import datetime
+
+from backend.services import logs
+
+log = logs.get_logger("alerts")
+
+# Уровень записи в журнале для важности правила
+SEVERITY_LEVELS = {'info': logging.INFO, 'warning': logging.WARNING, 'critical': logging.CRITICAL}
+
+# Встроенные правила: печать идет, а температура ушла от целевой, которой
+# нагреватель уже достиг; остановка печати; принтер или Klippy недоступны
+DEFAULT_RULES = [
+    {
+        'name': 'thermal_extruder',
+        'severity': 'critical',
+        'when': "print_stats.state == 'printing' and extruder.target > 0"
+                " and abs(extruder.temperature - extruder.target) > 15",
+        'arm': "extruder.target > 0 and abs(extruder.temperature - extruder.target) <= 3",
+        'rearm': ['extruder.target', 'print_stats.state'],
+        'for': 30,
+        'message': "Температура экструдера {extruder.temperature:.1f}°C далеко от целевой {extruder.target:.0f}°C",
+    },
+    {
+        'name': 'thermal_bed',
+        'severity': 'critical',
+        'when': "print_stats.state == 'printing' and heater_bed.target > 0"
+                " and abs(heater_bed.temperature - heater_bed.target) > 10",
+        'arm': "heater_bed.target > 0 and abs(heater_bed.temperature - heater_bed.target) <= 2",
+        'rearm': ['heater_bed.target', 'print_stats.state'],
+        'for': 60,
+        'message': "Температура стола {heater_bed.temperature:.1f}°C далеко от целевой {heater_bed.target:.0f}°C",
+    },
+    {
+        'name': 'print_stalled',
+        'severity': 'warning',
+        # Пока принтер или Klippy недоступны, file_position не обновляется - это отдельные правила
+        'when': "print_stats.state == 'printing' and meta.klippy_state == 'ready'",
+        'stale': 'virtual_sdcard.file_position',
+        'for': 600,
+        'message': "Печать {print_stats.filename} не продвигается",
+    },
+    {
+        'name': 'printer_offline',
+        'severity': 'warning',
+        'when': "meta.online == False",
+        'for': 30,
+        'message': "Принтер {meta.host} недоступен",
+    },
+    {
+        'name': 'klippy_not_ready',
+        'severity': 'warning',
+        'when': "meta.online and meta.klippy_state != 'ready'",
+        'for': 30,
+        'message': "Klippy в состоянии {meta.klippy_state}",
+    },
+]
+
+# Функции, доступные в выражениях правил
+RULE_FUNCTIONS = {'abs': abs, 'min': min, 'max': max, 'len': len, 'round': round}
+
+_ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.FloorDiv, ast.Pow,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+    ast.Is, ast.IsNot, ast.IfExp, ast.Call, ast.Name, ast.Attribute, ast.Constant,
+    ast.Subscript, ast.Tuple, ast.List, ast.Load,
+)
+
+
+class _FieldAccess(ast.NodeTransformer):
+    """Заменяет объект.поле на _value('объект', 'поле') и собирает читаемые поля"""
+
+    def __init__(self):
+        self.fields = set()
+
+    def visit_Attribute(self, node):
+        if not isinstance(node.value, ast.Name) or node.attr.startswith('_'):
+            raise ValueError(f"Недопустимое обращение к полю в строке {node.lineno}: ожидается объект.поле")
+        self.fields.add(f'{node.value.id}.{node.attr}')
+        call = ast.Call(func=ast.Name(id='_value', ctx=ast.Load()),
+                        args=[ast.Constant(node.value.id), ast.Constant(node.attr)], keywords=[])
+        return ast.copy_location(call, node)
+
+
+def compile_expression(source):
+    """Компилирует выражение правила; возвращает (код, множество полей 'объект.поле')"""
+    tree = ast.parse(source, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"Недопустимая конструкция в правиле: {type(node).__name__}")
+        if isinstance(node, ast.Call) and not (isinstance(node.func, ast.Name) and node.func.id in RULE_FUNCTIONS):
+            raise ValueError("В правилах можно вызывать только " + ", ".join(RULE_FUNCTIONS))
+    access = _FieldAccess()
+    tree = ast.fix_missing_locations(access.visit(tree))
+    # После замены объект.поле других имен, кроме функций, остаться не должно
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id != '_value' and node.id not in RULE_FUNCTIONS:
+            raise ValueError(f"Неизвестное имя в правиле: {node.id}")
+    return compile(tree, f'<rule {source!r}>', 'eval'), access.fields
+
+
+class Rule:
+    """Скомпилированное правило"""
+
+    def __init__(self, name, when=None, stale=None, duration=0.0, severity='warning', message=None,
+                 printers=None, arm=None, rearm=()):
+        self.name = name
+        self.when = when
+        self.stale = stale
+        self.duration = duration
+        self.severity = severity
+        self.message = message or name
+        self.printers = frozenset(printers) if printers is not None else None
+
+        self.fields = set()
+        self._code = None
+        if when:
+            self._code, self.fields = compile_expression(when)
+        if stale:
+            if stale.count('.') != 1:
+                raise ValueError(f"Правило {name}: stale должно быть вида объект.поле")
+            self.fields.add(stale)
+        if not self.fields:
+            raise ValueError(f"Правило {name} не читает ни одного поля")
+        self._arm_code = None
+        self.rearm = frozenset(rearm)
+        if arm:
+            self._arm_code, arm_fields = compile_expression(arm)
+            self.fields |= arm_fields
+        for field in self.rearm:
+            if field.count('.') != 1:
+                raise ValueError(f"Правило {name}: поля rearm должны быть вида объект.поле")
+        self.fields |= self.rearm
+        # Поля шаблона сообщения: условие они не меняют, но подписка должна их получать
+        self.message_fields = _template_fields(self.message)
+        # Правило требует досмотра таймером, пока условие выполняется
+        self.timed = bool(stale) or duration > 0
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], when=data.get('when'), stale=data.get('stale'),
+                   duration=float(data.get('for', 0)), severity=data.get('severity', 'warning'),
+                   message=data.get('message'), printers=data.get('printers'), arm=data.get('arm'),
+                   rearm=data.get('rearm', ()))
+
+    @property
+    def armed_by(self):
+        return self._arm_code is not None
+
+    @staticmethod
+    def _eval(code, state):
+        try:
+            return bool(eval(code, {'__builtins__': {}, '_value': state.value, **RULE_FUNCTIONS}))
+        except Exception:
+            return False
+
+    def check(self, state):
+        """Значение условия для состояния принтера; ошибка вычисления (например, поля еще нет) - ложь"""
+        return True if self._code is None else self._eval(self._code, state)
+
+    def check_arm(self, state):
+        return self._eval(self._arm_code, state)
+
+    def format(self, state):
+        objects = {field.split('.')[0] for field in self.fields | self.message_fields}
+        namespace = {name: _ObjectView(state, name) for name in objects}
+        try:
+            return self.message.format(**namespace)
+        except Exception:
+            return self.message
+
+
+def _template_fields(template):
+    """Поля 'объект.поле' из шаблона сообщения: "{extruder.temperature:.1f}" -> extruder.temperature"""
+    fields = set()
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError:
+        return fields
+    for _, name, _, _ in parsed:
+        if name and name.count('.') == 1 and '[' not in name:
+            fields.add(name)
+    return fields
+
+
+class _ObjectView:
+    """Доступ к полям объекта состояния через атрибуты - для шаблонов сообщений"""
+
+    def __init__(self, state, name):
+        self._state = state
+        self._name = name
+
+    def __getattr__(self, field):
+        return self._state.value(self._name, field)
+
+
+class Alert:
+    def __init__(self, rule_name, subject, severity, message):
+        self.rule = rule_name
+        # printer_id для правил по состоянию или произвольный ключ для внешних оповещений
+        self.subject = subject
+        self.severity = severity
+        self.message = message
+        self.since = datetime.now()
+
+    def to_dict(self):
+        return {'rule': self.rule, 'subject': self.subject, 'severity': self.severity,
+                'message': self.message, 'since': self.since}
+
+
+def load_rules(path):
+    """Правила из JSON-файла: список объектов с полями name, when, stale, for, severity, message, printers"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class AlertEngine:
+    def __init__(self, store, rules=None, on_alert=None, on_resolve=None, tick_interval=1.0):
+        self.store = store
+        self.rules = [rule if isinstance(rule, Rule) else Rule.from_dict(rule)
+                      for rule in (DEFAULT_RULES if rules is None else rules)]
+        self._rules_by_name = {rule.name: rule for rule in self.rules}
+        self.on_alert = on_alert
+        self.on_resolve = on_resolve
+        self.tick_interval = tick_interval
+
+        # поле -> printer_id (None - правила для всех принтеров) -> правила
+        self._index = {}
+        for rule in self.rules:
+            for field in rule.fields:
+                scopes = self._index.setdefault(field, {})
+                for printer_id in (rule.printers or (None,)):
+                    scopes.setdefault(printer_id, []).append(rule)
+        # Поля, которые нужны правилам и их сообщениям (подписка Moonraker, см. ws_hub)
+        self.FIELDS = {}
+        for field in sorted(set(self._index).union(*(rule.message_fields for rule in self.rules))):
+            name, key = field.split('.', 1)
+            if name != 'meta':
+                self.FIELDS.setdefault(name, []).append(key)
+
+        self._lock = threading.Lock()
+        # (имя правила, printer_id) -> время, с которого выполняется условие
+        self._since = {}
+        # (имя правила, printer_id) правил с arm, которые уже взведены
+        self._armed = set()
+        # printer_id -> живое состояние принтера из последнего уведомления
+        self._states = {}
+        # (имя правила, subject) -> Alert
+        self.active = {}
+        self.evaluations = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.store.subscribe(self.on_state_change)
+        self._thread = threading.Thread(target=self._run, name='alerts', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.store.unsubscribe(self.on_state_change)
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def rules_for(self, printer_id, delta):
+        """Правила, чьи поля изменились в дельте"""
+        rules = {}
+        for name, fields in delta.items():
+            if not isinstance(fields, dict):
+                continue
+            for key in fields:
+                scopes = self._index.get(f'{name}.{key}')
+                if scopes is None:
+                    continue
+                for rule in scopes.get(None, ()):
+                    rules[rule.name] = rule
+                for rule in scopes.get(printer_id, ()):
+                    rules[rule.name] = rule
+        return rules.values()
+
+    def on_state_change(self, printer_id, delta, state):
+        now = time.monotonic()
+        fired, resolved = [], []
+        with self._lock:
+            self._states[printer_id] = state
+            for rule in self.rules_for(printer_id, delta):
+                self.evaluations += 1
+                key = (rule.name, printer_id)
+                if rule.armed_by:
+                    if any(self._changed(delta, field) for field in rule.rearm):
+                        self._armed.discard(key)
+                    if key not in self._armed and rule.check_arm(state):
+                        self._armed.add(key)
+                if (rule.armed_by and key not in self._armed) or not rule.check(state):
+                    self._since.pop(key, None)
+                    if key in self.active:
+                        resolved.append(self.active.pop(key))
+                    continue
+                if rule.stale and self._changed(delta, rule.stale):
+                    # Поле сдвинулось - отсчет начинается заново
+                    self._since[key] = now
+                    if key in self.active:
+                        resolved.append(self.active.pop(key))
+                elif key not in self._since:
+                    self._since[key] = now
+                if not rule.timed and key not in self.active:
+                    fired.append(self._activate(rule, printer_id, state))
+        self._notify(fired, resolved)
+
+    @staticmethod
+    def _changed(delta, field):
+        name, key = field.split('.', 1)
+        fields = delta.get(name)
+        return isinstance(fields, dict) and key in fields
+
+    def tick(self, now=None):
+        """Досматривает правила с длительностью: срабатывают те, чье условие держится достаточно долго"""
+        now = time.monotonic() if now is None else now
+        fired = []
+        with self._lock:
+            for key, since in self._since.items():
+                rule = self._rules_by_name[key[0]]
+                if rule.timed and key not in self.active and now - since >= rule.duration:
+                    fired.append(self._activate(rule, key[1], self._states[key[1]]))
+        self._notify(fired, [])
+        return fired
+
+    def trigger(self, name, subject, message, severity='warning'):
+        """Внешнее оповещение (например, мало филамента); повторный вызов не дублирует его"""
+        with self._lock:
+            if (name, subject) in self.active:
+                return None
+            alert = self.active[(name, subject)] = Alert(name, subject, severity, message)
+        self._notify([alert], [])
+        return alert
+
+    def clear(self, name, subject):
+        with self._lock:
+            alert = self.active.pop((name, subject), None)
+        if alert is not None:
+            self._notify([], [alert])
+
+    def _activate(self, rule, printer_id, state):
+        alert = self.active[(rule.name, printer_id)] = Alert(rule.name, printer_id, rule.severity,
+                                                             rule.format(state))
+        return alert
+
+    def _notify(self, fired, resolved):
+        for alert in fired:
+            log.log(SEVERITY_LEVELS.get(alert.severity, logging.WARNING), "%s (%s): %s", alert.rule, alert.subject,
+                    alert.message, extra={"rule": alert.rule, "subject": alert.subject, "severity": alert.severity})
+            if self.on_alert:
+                self.on_alert(alert)
+        for alert in resolved:
+            log.info("%s (%s): снято", alert.rule, alert.subject, extra={"rule": alert.rule, "subject": alert.subject})
+            if self.on_resolve:
+                self.on_resolve(alert)
+
+    def _run(self):
+        while not self._stop.wait(self.tick_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                log.exception("Ошибка проверки оповещений")
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Прореживание потока изменений состояния перед потребителями.
+
+Во время печати Moonraker присылает до ~4 обновлений в секунду на принтер,
+и большая часть из них - дрожание позиции и шум температуры. StatusFanout
+стоит между PrinterStateStore и потребителями (запись в базу, публикация
+снимка для веб-интерфейса, оповещения):
+
+- копит дельты каждого принтера и раздает их раз в window секунд;
+- отбрасывает изменения числовых полей меньше зоны нечувствительности
+  (deadband) относительно последнего доставленного потребителю значения;
+  придержанное значение все равно доставляется не позже чем через max_hold;
+- доставляет каждому потребителю не чаще его interval.
+
+Интерфейс подписки такой же, как у PrinterStateStore, поэтому компоненты
+сбора подключаются к StatusFanout без изменений.
+"""
+
+import threading
+import time
+
+from backend.services import logs
+
+log = logs.get_logger("fanout")
+
+# Зоны нечувствительности по умолчанию: "объект.поле" -> минимальное значимое изменение
+DEFAULT_DEADBANDS = {
+    'extruder.temperature': 0.1,
+    'heater_bed.temperature': 0.1,
+    'extruder.power': 0.01,
+    'heater_bed.power': 0.01,
+    'toolhead.position': 0.05,
+    'virtual_sdcard.progress': 0.001,
+}
+
+
+def merge_delta(target, delta):
+    """Сливает дельту {объект: {поле: значение}} в target на месте"""
+    for name, fields in delta.items():
+        if isinstance(fields, dict):
+            current = target.get(name)
+            if isinstance(current, dict):
+                current.update(fields)
+            else:
+                target[name] = dict(fields)
+        else:
+            target[name] = fields
+
+
+def within_deadband(old, new, deadband):
+    """True, если new отличается от old меньше чем на deadband (для чисел и списков чисел)"""
+    if isinstance(new, bool) or isinstance(old, bool):
+        return old == new
+    if isinstance(new, (int, float)) and isinstance(old, (int, float)):
+        return abs(new - old) < deadband
+    if isinstance(new, (list, tuple)) and isinstance(old, (list, tuple)) and len(new) == len(old):
+        try:
+            return all(abs(a - b) < deadband for a, b in zip(new, old))
+        except TypeError:
+            return False
+    return False
+
+
+class FanoutConsumer:
+    """Потребитель с собственными частотой, зонами нечувствительности и накопленными дельтами"""
+
+    def __init__(self, listener, interval, deadbands, max_hold):
+        self.listener = listener
+        self.interval = interval
+        self.deadbands = deadbands
+        self.max_hold = max_hold
+        self.next_due = 0.0
+        # printer_id -> накопленная дельта и время самого старого недоставленного изменения
+        self.pending = {}
+        self.pending_since = {}
+        # printer_id -> {объект: {поле: последнее доставленное значение}}
+        self.delivered = {}
+
+        self.calls = 0
+        self.suppressed = 0
+
+    def take(self, printer_id, now, force=False):
+        """Забирает из накопленного то, что пора доставить; остальное остается ждать"""
+        delta = self.pending.get(printer_id)
+        if not delta:
+            return None
+        if force or now - self.pending_since[printer_id] >= self.max_hold:
+            ready, held = delta, {}
+        else:
+            ready, held = self._split(printer_id, delta)
+        if held:
+            self.pending[printer_id] = held
+            self.suppressed += 1
+        else:
+            del self.pending[printer_id]
+            del self.pending_since[printer_id]
+        if not ready:
+            return None
+        merge_delta(self.delivered.setdefault(printer_id, {}), ready)
+        return ready
+
+    def _split(self, printer_id, delta):
+        delivered = self.delivered.get(printer_id, {})
+        ready, held = {}, {}
+        for name, fields in delta.items():
+            if not isinstance(fields, dict):
+                ready[name] = fields
+                continue
+            last = delivered.get(name, {})
+            for key, value in fields.items():
+                deadband = self.deadbands.get(f'{name}.{key}')
+                if deadband and key in last and within_deadband(last[key], value, deadband):
+                    held.setdefault(name, {})[key] = value
+                else:
+                    ready.setdefault(name, {})[key] = value
+        return ready, held
+
+
+class StatusFanout:
+    def __init__(self, store, window=0.25, deadbands=None, max_hold=5.0):
+        self.store = store
+        self.window = window
+        self.deadbands = dict(DEFAULT_DEADBANDS if deadbands is None else deadbands)
+        self.max_hold = max_hold
+
+        self._lock = threading.Lock()
+        self._consumers = []
+        # printer_id -> дельта, накопленная за текущее окно, и живое состояние принтера
+        self._incoming = {}
+        self._states = {}
+
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.received = 0
+        self.windows = 0
+
+    def subscribe(self, listener, interval=None, deadbands=None, max_hold=None):
+        """listener(printer_id, delta, state) вызывается не чаще раза в interval секунд.
+
+        deadbands дополняют зоны нечувствительности по умолчанию ("объект.поле" -> порог,
+        0 - доставлять любое изменение поля).
+        """
+        consumer_deadbands = dict(self.deadbands)
+        consumer_deadbands.update(deadbands or {})
+        consumer = FanoutConsumer(listener, interval or self.window, consumer_deadbands,
+                                  self.max_hold if max_hold is None else max_hold)
+        with self._lock:
+            self._consumers.append(consumer)
+        return consumer
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            self._consumers = [consumer for consumer in self._consumers if consumer.listener != listener]
+
+    def start(self):
+        self.store.subscribe(self._on_change)
+        self._thread = threading.Thread(target=self._run, name='status-fanout', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.store.unsubscribe(self._on_change)
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        # Остаток доставляется сразу, без учета частоты и зон нечувствительности
+        self.flush(force=True)
+
+    def _on_change(self, printer_id, delta, state):
+        with self._lock:
+            self.received += 1
+            merge_delta(self._incoming.setdefault(printer_id, {}), delta)
+            self._states[printer_id] = state
+
+    def flush(self, force=False, now=None):
+        """Раздает накопленное за окно потребителям, которым пора; возвращает число вызовов"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            incoming, self._incoming = self._incoming, {}
+            consumers = list(self._consumers)
+            states = self._states
+            self.windows += 1
+            for consumer in consumers:
+                for printer_id, delta in incoming.items():
+                    pending = consumer.pending.get(printer_id)
+                    if pending is None:
+                        consumer.pending[printer_id] = pending = {}
+                        consumer.pending_since[printer_id] = now
+                    merge_delta(pending, delta)
+
+        calls = 0
+        for consumer in consumers:
+            if not force and now < consumer.next_due:
+                continue
+            consumer.next_due = now + consumer.interval
+            for printer_id in list(consumer.pending):
+                delta = consumer.take(printer_id, now, force)
+                if not delta:
+                    continue
+                consumer.calls += 1
+                calls += 1
+                try:
+                    consumer.listener(printer_id, delta, states.get(printer_id))
+                except Exception as e:
+                    log.exception("Ошибка потребителя состояния принтера %s", printer_id, extra={"printer_id": printer_id})
+        return calls
+
+    def stats(self):
+        """Счетчики: сколько изменений пришло и сколько вызовов получил каждый потребитель"""
+        with self._lock:
+            consumers = list(self._consumers)
+        return {
+            'received': self.received,
+            'windows': self.windows,
+            'consumers': [{'listener': getattr(consumer.listener, '__qualname__', repr(consumer.listener)),
+                           'calls': consumer.calls, 'suppressed': consumer.suppressed,
+                           'pending': len(consumer.pending)} for consumer in consumers],
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception("Ошибка раздачи изменений состояния")
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Учет расхода филамента по живой телеметрии принтеров.
+
+Следит за print_stats.filament_used (мм нити с начала печати) каждого принтера,
+переводит прирост в граммы по плотности и диаметру материала катушки и пачкой
+списывает их с Coil.remains. Параллельно поддерживает прогноз остатков:
+остаток катушки минус потребность задач в очереди и недопечатанной активной
+задачи. Все величины обновляются инкрементально, без пересчета по всем задачам.
+Очередь задач загружается при старте и дальше ведется по DBModel.subscribe_tasks;
+задачи, добавленные и снятые другими процессами (веб-интерфейсом), раз в
+flush_interval секунд дочитываются из базы: только новые задачи очереди
+(id больше последнего известного) и статусы задач, которые сейчас в очереди.
+"""
+
+import math
+import threading
+
+from backend.db.data_model import Task
+from backend.services import logs
+
+log = logs.get_logger("filament_accounting")
+
+# Типичная плотность материалов, г/см³, если в базе не указана
+DEFAULT_DENSITIES = {
+    'PLA': 1.24,
+    'PETG': 1.27,
+    'ABS': 1.04,
+    'ASA': 1.07,
+    'TPU': 1.21,
+    'PA': 1.14,
+    'NYLON': 1.14,
+    'PC': 1.20,
+}
+DEFAULT_DENSITY = 1.24
+DEFAULT_DIAMETER = 1.75
+
+
+def filament_grams(length_mm, density=None, diameter=None):
+    """Масса нити длиной length_mm, г"""
+    radius = (diameter or DEFAULT_DIAMETER) / 2
+    volume_cm3 = math.pi * radius * radius * length_mm / 1000
+    return volume_cm3 * (density or DEFAULT_DENSITY)
+
+
+class FilamentAccountant:
+    # Поля Moonraker, которые нужны для учета расхода
+    FIELDS = {'print_stats': ['state', 'filament_used']}
+
+    def __init__(self, db, store, flush_interval=30.0, low_stock_margin=0.0, on_low_stock=None,
+                 on_stock_restored=None):
+        self.db = db
+        self.store = store
+        self.flush_interval = flush_interval
+        self.low_stock_margin = low_stock_margin
+        # on_low_stock(coil_id, forecast) вызывается, когда прогноз остатка опускается ниже порога
+        self.on_low_stock = on_low_stock
+        # on_stock_restored(coil_id, forecast) - прогноз снова выше порога (катушку пополнили, задачи сняли)
+        self.on_stock_restored = on_stock_restored
+
+        self._lock = threading.Lock()
+        # printer_id -> последнее значение filament_used, мм, и print_stats.state
+        self._last_used = {}
+        self._print_states = {}
+        # printer_id -> [task_id, coil_id, material_amount, израсходовано г]
+        self._active = {}
+        # printer_id -> катушка, заправленная вручную (приоритетнее катушки задачи)
+        self._loaded = {}
+        # coil_id -> накопленная длина к списанию, мм
+        self._pending_mm = {}
+        # coil_id -> {remains, material, density, diameter}
+        self._coils = {}
+        # Задачи в очереди: task_id -> (coil_id, material_amount) и суммы по катушкам
+        self._queued_tasks = {}
+        self._queued_demand = {}
+        # Наибольший известный id задачи: более новые задачи дочитываются из базы
+        self._last_task_id = 0
+        # Катушки, по которым уже выдано предупреждение
+        self.low_stock = {}
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Загружает остатки катушек и очередь задач один раз, дальше - только инкременты"""
+        self._coils = self.db.get_coil_stock()
+        for row in self.db.iter_tasks(status='queued', columns=['coil_id', 'material_amount']):
+            self.task_queued(row['id'], row['coil_id'], row['material_amount'])
+        self.db.subscribe_tasks(self.on_task_change)
+        self.store.subscribe(self.on_state_change)
+        self._thread = threading.Thread(target=self._run, name='filament-accounting', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.store.unsubscribe(self.on_state_change)
+        self.db.unsubscribe_tasks(self.on_task_change)
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def load_coil(self, printer_id, coil_id):
+        """Указывает, какая катушка заправлена в принтер"""
+        with self._lock:
+            if coil_id is None:
+                self._loaded.pop(printer_id, None)
+            else:
+                self._loaded[printer_id] = coil_id
+        self._load_coil_stock(coil_id)
+
+    def _load_coil_stock(self, coil_id):
+        """Подгружает катушку, которой еще нет в кеше; запрос к базе - вне блокировки"""
+        with self._lock:
+            if coil_id is None or coil_id in self._coils:
+                return
+        stock = self.db.get_coil_stock([coil_id])
+        with self._lock:
+            for stock_id, coil in stock.items():
+                # Пока шел запрос, катушку могли загрузить и уже списать с нее расход
+                self._coils.setdefault(stock_id, coil)
+
+    def task_queued(self, task_id, coil_id, material_amount):
+        """Учитывает новую задачу в очереди в прогнозе остатка катушки"""
+        with self._lock:
+            self._last_task_id = max(self._last_task_id, task_id)
+        if coil_id is None:
+            return
+        amount = material_amount or 0.0
+        with self._lock:
+            if task_id in self._queued_tasks or any(active[0] == task_id for active in self._active.values()):
+                return
+            self._queued_tasks[task_id] = (coil_id, amount)
+            self._queued_demand[coil_id] = self._queued_demand.get(coil_id, 0.0) + amount
+        self._check_stock([coil_id])
+
+    def task_removed(self, task_id):
+        """Убирает задачу из очереди (удалена или отменена до старта)"""
+        with self._lock:
+            coil_id, amount = self._queued_tasks.pop(task_id, (None, 0.0))
+            if coil_id is not None:
+                self._queued_demand[coil_id] -= amount
+        if coil_id is not None:
+            self._check_stock([coil_id])
+
+    def on_task_change(self, task_id, values):
+        """Подписчик DBModel.subscribe_tasks: задача встала в очередь или покинула ее"""
+        with self._lock:
+            self._last_task_id = max(self._last_task_id, task_id)
+        status = values.get('status')
+        if status == 'queued':
+            if 'coil_id' not in values:
+                task = self.db.get_row(Task, task_id, columns=['coil_id', 'material_amount'])
+                if task is None:
+                    return
+                values = task
+            self.task_queued(task_id, values.get('coil_id'), values.get('material_amount'))
+        elif status is not None:
+            self.task_removed(task_id)
+
+    def sync_queue(self):
+        """Дочитывает изменения очереди из других процессов: новые задачи и ушедшие из очереди"""
+        with self._lock:
+            last_id = self._last_task_id
+            known = list(self._queued_tasks)
+        filters = [Task.status == 'queued', Task.id > last_id]
+        for row in self.db.iter_rows(Task, filters, ['coil_id', 'material_amount']):
+            self.task_queued(row['id'], row['coil_id'], row['material_amount'])
+        if known:
+            filters = [Task.id.in_(known), Task.status != 'queued']
+            for row in self.db.iter_rows(Task, filters, ['id']):
+                self.task_removed(row['id'])
+
+    def forecast(self, coil_id):
+        """Прогноз остатка катушки после выполнения очереди, г"""
+        with self._lock:
+            return self._forecast(coil_id)
+
+    def _forecast(self, coil_id):
+        coil = self._coils.get(coil_id)
+        if coil is None or coil['remains'] is None:
+            return None
+        demand = self._queued_demand.get(coil_id, 0.0)
+        for task_id, active_coil, amount, used in self._active.values():
+            if active_coil == coil_id:
+                demand += max(0.0, (amount or 0.0) - used)
+        return coil['remains'] - demand
+
+    def on_state_change(self, printer_id, delta, state):
+        print_stats = delta.get('print_stats')
+        if not print_stats:
+            return
+        new_state = print_stats.get('state')
+        starting = finished = False
+        if new_state is not None:
+            with self._lock:
+                if new_state != self._print_states.get(printer_id):
+                    self._print_states[printer_id] = new_state
+                    starting = new_state == 'printing' and printer_id not in self._active
+                    finished = new_state in ('complete', 'error', 'cancelled', 'standby')
+        if starting:
+            # Обращение к базе только при старте печати
+            self._start_task(printer_id)
+
+        # Дельта окончания печати может нести и последний прирост filament_used:
+        # он списывается до того, как активная задача снята
+        used = print_stats.get('filament_used')
+        if used is not None:
+            self._count_used(printer_id, used)
+        if finished:
+            with self._lock:
+                self._active.pop(printer_id, None)
+
+    def _count_used(self, printer_id, used):
+        with self._lock:
+            last = self._last_used.get(printer_id)
+            self._last_used[printer_id] = used
+            if last is None:
+                # Первое наблюдение: то, что напечатано раньше, уже не учесть
+                return
+            # Счетчик уменьшился - началась новая печать
+            length = used - last if used >= last else used
+            if length <= 0:
+                return
+            coil_id = self._loaded.get(printer_id)
+            active = self._active.get(printer_id)
+            if coil_id is None and active is not None:
+                coil_id = active[1]
+            if coil_id is None:
+                return
+            self._pending_mm[coil_id] = self._pending_mm.get(coil_id, 0.0) + length
+
+    def _start_task(self, printer_id):
+        task_id = self.db.find_task_for_printer(printer_id)
+        if task_id is None:
+            return
+        task = self.db.get_row(Task, task_id, columns=['coil_id', 'material_amount'])
+        if task is None:
+            return
+        coil_id, amount = task['coil_id'], task['material_amount']
+        with self._lock:
+            queued = self._queued_tasks.pop(task_id, None)
+            if queued is not None:
+                self._queued_demand[queued[0]] -= queued[1]
+            self._active[printer_id] = [task_id, coil_id, amount, 0.0]
+        self._load_coil_stock(coil_id)
+
+    def flush(self):
+        """Списывает накопленный расход с катушек одной пачкой"""
+        with self._lock:
+            pending, self._pending_mm = self._pending_mm, {}
+            grams_by_coil = {}
+            for coil_id, length in pending.items():
+                coil = self._coils.get(coil_id)
+                if coil is None:
+                    continue
+                density = coil['density'] or DEFAULT_DENSITIES.get((coil['material'] or '').upper())
+                grams = filament_grams(length, density, coil['diameter'])
+                grams_by_coil[coil_id] = grams
+                if coil['remains'] is not None:
+                    coil['remains'] -= grams
+                for active in self._active.values():
+                    if active[1] == coil_id:
+                        active[3] += grams
+        if grams_by_coil:
+            self.db.consume_coils(grams_by_coil)
+            self._check_stock(grams_by_coil)
+        return grams_by_coil
+
+    def _check_stock(self, coil_ids):
+        alerts, restored = [], []
+        with self._lock:
+            for coil_id in coil_ids:
+                forecast = self._forecast(coil_id)
+                if forecast is None:
+                    continue
+                if forecast < self.low_stock_margin:
+                    if coil_id not in self.low_stock:
+                        alerts.append((coil_id, forecast))
+                    self.low_stock[coil_id] = forecast
+                elif self.low_stock.pop(coil_id, None) is not None:
+                    restored.append((coil_id, forecast))
+        for coil_id, forecast in alerts:
+            log.warning("Мало филамента на катушке %s: прогноз остатка %.1f г", coil_id, forecast,
+                        extra={"coil_id": coil_id, "forecast": forecast})
+            if self.on_low_stock:
+                self.on_low_stock(coil_id, forecast)
+        for coil_id, forecast in restored:
+            if self.on_stock_restored:
+                self.on_stock_restored(coil_id, forecast)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                self.sync_queue()
+            except Exception as e:
+                log.exception("Ошибка учета филамента")
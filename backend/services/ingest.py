@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Процесс сбора данных с принтеров парка.
+
+Опрашивает Moonraker каждого принтера (или держит подписки WebSocket, см.
+ws_hub.py), складывает состояние в PrinterStateStore, ведет отложенную запись
+прогресса задач и учет филамента в базе, проверяет правила оповещений
+(alerts.py) и публикует снимок состояния в общий файл, откуда его читают
+HTTP-воркеры веб-интерфейса.
+В режиме разработки web_interface.py запускает этот же сбор у себя в процессе.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import os
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.services import json_codec, logs, metrics, profiler, tracing
+from backend.services.alerts import AlertEngine, load_rules
+from backend.services.fanout import StatusFanout
+from backend.services.state_store import DashboardPresence, PrinterStateStore, StateFileWriter, DEFAULT_STATE_FILE
+
+log = logs.get_logger("ingest")
+
+# Поля объектов Moonraker: {объект: [поля] или None - все поля объекта}.
+# По webhooks.state определяется готовность Klippy, эти поля нужны всегда
+READY_FIELDS = {"webhooks": ["state"]}
+# Список принтеров (/api/printers, build_printer)
+FLEET_FIELDS = {"virtual_sdcard": ["progress"]}
+# Панель управления принтером (/api/state, build_state)
+PRINTER_FIELDS = {
+    "print_stats": ["state"],
+    "extruder": ["temperature", "target"],
+    "heater_bed": ["temperature", "target"],
+    "toolhead": ["position"],
+}
+
+# Принтер по умолчанию, если не удалось найти ни одного в сети
+DEFAULT_PRINTER_HOST = "172.22.112.68"
+DEFAULT_PRINTER_PORT = 7125
+
+POLL_REQUEST_SECONDS = metrics.histogram("printers_poll_request_seconds",
+                                         "Длительность запроса printer/objects/query одного принтера")
+POLL_CYCLE_SECONDS = metrics.histogram("printers_poll_cycle_seconds", "Длительность цикла опроса всех принтеров")
+POLL_ERRORS = metrics.counter("printers_poll_errors_total", "Ошибки опроса принтеров")
+
+
+def merge_fields(*declarations):
+    """Объединение объявлений полей {объект: [поля] или None}"""
+    merged = {}
+    for fields in declarations:
+        for name, names in fields.items():
+            if name in merged and merged[name] is None:
+                continue
+            if names is None:
+                merged[name] = None
+            else:
+                merged[name] = sorted(set(merged.get(name) or ()) | set(names))
+    return merged
+
+
+# Все поля веб-интерфейса
+API_FIELDS = merge_fields(READY_FIELDS, FLEET_FIELDS, PRINTER_FIELDS)
+
+
+def objects_query(objects):
+    """Строка запроса printer/objects/query: объект или объект=поле1,поле2"""
+    return "&".join(name if names is None else f"{name}={','.join(names)}"
+                    for name, names in objects.items())
+
+
+class PrinterPoller:
+    """Периодический опрос списка принтеров с ограниченным параллелизмом"""
+
+    def __init__(self, store, printers, interval=1.0, info_interval=30.0, max_workers=16, timeout=5,
+                 objects=None):
+        self.store = store
+        # printer_id -> (host, port)
+        self.printers = dict(printers)
+        # Запрашиваются только нужные поля, а не объекты целиком
+        self.query = objects_query(objects or API_FIELDS)
+        self.interval = interval
+        self.info_interval = info_interval
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                              thread_name_prefix="poller")
+        self._info_polled = {}
+        # Принтеры, опрос которых сейчас не проходит: ошибка пишется в журнал один раз, а не каждый цикл
+        self._failing = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="printer-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.executor.shutdown(wait=False)
+
+    def add_printer(self, printer_id, host, port):
+        self.printers[printer_id] = (host, port)
+
+    def remove_printer(self, printer_id):
+        self.printers.pop(printer_id, None)
+
+    def _get(self, base_url, endpoint):
+        with tracing.span("moonraker.request", url=base_url, endpoint=endpoint.partition("?")[0]):
+            response = self.session.get(f"{base_url}/{endpoint}", timeout=self.timeout)
+            response.raise_for_status()
+            return json_codec.loads(response.content)["result"]
+
+    def poll_printer(self, printer_id):
+        host, port = self.printers[printer_id]
+        base_url = f"http://{host}:{port}"
+        meta = {"host": host, "port": port}
+        try:
+            with tracing.span("poll.printer", printer=printer_id):
+                started = time.perf_counter()
+                status = self._get(base_url, "printer/objects/query?" + self.query)["status"]
+                POLL_REQUEST_SECONDS.observe(time.perf_counter() - started)
+
+                # Сведения о принтере меняются редко и опрашиваются реже
+                now = time.monotonic()
+                if now - self._info_polled.get(printer_id, 0) >= self.info_interval:
+                    printer_info = self._get(base_url, "printer/info")
+                    server_info = self._get(base_url, "server/info")
+                    meta.update(hostname=printer_info.get("hostname"), model=printer_info.get("model"),
+                                software_version=printer_info.get("software_version"),
+                                moonraker_version=server_info.get("moonraker_version"))
+                    self._info_polled[printer_id] = now
+
+                meta.update(online=True, klippy_state=status.get("webhooks", {}).get("state"))
+                status["meta"] = meta
+                self.store.apply(printer_id, status)
+            if printer_id in self._failing:
+                self._failing.discard(printer_id)
+                log.info("Принтер снова отвечает", extra={"printer_id": printer_id, "host": host, "port": port})
+        except Exception as e:
+            POLL_ERRORS.inc()
+            level = logging.DEBUG if printer_id in self._failing else logging.WARNING
+            self._failing.add(printer_id)
+            log.log(level, "Ошибка при обновлении состояния принтера: %s", e,
+                    extra={"printer_id": printer_id, "host": host, "port": port})
+            meta["online"] = False
+            self.store.apply(printer_id, {"meta": meta})
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            list(self.executor.map(self.poll_printer, list(self.printers)))
+            POLL_CYCLE_SECONDS.observe(time.monotonic() - started)
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+class DashboardFields:
+    """Объявляет в WebSocketHub поля открытых панелей веб-интерфейса.
+
+    Панели отмечаются HTTP-воркерами в DashboardPresence; раз в interval
+    секунд отметки перечитываются и объявления продлеваются на оставшийся срок
+    отметки. Панель "fleet" - список принтеров, "printer-<id>" - панель
+    управления одним принтером.
+    """
+
+    def __init__(self, hub, presence, interval=1.0):
+        self.hub = hub
+        self.presence = presence
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def panel_fields(self, name):
+        """(поля, принтеры или None - все) панели; None, если панель неизвестна"""
+        if name == "fleet":
+            return FLEET_FIELDS, None
+        if name.startswith("printer-"):
+            printer_id = next((printer_id for printer_id in list(self.hub.printers)
+                               if str(printer_id) == name[len("printer-"):]), None)
+            if printer_id is not None:
+                return PRINTER_FIELDS, [printer_id]
+        return None
+
+    def refresh(self):
+        for name, left in self.presence.active().items():
+            panel = self.panel_fields(name)
+            if panel is not None:
+                fields, printers = panel
+                self.hub.subscribe_fields(f"dashboard:{name}", fields, printers, ttl=left)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="dashboard-fields", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                log.exception("Ошибка чтения отметок панелей")
+            self._stop.wait(self.interval)
+
+
+class Ingest:
+    """Сбор данных: опрос принтеров, запись в базу и публикация снимка состояния"""
+
+    def __init__(self, printers, store=None, db=None, state_file=None, interval=1.0, transport="poll",
+                 alert_rules=None):
+        self.store = store or PrinterStateStore()
+        self.db = db
+        # Потребители получают изменения прореженными, а не с частотой Moonraker
+        self.fanout = StatusFanout(self.store)
+        self.alerts = AlertEngine(self.fanout, alert_rules)
+        self.components = [self.alerts]
+        if db is not None:
+            # Импорт здесь, чтобы процесс без базы не тянул SQLAlchemy
+            from backend.services.task_progress import TaskProgressWriter
+            from backend.services.filament_accounting import FilamentAccountant
+            accountant = FilamentAccountant(
+                db, self.fanout,
+                on_low_stock=lambda coil_id, forecast: self.alerts.trigger(
+                    "filament_low", f"coil:{coil_id}",
+                    f"Мало филамента на катушке {coil_id}: прогноз остатка {forecast:.1f} г"),
+                on_stock_restored=lambda coil_id, forecast: self.alerts.clear("filament_low", f"coil:{coil_id}"))
+            self.components += [TaskProgressWriter(db, self.fanout), accountant]
+
+        # Компоненты объявляют в FIELDS, какие поля им нужны, сверх полей веб-интерфейса
+        consumers = [component for component in self.components if hasattr(component, "FIELDS")]
+        if transport == "websocket":
+            # Подписки Moonraker всех принтеров на одном цикле asyncio вместо опроса
+            from backend.services.ws_hub import WebSocketHub
+            # Со снимком в файле панели открываются в других процессах и объявляют
+            # свои поля через отметки; без него веб-интерфейсу нужны все поля всегда
+            self.source = WebSocketHub(self.store, printers, objects=READY_FIELDS if state_file else None)
+            for component in consumers:
+                self.source.subscribe_fields(component, component.FIELDS)
+            if state_file:
+                self.components.append(DashboardFields(self.source, DashboardPresence(state_file)))
+        else:
+            objects = merge_fields(API_FIELDS, *(component.FIELDS for component in consumers))
+            self.source = PrinterPoller(self.store, printers, interval=interval, objects=objects)
+
+        if state_file:
+            self.components.append(StateFileWriter(self.store, state_file, notifier=self.fanout))
+        # Раздача останавливается первой и успевает доставить остаток компонентам
+        self.components.append(self.fanout)
+
+        # Внутренние метрики сбора; состояние принтеров экспортирует тот, кто отдает /metrics
+        self.collectors = [metrics.fanout_metrics(self.fanout), metrics.alert_metrics(self.alerts)]
+        if transport == "websocket":
+            self.collectors.append(metrics.hub_metrics(self.source))
+        if db is not None:
+            self.collectors.append(metrics.write_queue_metrics(db.writer))
+
+    def start(self):
+        for component in self.components:
+            component.start()
+        self.source.start()
+        for collector in self.collectors:
+            metrics.REGISTRY.register(collector)
+
+    def stop(self):
+        for collector in self.collectors:
+            metrics.REGISTRY.unregister(collector)
+        self.source.stop()
+        for component in reversed(self.components):
+            component.stop()
+        if self.db is not None:
+            self.db.close()
+
+
+def discover_printers(hosts=None, port=DEFAULT_PRINTER_PORT, cache_file=None):
+    """Принтеры {printer_id: (host, port)}: явно заданные хосты или найденные в сети.
+
+    Хост можно задать вместе с портом (host:port), например для имитатора moonraker_sim.py.
+    Без хостов сначала проверяются принтеры из кеша поиска (discovery/cache.py),
+    и только если никто из них не ответил - сканируются подсети. Возвращает
+    (принтеры, досмотр): досмотр - незапущенный BackgroundSweep остальных
+    адресов или None.
+    """
+    if not hosts:
+        from discovery.cache import PrinterCache, discover
+        printers, sweep = discover(PrinterCache(cache_file) if cache_file else None, port)
+        return printers or {1: (DEFAULT_PRINTER_HOST, port)}, sweep
+    printers = {}
+    for printer_id, host in enumerate(hosts, start=1):
+        name, _, host_port = host.rpartition(":")
+        printers[printer_id] = (name, int(host_port)) if name and host_port.isdigit() else (host, port)
+    return printers, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сбор данных с принтеров для веб-интерфейса")
+    parser.add_argument("--host", action="append",
+                        help="Хост Moonraker или хост:порт (можно несколько; по умолчанию - поиск в сети)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PRINTER_PORT, help="Порт Moonraker (по умолчанию: 7125)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Интервал опроса в секундах (по умолчанию: 1)")
+    parser.add_argument("--websocket", action="store_true",
+                        help="Получать обновления по подпискам WebSocket вместо HTTP-опроса")
+    parser.add_argument("--state-file", default=os.environ.get("PRINTERS_STATE_FILE", DEFAULT_STATE_FILE),
+                        help=f"Файл общего снимка состояния (по умолчанию: {DEFAULT_STATE_FILE})")
+    parser.add_argument("--discovery-cache", help="Файл кеша найденных принтеров "
+                                                  "(по умолчанию: ~/.printers_base/discovered_printers.json)")
+    parser.add_argument("--no-db", action="store_true", help="Не писать прогресс задач и расход филамента в базу")
+    parser.add_argument("--alert-rules", help="JSON-файл с правилами оповещений (по умолчанию - встроенные)")
+    parser.add_argument("--metrics-port", type=int, default=os.environ.get("PRINTERS_METRICS_PORT"),
+                        help="Порт HTTP-сервера /metrics для Prometheus (по умолчанию не запускается)")
+    args = parser.parse_args()
+    logs.setup_logging()
+
+    db = None
+    if not args.no_db:
+        from backend.db.data_model import DBModel
+        db = DBModel()
+
+    if tracing.configure_from_env("printers-ingest"):
+        log.info("Трассировка включена (PRINTERS_TRACE_FILE / PRINTERS_TRACE_OTLP)")
+    printers, sweep = discover_printers(args.host, args.port, args.discovery_cache)
+    ingest = Ingest(printers, db=db, state_file=args.state_file,
+                    interval=args.interval, transport="websocket" if args.websocket else "poll",
+                    alert_rules=load_rules(args.alert_rules) if args.alert_rules else None)
+    log.info("Сбор данных с %d принтеров, снимок состояния: %s", len(ingest.source.printers), args.state_file)
+    ingest.start()
+    if sweep is not None:
+        # Принтеры, найденные досмотром сети, подключаются к сбору на ходу
+        sweep.on_found = ingest.source.add_printer
+        sweep.start()
+    metrics_server = None
+    if args.metrics_port:
+        metrics.REGISTRY.register(metrics.printer_metrics(ingest.store))
+        routes = {"/debug/profile": profiler.handle_request} if profiler.enabled() else None
+        metrics_server = metrics.MetricsServer(port=args.metrics_port, routes=routes)
+        metrics_server.start()
+        log.info("Метрики: http://0.0.0.0:%s/metrics", args.metrics_port)
+        if routes:
+            log.info("Профиль: http://0.0.0.0:%s/debug/profile?seconds=10", args.metrics_port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        log.info("Остановка сбора данных...")
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        if sweep is not None:
+            sweep.stop()
+        ingest.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Быстрый JSON-кодек для кадров Moonraker, снимков состояния и ответов API.
+
+Использует orjson, если он установлен, иначе - стандартный json с тем же
+поведением: dataclass-объекты и datetime сериализуются, dumps возвращает bytes.
+"""
+
+import dataclasses
+import json
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Ошибка разбора JSON для обоих вариантов (orjson.JSONDecodeError - ее подкласс)
+JSONDecodeError = json.JSONDecodeError
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _default(obj):
+    if dataclasses.is_dataclass(obj):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    raise TypeError(f"Объект типа {type(obj).__name__} не сериализуется в JSON")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def loads(data):
+        """Разбирает JSON из str или bytes"""
+        return orjson.loads(data)
+
+    def dumps(obj):
+        """Сериализует объект в JSON (bytes, UTF-8)"""
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def loads(data):
+        """Разбирает JSON из str или bytes"""
+        return json.loads(data)
+
+    def dumps(obj):
+        """Сериализует объект в JSON (bytes, UTF-8)"""
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj):
+    """Сериализует объект в JSON-строку"""
+    return dumps(obj).decode("utf-8")
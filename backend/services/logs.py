@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Структурированный журнал сервисов вместо print().
+
+Записи уходят в ограниченную очередь (BoundedQueueHandler), а в stderr или
+файл их пишет отдельный поток (QueueListener): поток сбора данных не ждет
+терминал и диск. Когда очередь полна, новые записи ниже WARNING
+отбрасываются, а предупреждения и ошибки вытесняют самые старые записи;
+число потерянных записей попадает в журнал, как только он разгрузится.
+
+Записи о конкретном принтере несут его id, хост и порт (printer_logger) -
+в текстовом выводе это префикс, в JSON - отдельные поля.
+
+Настройка - setup_logging() или переменные окружения:
+    PRINTERS_LOG_LEVEL=INFO - общий уровень;
+    PRINTERS_LOG_LEVELS=ws_hub=DEBUG,alerts=WARNING - уровни отдельных модулей;
+    PRINTERS_LOG_FORMAT=json - JSON Lines вместо цветного текста;
+    PRINTERS_LOG_BUFFER=10000 - размер очереди записей.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+
+from backend.services import json_codec
+
+ROOT = "printers"
+DEFAULT_BUFFER = 10000
+
+# Цвета и подписи уровней - как у прежних print_colored
+_COLORS = {
+    logging.DEBUG: ("\033[96m", "ОТЛАДКА"),
+    logging.INFO: ("\033[94m", "ИНФО"),
+    logging.WARNING: ("\033[93m", "ВНИМАНИЕ"),
+    logging.ERROR: ("\033[91m", "ОШИБКА"),
+    logging.CRITICAL: ("\033[91m", "АВАРИЯ"),
+}
+_RESET = "\033[0m"
+
+# Стандартные атрибуты LogRecord; все остальные - поля, переданные через extra
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+_PRINTER_FIELDS = ("printer_id", "host", "port")
+
+_setup_lock = threading.Lock()
+_listener = None
+_handler = None
+
+
+def get_logger(name):
+    """Журнал модуля: get_logger("ws_hub") -> printers.ws_hub"""
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+class PrinterLogger(logging.LoggerAdapter):
+    """Журнал с контекстом принтера; поля extra вызова дополняют контекст"""
+
+    def process(self, msg, kwargs):
+        extra = kwargs.get("extra")
+        kwargs["extra"] = {**self.extra, **extra} if extra else self.extra
+        return msg, kwargs
+
+
+def printer_logger(logger, printer_id=None, host=None, port=None):
+    context = {"printer_id": printer_id, "host": host, "port": port}
+    return PrinterLogger(logger, {key: value for key, value in context.items() if value is not None})
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS}
+
+
+class TextFormatter(logging.Formatter):
+    """Время, уровень, принтер и сообщение; цвет - только на терминале"""
+
+    def __init__(self, color=False):
+        super().__init__()
+        self.color = color
+
+    def format(self, record):
+        color, label = _COLORS.get(record.levelno, ("", record.levelname))
+        prefix = f"{color}[{label}]{_RESET}" if self.color else f"[{label}]"
+        fields = _fields(record)
+        where = []
+        if "printer_id" in fields:
+            where.append(f"#{fields['printer_id']}")
+        if "host" in fields:
+            where.append(f"{fields['host']}:{fields['port']}" if "port" in fields else fields["host"])
+        where = f"[{' '.join(where)}] " if where else ""
+        time = datetime.fromtimestamp(record.created).strftime("%H:%M:%S.%f")[:-3]
+        line = f"{time} {prefix} {record.name.removeprefix(ROOT + '.')}: {where}{record.getMessage()}"
+        if record.exc_text:
+            line = f"{line}\n{record.exc_text}"
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON: время, уровень, модуль, сообщение и поля extra"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json_codec.dumps(entry).decode("utf-8")
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Кладет записи в ограниченную очередь и никогда не блокирует вызывающий поток"""
+
+    def __init__(self, maxsize=DEFAULT_BUFFER):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Сообщение подставляется сразу: аргументы (словари состояния) могут измениться до записи
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if record.levelno >= logging.WARNING:
+            # Важная запись вытесняет самую старую
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+                self.queue.put_nowait(record)
+                return
+            except (queue.Empty, queue.Full):
+                pass
+        self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    """Пишет записи из очереди и сообщает о потерянных при переполнении"""
+
+    def __init__(self, handler, *handlers):
+        super().__init__(handler.queue, *handlers, respect_handler_level=True)
+        self.source = handler
+        self.reported = 0
+
+    def handle(self, record):
+        dropped = self.source.dropped
+        if dropped != self.reported and self.queue.empty():
+            lost = dropped - self.reported
+            self.reported = dropped
+            super().handle(logging.makeLogRecord({
+                "name": f"{ROOT}.logs", "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"Журнал не успевал: потеряно записей - {lost}", "dropped": lost}))
+        super().handle(record)
+
+    def enqueue_sentinel(self):
+        # Базовый put_nowait падает с queue.Full на полной очереди: сначала
+        # даем писателю ее разгрузить, а если он не успевает - вытесняем старые записи
+        try:
+            self.queue.put(self._sentinel, timeout=1.0)
+            return
+        except queue.Full:
+            pass
+        while True:
+            try:
+                self.queue.put_nowait(self._sentinel)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.source.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+def _parse_levels(spec):
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.strip().partition("=")
+        if name and level:
+            levels[name] = level.upper()
+    return levels
+
+
+def setup_logging(level=None, fmt=None, levels=None, buffer=None, stream=None):
+    """Подключает журнал printers.* к фоновому писателю; повторный вызов ничего не делает.
+
+    level - общий уровень, fmt - "text" или "json", levels - {модуль: уровень},
+    buffer - размер очереди записей, stream - поток вывода (по умолчанию stderr).
+    Параметры, не заданные явно, берутся из переменных окружения PRINTERS_LOG_*.
+    """
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            return _handler
+        level = (level or os.environ.get("PRINTERS_LOG_LEVEL") or "INFO").upper()
+        fmt = fmt or os.environ.get("PRINTERS_LOG_FORMAT") or "text"
+        levels = levels if levels is not None else _parse_levels(os.environ.get("PRINTERS_LOG_LEVELS"))
+        buffer = buffer or int(os.environ.get("PRINTERS_LOG_BUFFER", DEFAULT_BUFFER))
+        stream = stream or sys.stderr
+
+        output = logging.StreamHandler(stream)
+        if fmt == "json":
+            output.setFormatter(JSONFormatter())
+        else:
+            output.setFormatter(TextFormatter(color=getattr(stream, "isatty", lambda: False)()))
+
+        root = logging.getLogger(ROOT)
+        root.setLevel(level)
+        root.propagate = False
+        for name, module_level in levels.items():
+            get_logger(name).setLevel(module_level)
+
+        _handler = BoundedQueueHandler(buffer)
+        root.addHandler(_handler)
+        _listener = _Listener(_handler, output)
+        _listener.start()
+        atexit.register(shutdown)
+        return _handler
+
+
+def shutdown():
+    """Дописывает очередь и останавливает фоновый писатель"""
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is None:
+            return
+        # Сначала отключаем обработчик, чтобы очередь больше не пополнялась
+        logging.getLogger(ROOT).removeHandler(_handler)
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+Счетчики и гистограммы обновляются на горячем пути без блокировок - это
+сложения над атрибутами под GIL; при одновременных наблюдениях из разных
+потоков может потеряться единичный отсчет, что для метрик допустимо.
+
+Состояние принтеров, очереди и метрики соединений не дублируются в
+счетчиках, а читаются при опросе коллекторами (Registry.register):
+отрисовка /metrics проходит по живому состоянию парка один раз, за
+O(число принтеров), и не берет блокировки хранилища.
+"""
+
+import bisect
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backend.services import logs
+
+log = logs.get_logger("metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы гистограмм задержек по умолчанию, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class MetricFamily:
+    """Метрика с набором отсчетов, которую коллектор строит при каждом опросе"""
+
+    def __init__(self, name, kind, help_text):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        # (суффикс имени, метки, значение)
+        self.samples = []
+
+    def add(self, value, suffix="", **labels):
+        if value is not None:
+            self.samples.append((suffix, labels, value))
+        return self
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for suffix, labels, value in self.samples:
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values):
+        """Дочерняя метрика для значений меток; ее стоит сохранить и обновлять напрямую"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}")
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def __getattr__(self, name):
+        # Методы метрики без меток вызываются прямо на ней: counter.inc(), histogram.observe()
+        if name.startswith("_") or self.labelnames:
+            raise AttributeError(name)
+        return getattr(self._children[()], name)
+
+    def collect(self):
+        family = MetricFamily(self.name, self.kind, self.help)
+        for values, child in list(self._children.items()):
+            child.collect(family, dict(zip(self.labelnames, values)))
+        return [family]
+
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def collect(self, family, labels):
+        family.add(self.value, **labels)
+
+
+class _GaugeValue(_CounterValue):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def collect(self, family, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            family.add(cumulative, "_bucket", **labels, le=_format_value(bound))
+        family.add(self.count, "_bucket", **labels, le="+Inf")
+        family.add(self.sum, "_sum", **labels)
+        family.add(self.count, "_count", **labels)
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeValue()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Повторный импорт модуля или второй экземпляр компонента получает ту же метрику
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def register(self, collector):
+        """collector() -> список MetricFamily, вызывается при каждом опросе"""
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def unregister(self, collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def render(self):
+        with self._lock:
+            sources = [metric.collect for metric in self._metrics.values()] + list(self._collectors)
+        lines = []
+        for collect in sources:
+            try:
+                for family in collect():
+                    family.render(lines)
+            except Exception as e:
+                log.exception("Ошибка сбора метрик")
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+# Обращения к кешам: state_copy - снимки PrinterStateStore, state_file - StateFileReader,
+# http_etag - ответы 304 по ETag
+CACHE_REQUESTS = counter("printers_cache_requests_total", "Обращения к кешам по результату",
+                         ("cache", "result"))
+
+
+# --- коллекторы ---
+
+PRINT_STATES = ("standby", "printing", "paused", "complete", "cancelled", "error")
+KLIPPY_STATES = ("ready", "startup", "shutdown", "error", "disconnected")
+
+
+def printer_metrics(source):
+    """Коллектор состояния парка из PrinterStateStore или StateFileReader.
+
+    source - источник или функция, возвращающая текущий источник.
+    """
+
+    def collect():
+        current = source() if callable(source) else source
+        up = MetricFamily("printer_up", "gauge", "Принтер отвечает (1) или недоступен (0)")
+        info = MetricFamily("printer_info", "gauge", "Сведения о принтере")
+        klippy = MetricFamily("printer_klippy_state", "gauge", "Состояние Klippy (1 - текущее)")
+        temperature = MetricFamily("printer_temperature_celsius", "gauge", "Температура нагревателя")
+        target = MetricFamily("printer_target_temperature_celsius", "gauge", "Целевая температура нагревателя")
+        power = MetricFamily("printer_heater_power_ratio", "gauge", "Мощность нагревателя, 0..1")
+        progress = MetricFamily("printer_print_progress_ratio", "gauge", "Прогресс печати, 0..1")
+        print_state = MetricFamily("printer_print_state", "gauge", "Состояние печати (1 - текущее)")
+        filament = MetricFamily("printer_filament_used_mm", "gauge", "Израсходовано филамента в текущей печати, мм")
+        duration = MetricFamily("printer_print_duration_seconds", "gauge", "Длительность текущей печати")
+
+        for printer_id, state in current.items():
+            printer = str(printer_id)
+            meta = state.meta
+            up.add(bool(meta.get("online")), printer=printer)
+            info.add(1, printer=printer, host=meta.get("host", ""), hostname=meta.get("hostname") or "",
+                     model=meta.get("model") or "", software_version=meta.get("software_version") or "")
+            current_klippy = meta.get("klippy_state")
+            for name in KLIPPY_STATES:
+                klippy.add(current_klippy == name, printer=printer, state=name)
+            for heater in ("extruder", "heater_bed"):
+                obj = getattr(state, heater)
+                temperature.add(obj.temperature, printer=printer, heater=heater)
+                target.add(obj.target, printer=printer, heater=heater)
+                power.add(obj.power, printer=printer, heater=heater)
+            progress.add(state.virtual_sdcard.progress, printer=printer)
+            current_print = state.print_stats.state
+            for name in PRINT_STATES:
+                print_state.add(current_print == name, printer=printer, state=name)
+            filament.add(state.print_stats.filament_used, printer=printer)
+            duration.add(state.print_stats.print_duration, printer=printer)
+        return [up, info, klippy, temperature, target, power, progress, print_state, filament, duration]
+
+    return collect
+
+
+def hub_metrics(hub):
+    """Коллектор соединений WebSocketHub: переподключения, сообщения, задержки, очередь"""
+
+    def collect():
+        health = hub.health()
+        connected = MetricFamily("printers_ws_connected", "gauge", "Соединение WebSocket установлено")
+        reconnects = MetricFamily("printers_ws_reconnects_total", "counter", "Переподключения WebSocket")
+        messages = MetricFamily("printers_ws_messages_total", "counter", "Принятые сообщения WebSocket")
+        received = MetricFamily("printers_ws_received_bytes_total", "counter", "Принятые байты WebSocket")
+        errors = MetricFamily("printers_ws_errors_total", "counter", "Ошибки соединения WebSocket")
+        rtt = MetricFamily("printers_ws_rtt_seconds", "gauge", "Время ответа на последний запрос JSON-RPC")
+        idle = MetricFamily("printers_ws_idle_seconds", "gauge", "Время с последнего сообщения")
+        for printer_id, connection in health["printers"].items():
+            printer = str(printer_id)
+            connected.add(connection["connected"], printer=printer)
+            reconnects.add(connection["reconnects"], printer=printer)
+            messages.add(connection["messages"], printer=printer)
+            received.add(connection["bytes_received"], printer=printer)
+            errors.add(connection["errors"], printer=printer)
+            rtt.add(connection["rtt"], printer=printer)
+            idle.add(connection["idle"], printer=printer)
+        return [
+            connected, reconnects, messages, received, errors, rtt, idle,
+            MetricFamily("printers_ws_queue_depth", "gauge", "Необработанные кадры в очереди хаба")
+            .add(health["queue_depth"]),
+            MetricFamily("printers_ws_dispatch_lag_seconds", "gauge", "Задержка применения последней пачки")
+            .add(health["dispatch_lag"]),
+            MetricFamily("printers_ws_applied_total", "counter", "Изменения, примененные к хранилищу")
+            .add(health["applied"]),
+        ]
+
+    return collect
+
+
+def fanout_metrics(fanout):
+    """Коллектор StatusFanout: очереди потребителей и прореживание"""
+
+    def collect():
+        stats = fanout.stats()
+        pending = MetricFamily("printers_fanout_pending", "gauge", "Принтеры с недоставленными изменениями")
+        calls = MetricFamily("printers_fanout_calls_total", "counter", "Вызовы потребителя")
+        suppressed = MetricFamily("printers_fanout_suppressed_total", "counter",
+                                  "Изменения, придержанные зоной нечувствительности")
+        for consumer in stats["consumers"]:
+            pending.add(consumer["pending"], consumer=consumer["listener"])
+            calls.add(consumer["calls"], consumer=consumer["listener"])
+            suppressed.add(consumer["suppressed"], consumer=consumer["listener"])
+        received = MetricFamily("printers_fanout_received_total", "counter", "Изменения, пришедшие из хранилища")
+        return [received.add(stats["received"]), pending, calls, suppressed]
+
+    return collect
+
+
+def write_queue_metrics(writer):
+    """Коллектор очереди записи в базу (WriteQueue)"""
+
+    def collect():
+        return [
+            MetricFamily("printers_db_queue_depth", "gauge", "Операции в очереди записи").add(writer.queue.qsize()),
+            MetricFamily("printers_db_batches_total", "counter", "Закоммиченные пачки").add(writer.batches),
+            MetricFamily("printers_db_operations_total", "counter", "Записанные операции").add(writer.committed),
+            MetricFamily("printers_db_failed_total", "counter", "Операции, которые не удалось записать")
+            .add(writer.failed),
+        ]
+
+    return collect
+
+
+def alert_metrics(engine):
+    """Коллектор активных оповещений AlertEngine"""
+
+    def collect():
+        active = MetricFamily("printers_alerts_active", "gauge", "Активные оповещения")
+        counts = {}
+        for alert in list(engine.active.values()):
+            key = (alert.rule, alert.severity)
+            counts[key] = counts.get(key, 0) + 1
+        for (rule, severity), count in sorted(counts.items()):
+            active.add(count, rule=rule, severity=severity)
+        return [active, MetricFamily("printers_alert_evaluations_total", "counter", "Вычисления правил оповещений")
+                .add(engine.evaluations)]
+
+    return collect
+
+
+class MetricsServer:
+    """HTTP-сервер /metrics для процессов без веб-интерфейса (ingest.py --metrics-port).
+
+    routes - дополнительные пути {путь: функция(параметры запроса) -> (статус, текст)}.
+    """
+
+    def __init__(self, registry=REGISTRY, host="0.0.0.0", port=9105, routes=None):
+        registry_ = registry
+        routes_ = dict(routes or {})
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, _, query = self.path.partition("?")
+                if path in routes_:
+                    status, text = routes_[path](dict(urllib.parse.parse_qsl(query)))
+                    content_type = "text/plain; charset=utf-8"
+                elif path == "/metrics":
+                    status, text, content_type = 200, registry_.render(), CONTENT_TYPE
+                else:
+                    self.send_error(404)
+                    return
+                body = text.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread:
+            self._thread.join()
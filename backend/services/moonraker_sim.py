@@ -0,0 +1,715 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Имитатор Moonraker для нагрузочных и автономных проверок без принтеров.
+
+Поднимает N имитируемых принтеров на localhost, каждый на своем порту, с
+теми HTTP-методами и JSON-RPC по WebSocket, которыми пользуется проект:
+server.info, printer.info, запрос и подписка на объекты, G-code, печать,
+список, метаданные и загрузка файлов. Нагреватели греются и остывают с
+инерцией и шумом, печать начинается после прогрева и двигает
+file_position, прогресс, слои и расход филамента.
+
+Для проверки оповещений есть команда SIM_FAULT TYPE=heater|stall|shutdown|clear.
+
+Пример:
+    python backend/services/moonraker_sim.py --count 50 --port 17125 --printing 0.5 --speed 10
+    python backend/services/ingest.py --no-db --websocket --host 127.0.0.1:17125 --host 127.0.0.1:17126
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.services import json_codec
+
+AMBIENT_TEMPERATURE = 22.0
+
+# Файлы, которые есть на каждом имитируемом принтере: имя -> (размер, время печати с,
+# филамент мм, высота слоя, высота модели, температуры первого слоя экструдера и стола)
+SAMPLE_FILES = {
+    "calibration_cube.gcode": (420_000, 1500, 1800.0, 0.2, 20.0, 210.0, 60.0),
+    "benchy.gcode": (2_600_000, 5400, 5200.0, 0.2, 48.0, 215.0, 60.0),
+    "petg_bracket.gcode": (1_300_000, 3600, 4100.0, 0.25, 30.0, 240.0, 80.0),
+}
+
+_GCODE_PARAM = re.compile(r"([A-Z_]+)=(\S+)|([A-Z])(-?[\d.]+)", re.I)
+_FIRST_TEMPERATURE = re.compile(rb"^M10[49]\s+S(\d+(?:\.\d+)?)", re.M)
+_FIRST_BED_TEMPERATURE = re.compile(rb"^M1[49]0\s+S(\d+(?:\.\d+)?)", re.M)
+
+
+class SimulatorError(Exception):
+    """Ошибка метода имитатора; code - HTTP-статус и код ошибки JSON-RPC"""
+
+    def __init__(self, message, code=400):
+        super().__init__(message)
+        self.code = code
+
+
+def parse_gcode(line):
+    """Команда G-code и ее параметры: 'M104 S210' -> ('M104', {'S': '210'})"""
+    parts = line.split(None, 1)
+    command = parts[0].upper()
+    params = {}
+    if len(parts) > 1:
+        for key, value, letter, number in _GCODE_PARAM.findall(parts[1]):
+            if key:
+                params[key.upper()] = value
+            else:
+                params[letter.upper()] = number
+    return command, params
+
+
+class Heater:
+    """Нагреватель первого порядка: T' = (окружающая + мощность * rise - T) / tau"""
+
+    def __init__(self, rise, tau, noise, gain):
+        self.rise = rise
+        self.tau = tau
+        self.noise = noise
+        self.gain = gain
+
+    def step(self, temperature, target, dt, rng, failed=False):
+        """Новые (температура, мощность) через dt секунд"""
+        # При ускоренном времени регулятор пересчитывается не реже раза в секунду, иначе он раскачивается
+        steps = max(1, math.ceil(dt))
+        for _ in range(steps):
+            power = 0.0
+            if target > 0 and not failed:
+                # Прямая связь на установившуюся мощность плюс пропорциональная поправка
+                power = min(1.0, max(0.0, (target - AMBIENT_TEMPERATURE) / self.rise
+                                     + (target - temperature) * self.gain))
+            temperature += ((AMBIENT_TEMPERATURE + power * self.rise - temperature)
+                            * (1 - math.exp(-dt / steps / self.tau)))
+        return temperature + rng.gauss(0, self.noise), power
+
+
+EXTRUDER_HEATER = Heater(rise=300.0, tau=80.0, noise=0.08, gain=0.1)
+BED_HEATER = Heater(rise=120.0, tau=240.0, noise=0.04, gain=0.2)
+
+
+class SimulatedPrinter:
+    """Состояние и поведение одного имитируемого принтера Klipper/Moonraker"""
+
+    def __init__(self, index, port, seed=None, repeat=True):
+        self.index = index
+        self.port = port
+        self.hostname = f"sim-printer-{index}"
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+        self.clock = 0.0
+        self.files = {name: self._sample_file(name, *values) for name, values in SAMPLE_FILES.items()}
+        self.faults = set()
+        # События для подключенных клиентов: (метод уведомления, параметры)
+        self.events = []
+        self._changed = {}
+        self._heated = False
+        self._idle_since = None
+        self._phase = self.rng.uniform(0, 2 * math.pi)
+
+        ambient = round(AMBIENT_TEMPERATURE + self.rng.uniform(-1, 1), 2)
+        self.status = {
+            "webhooks": {"state": "ready", "state_message": "Printer is ready"},
+            "print_stats": {"filename": "", "total_duration": 0.0, "print_duration": 0.0, "filament_used": 0.0,
+                            "state": "standby", "message": "", "info": {"total_layer": None, "current_layer": None}},
+            "virtual_sdcard": {"file_path": None, "progress": 0.0, "is_active": False, "file_position": 0,
+                               "file_size": 0},
+            "extruder": {"temperature": ambient, "target": 0.0, "power": 0.0, "can_extrude": False,
+                         "pressure_advance": 0.04, "smooth_time": 0.04},
+            "heater_bed": {"temperature": ambient, "target": 0.0, "power": 0.0},
+            "toolhead": {"homed_axes": "", "print_time": 0.0, "estimated_print_time": 0.0,
+                         "position": [0.0, 0.0, 0.0, 0.0], "max_velocity": 300.0, "max_accel": 3000.0,
+                         "axis_minimum": [0.0, 0.0, 0.0, 0.0], "axis_maximum": [235.0, 235.0, 250.0, 0.0]},
+            "gcode_move": {"speed_factor": 1.0, "extrude_factor": 1.0, "gcode_position": [0.0, 0.0, 0.0, 0.0]},
+            "fan": {"speed": 0.0, "rpm": None},
+            "display_status": {"progress": 0.0, "message": None},
+            "idle_timeout": {"state": "Idle", "printing_time": 0.0},
+            "pause_resume": {"is_paused": False},
+        }
+
+    def _sample_file(self, name, size, estimated_time, filament, layer_height, height, extruder_temp, bed_temp):
+        return {"path": name, "size": size, "modified": time.time() - self.rng.uniform(0, 86400 * 30),
+                "permissions": "rw", "estimated_time": estimated_time, "filament_total": filament,
+                "layer_height": layer_height, "first_layer_height": layer_height, "object_height": height,
+                "first_layer_extr_temp": extruder_temp, "first_layer_bed_temp": bed_temp, "slicer": "SimSlicer"}
+
+    def _set(self, name, **fields):
+        obj = self.status[name]
+        for key, value in fields.items():
+            if obj.get(key) != value:
+                obj[key] = value
+                self._changed.setdefault(name, {})[key] = value
+
+    @property
+    def klippy_state(self):
+        return self.status["webhooks"]["state"]
+
+    # --- динамика ---
+
+    def step(self, dt):
+        """Продвигает имитацию на dt секунд и возвращает изменившиеся поля {объект: {поле: значение}}"""
+        self.clock += dt
+        # После аварийной остановки нагреватели выключены и остывают
+        self._step_heaters(dt)
+        if self.klippy_state == "ready":
+            self._step_print(dt)
+        changed, self._changed = self._changed, {}
+        return changed
+
+    def _step_heaters(self, dt):
+        for name, heater, failed in (("extruder", EXTRUDER_HEATER, "heater" in self.faults),
+                                     ("heater_bed", BED_HEATER, False)):
+            obj = self.status[name]
+            temperature, power = heater.step(obj["temperature"], obj["target"], dt, self.rng, failed)
+            self._set(name, temperature=round(temperature, 2), power=round(power, 3))
+        self._set("extruder", can_extrude=self.status["extruder"]["temperature"] >= 170)
+
+    def _step_print(self, dt):
+        stats = self.status["print_stats"]
+        toolhead = self.status["toolhead"]
+        self._set("toolhead", print_time=round(toolhead["print_time"] + dt, 3),
+                  estimated_print_time=round(toolhead["estimated_print_time"] + dt, 3))
+        if stats["state"] == "complete" and self.repeat:
+            if self._idle_since is not None and self.clock - self._idle_since >= 30:
+                self.print_start(stats["filename"])
+            return
+        if stats["state"] not in ("printing", "paused"):
+            return
+
+        self._set("print_stats", total_duration=round(stats["total_duration"] + dt, 2))
+        if stats["state"] == "paused":
+            return
+        if not self._heated:
+            # Печать начинается, когда оба нагревателя вышли на целевую температуру
+            self._heated = all(abs(self.status[name]["temperature"] - self.status[name]["target"]) < 2
+                               for name in ("extruder", "heater_bed"))
+            if not self._heated:
+                return
+        if "stall" in self.faults:
+            return
+
+        sdcard = self.status["virtual_sdcard"]
+        meta = self.files[stats["filename"]]
+        speed_factor = self.status["gcode_move"]["speed_factor"]
+        position = min(sdcard["file_size"],
+                       sdcard["file_position"] + int(sdcard["file_size"] / meta["estimated_time"] * dt * speed_factor))
+        progress = position / sdcard["file_size"] if sdcard["file_size"] else 1.0
+        total_layers = max(1, int(meta["object_height"] / meta["layer_height"]))
+        layer = min(total_layers, int(progress * total_layers) + 1)
+
+        self._set("virtual_sdcard", file_position=position, progress=round(progress, 4))
+        self._set("display_status", progress=round(progress, 4))
+        self._set("print_stats", print_duration=round(stats["print_duration"] + dt, 2),
+                  filament_used=round(meta["filament_total"] * progress, 2),
+                  info={"total_layer": total_layers, "current_layer": layer})
+        self._set("fan", speed=1.0 if layer > 1 else 0.0)
+        angle = self.clock * 0.7 + self._phase
+        self._set("toolhead", position=[round(117.5 + 60 * math.sin(angle), 3),
+                                        round(117.5 + 60 * math.cos(angle * 0.63), 3),
+                                        round(meta["first_layer_height"] + (layer - 1) * meta["layer_height"], 3),
+                                        round(meta["filament_total"] * progress, 2)])
+        if position >= sdcard["file_size"]:
+            self._finish("complete")
+
+    def _finish(self, state):
+        self._set("print_stats", state=state)
+        self._set("virtual_sdcard", is_active=False)
+        self._set("extruder", target=0.0)
+        self._set("heater_bed", target=0.0)
+        self._set("fan", speed=0.0)
+        self._set("idle_timeout", state="Idle")
+        self._idle_since = self.clock
+
+    # --- методы API ---
+
+    def server_info(self):
+        ready = self.klippy_state == "ready"
+        return {"klippy_connected": True, "klippy_state": self.klippy_state,
+                "components": ["file_manager", "klippy_apis", "websockets"], "failed_components": [],
+                "registered_directories": ["config", "gcodes", "logs"], "warnings": [],
+                "moonraker_version": "v0.8.0-sim", "api_version": [1, 4, 0],
+                "api_version_string": "1.4.0", "missing_klippy_requirements": [] if ready else ["webhooks"]}
+
+    def printer_info(self):
+        return {"state": self.klippy_state, "state_message": self.status["webhooks"]["state_message"],
+                "hostname": self.hostname, "software_version": "v0.12.0-sim", "cpu_info": "Simulated CPU",
+                "klipper_path": "/home/pi/klipper", "python_path": "/home/pi/klippy-env/bin/python",
+                "log_file": "/home/pi/printer_data/logs/klippy.log",
+                "config_file": "/home/pi/printer_data/config/printer.cfg"}
+
+    def system_info(self, address):
+        # Свой MAC у каждого имитируемого принтера: по нему поиск узнает один хост на нескольких адресах
+        return {"system_info": {
+            "cpu_info": {"cpu_count": 4, "model": "Simulated CPU"},
+            "network": {"eth0": {"mac_address": f"02:00:00:00:{self.index >> 8:02x}:{self.index & 0xff:02x}",
+                                 "ip_addresses": [{"family": "ipv4", "address": address, "is_link_local": False}]}},
+        }}
+
+    def objects_list(self):
+        return {"objects": list(self.status)}
+
+    def query(self, objects):
+        """Поля объектов {объект: [поля] или None - все поля}"""
+        status = {}
+        for name, fields in objects.items():
+            obj = self.status.get(name)
+            if obj is None:
+                continue
+            status[name] = dict(obj) if not fields else {key: obj[key] for key in fields if key in obj}
+        return {"eventtime": round(self.clock, 3), "status": status}
+
+    def gcode(self, script):
+        for line in str(script).splitlines():
+            line = line.split(";", 1)[0].strip()
+            if line:
+                self._run_gcode(line)
+        return "ok"
+
+    def _run_gcode(self, line):
+        command, params = parse_gcode(line)
+        if command == "M112":
+            return self.emergency_stop()
+        if command in ("FIRMWARE_RESTART", "RESTART"):
+            return self.firmware_restart()
+        if self.klippy_state != "ready":
+            raise SimulatorError(f"Printer is {self.klippy_state}")
+
+        if command in ("M104", "M109"):
+            self._set("extruder", target=float(params.get("S", 0)))
+        elif command in ("M140", "M190"):
+            self._set("heater_bed", target=float(params.get("S", 0)))
+        elif command == "SET_HEATER_TEMPERATURE":
+            heater = params.get("HEATER", "").lower()
+            if heater not in ("extruder", "heater_bed"):
+                raise SimulatorError(f"Unknown heater '{heater}'")
+            self._set(heater, target=float(params.get("TARGET", 0)))
+        elif command == "G28":
+            self._set("toolhead", homed_axes="xyz", position=[0.0, 0.0, 0.0, self.status["toolhead"]["position"][3]])
+        elif command in ("G0", "G1"):
+            toolhead = self.status["toolhead"]
+            if toolhead["homed_axes"] != "xyz":
+                raise SimulatorError("Must home axis first")
+            position = list(toolhead["position"])
+            for i, axis in enumerate("XYZE"):
+                if axis in params:
+                    position[i] = float(params[axis])
+            self._set("toolhead", position=position)
+        elif command == "M106":
+            self._set("fan", speed=round(float(params.get("S", 255)) / 255, 3))
+        elif command == "M107":
+            self._set("fan", speed=0.0)
+        elif command == "M117":
+            self._set("display_status", message=line[4:].strip() or None)
+        elif command == "M220":
+            self._set("gcode_move", speed_factor=float(params.get("S", 100)) / 100)
+        elif command == "SDCARD_PRINT_FILE":
+            self.print_start(params.get("FILENAME", ""))
+        elif command == "PAUSE":
+            self.print_pause()
+        elif command == "RESUME":
+            self.print_resume()
+        elif command == "CANCEL_PRINT":
+            self.print_cancel()
+        elif command == "SIM_FAULT":
+            fault = params.get("TYPE", "").lower()
+            if fault == "clear":
+                self.faults.clear()
+            elif fault == "shutdown":
+                self._shutdown("Simulated MCU shutdown")
+            elif fault in ("heater", "stall"):
+                self.faults.add(fault)
+            else:
+                raise SimulatorError(f"Unknown fault '{fault}'")
+
+    def print_start(self, filename):
+        if self.klippy_state != "ready":
+            raise SimulatorError(f"Printer is {self.klippy_state}")
+        if self.status["print_stats"]["state"] in ("printing", "paused"):
+            raise SimulatorError("Printer is busy")
+        meta = self.files.get(filename.lstrip("/"))
+        if meta is None:
+            raise SimulatorError(f"File not found: {filename}", 404)
+        self._heated = False
+        self._idle_since = None
+        self._set("extruder", target=meta["first_layer_extr_temp"])
+        self._set("heater_bed", target=meta["first_layer_bed_temp"])
+        self._set("toolhead", homed_axes="xyz")
+        self._set("virtual_sdcard", file_path=f"/home/pi/printer_data/gcodes/{meta['path']}", file_size=meta["size"],
+                  file_position=0, progress=0.0, is_active=True)
+        self._set("display_status", progress=0.0)
+        self._set("print_stats", state="printing", filename=meta["path"], total_duration=0.0, print_duration=0.0,
+                  filament_used=0.0, message="", info={"total_layer": None, "current_layer": None})
+        self._set("idle_timeout", state="Printing")
+        return "ok"
+
+    def print_pause(self):
+        if self.status["print_stats"]["state"] != "printing":
+            raise SimulatorError("Print is not active")
+        self._set("print_stats", state="paused")
+        self._set("pause_resume", is_paused=True)
+        return "ok"
+
+    def print_resume(self):
+        if self.status["print_stats"]["state"] != "paused":
+            raise SimulatorError("Print is not paused")
+        self._set("print_stats", state="printing")
+        self._set("pause_resume", is_paused=False)
+        return "ok"
+
+    def print_cancel(self):
+        if self.status["print_stats"]["state"] not in ("printing", "paused"):
+            raise SimulatorError("Print is not active")
+        self._set("pause_resume", is_paused=False)
+        self._finish("cancelled")
+        return "ok"
+
+    def emergency_stop(self):
+        self._shutdown("Shutdown due to M112 command")
+        return "ok"
+
+    def firmware_restart(self):
+        self.faults.clear()
+        self._set("webhooks", state="ready", state_message="Printer is ready")
+        self.events.append(("notify_klippy_ready", []))
+        return "ok"
+
+    def _shutdown(self, message):
+        if self.status["print_stats"]["state"] in ("printing", "paused"):
+            self._set("print_stats", state="error", message=message)
+            self._set("virtual_sdcard", is_active=False)
+        self._set("extruder", target=0.0, power=0.0)
+        self._set("heater_bed", target=0.0, power=0.0)
+        self._set("webhooks", state="shutdown", state_message=message)
+        self.events.append(("notify_klippy_shutdown", []))
+
+    def files_list(self, root="gcodes"):
+        if root != "gcodes":
+            return []
+        return [{"path": meta["path"], "modified": meta["modified"], "size": meta["size"],
+                 "permissions": meta["permissions"]} for meta in self.files.values()]
+
+    def file_metadata(self, filename):
+        meta = self.files.get(str(filename).lstrip("/"))
+        if meta is None:
+            raise SimulatorError(f"Metadata not available for <{filename}>", 404)
+        data = {key: value for key, value in meta.items() if key not in ("path", "permissions")}
+        data["filename"] = meta["path"]
+        return data
+
+    def upload(self, filename, content, start=False):
+        """Сохраняет сведения о загруженном файле; содержимое не хранится, из него берутся температуры"""
+        filename = os.path.basename(filename)
+        if not filename.endswith((".gcode", ".g", ".gco")):
+            raise SimulatorError(f"File extension not allowed: {filename}")
+        extruder = _FIRST_TEMPERATURE.search(content[:65536])
+        bed = _FIRST_BED_TEMPERATURE.search(content[:65536])
+        size = len(content)
+        self.files[filename] = {
+            "path": filename, "size": size, "modified": time.time(), "permissions": "rw",
+            # Около 700 байт G-code в секунду печати
+            "estimated_time": max(1, size // 700), "filament_total": size / 500.0,
+            "layer_height": 0.2, "first_layer_height": 0.2, "object_height": 20.0,
+            "first_layer_extr_temp": float(extruder.group(1)) if extruder else 210.0,
+            "first_layer_bed_temp": float(bed.group(1)) if bed else 60.0, "slicer": "Unknown",
+        }
+        # Как в Moonraker без очереди задач: занятый принтер файл принимает, но печать не начинает
+        started = start and self.status["print_stats"]["state"] not in ("printing", "paused")
+        if started:
+            self.print_start(filename)
+        return {"item": {"path": filename, "root": "gcodes", "modified": self.files[filename]["modified"],
+                         "size": size, "permissions": "rw"},
+                "print_started": started, "print_queued": False, "action": "create_file"}
+
+
+class SimulatedConnection:
+    """WebSocket-клиент имитатора и его подписка"""
+
+    def __init__(self, ws, connection_id):
+        self.ws = ws
+        self.connection_id = connection_id
+        # {объект: [поля] или None}; None - подписки нет
+        self.objects = None
+        # Подписка в виде строки: клиенты с одинаковой подпиской получают один кадр
+        self.subscription = None
+
+    def filter(self, changed):
+        status = {}
+        for name, fields in self.objects.items():
+            diff = changed.get(name)
+            if diff is None:
+                continue
+            if fields:
+                diff = {key: value for key, value in diff.items() if key in fields}
+            if diff:
+                status[name] = diff
+        return status
+
+
+class MoonrakerSimulator:
+    """N имитируемых принтеров на одном цикле asyncio: host:base_port, host:base_port+1, ..."""
+
+    def __init__(self, count=1, host="127.0.0.1", base_port=7125, rate=4.0, speed=1.0, printing=0.0,
+                 repeat=True, seed=None):
+        self.host = host
+        self.rate = rate
+        self.speed = speed
+        rng = random.Random(seed)
+        self.printers = [SimulatedPrinter(i, base_port + i, seed=rng.random(), repeat=repeat) for i in range(count)]
+        # Часть принтеров сразу печатает, каждый - свой файл
+        files = list(SAMPLE_FILES)
+        for printer in self.printers[:int(round(count * printing))]:
+            printer.print_start(rng.choice(files))
+        self._connections = {printer.index: [] for printer in self.printers}
+        self._connection_ids = 0
+        self.notifications = 0
+
+        self._methods = {
+            "server.info": lambda printer, params: dict(printer.server_info(),
+                                                        websocket_count=len(self._connections[printer.index])),
+            "printer.info": lambda printer, params: printer.printer_info(),
+            "machine.system_info": lambda printer, params: printer.system_info(self.host),
+            "printer.objects.list": lambda printer, params: printer.objects_list(),
+            "printer.objects.query": lambda printer, params: printer.query(params.get("objects", {})),
+            "printer.gcode.script": lambda printer, params: printer.gcode(params.get("script", "")),
+            "printer.gcode.help": lambda printer, params: {"SDCARD_PRINT_FILE": "Loads a SD file and starts the print",
+                                                           "SIM_FAULT": "Simulate a fault (heater, stall, shutdown, clear)"},
+            "printer.print.start": lambda printer, params: printer.print_start(params.get("filename", "")),
+            "printer.print.pause": lambda printer, params: printer.print_pause(),
+            "printer.print.resume": lambda printer, params: printer.print_resume(),
+            "printer.print.cancel": lambda printer, params: printer.print_cancel(),
+            "printer.emergency_stop": lambda printer, params: printer.emergency_stop(),
+            "printer.firmware_restart": lambda printer, params: printer.firmware_restart(),
+            "printer.restart": lambda printer, params: printer.firmware_restart(),
+            "server.files.list": lambda printer, params: printer.files_list(params.get("root", "gcodes")),
+            "server.files.metadata": lambda printer, params: printer.file_metadata(params.get("filename", "")),
+        }
+
+        self._loop = None
+        self._thread = None
+        self._started = threading.Event()
+        self._stopped = None
+        self._runners = []
+
+    @property
+    def addresses(self):
+        return [(self.host, printer.port) for printer in self.printers]
+
+    def start(self):
+        """Запускает имитатор в фоновом потоке и ждет, пока все порты будут открыты"""
+        self._thread = threading.Thread(target=self._run_loop, name="moonraker-sim", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join()
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self._main())
+        except KeyboardInterrupt:
+            pass
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        self._stopped = asyncio.Event()
+        for printer in self.printers:
+            app = web.Application(client_max_size=1024 ** 3)
+            app["printer"] = printer
+            app.router.add_get("/websocket", self._handle_websocket)
+            app.router.add_post("/server/files/upload", self._handle_upload)
+            app.router.add_route("*", "/{path:(?:server|printer|machine)/.*}", self._handle_http)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, self.host, printer.port).start()
+            self._runners.append(runner)
+        ticker = asyncio.ensure_future(self._tick())
+        self._started.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            ticker.cancel()
+            for connections in self._connections.values():
+                for connection in list(connections):
+                    await connection.ws.close()
+            for runner in self._runners:
+                await runner.cleanup()
+
+    async def _tick(self):
+        interval = 1.0 / self.rate
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            dt, last = (now - last) * self.speed, now
+            for printer in self.printers:
+                changed = printer.step(dt)
+                events, printer.events = printer.events, []
+                connections = self._connections[printer.index]
+                if not connections:
+                    continue
+                eventtime = round(printer.clock, 3)
+                for method, params in events:
+                    await self._broadcast(connections, {"jsonrpc": "2.0", "method": method, "params": params})
+                if changed:
+                    await self._notify_status(connections, changed, eventtime)
+
+    async def _notify_status(self, connections, changed, eventtime):
+        frames = {}
+        for connection in connections:
+            if connection.objects is None or connection.ws.closed:
+                continue
+            key = connection.subscription
+            if key not in frames:
+                status = connection.filter(changed)
+                frames[key] = json_codec.dumps_str({"jsonrpc": "2.0", "method": "notify_status_update",
+                                                    "params": [status, eventtime]}) if status else None
+            if frames[key] is not None:
+                self.notifications += 1
+                await self._send(connection, frames[key])
+
+    async def _broadcast(self, connections, message):
+        frame = json_codec.dumps_str(message)
+        for connection in connections:
+            if not connection.ws.closed:
+                await self._send(connection, frame)
+
+    @staticmethod
+    async def _send(connection, frame):
+        try:
+            await connection.ws.send_str(frame)
+        except ConnectionError:
+            pass
+
+    def call(self, printer, method, params):
+        handler = self._methods.get(method)
+        if handler is None:
+            raise SimulatorError(f"Method not found: {method}", 404)
+        return handler(printer, params or {})
+
+    async def _handle_http(self, request):
+        printer = request.app["printer"]
+        method = request.match_info["path"].strip("/").replace("/", ".")
+        if method == "printer.objects.query":
+            params = {"objects": {name: value.split(",") if value else None for name, value in request.query.items()}}
+        else:
+            params = dict(request.query)
+            if request.can_read_body and request.content_type == "application/json":
+                params.update(await request.json(loads=json_codec.loads))
+        try:
+            result = self.call(printer, method, params)
+        except SimulatorError as e:
+            return self._json_response({"error": {"code": e.code, "message": str(e)}}, status=e.code)
+        return self._json_response({"result": result})
+
+    async def _handle_upload(self, request):
+        printer = request.app["printer"]
+        filename, content, start = None, b"", False
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "file":
+                filename = part.filename
+                content = await part.read()
+            elif part.name == "print":
+                start = (await part.text()).lower() == "true"
+        if not filename:
+            return self._json_response({"error": {"code": 400, "message": "No file part"}}, status=400)
+        try:
+            result = printer.upload(filename, content, start)
+        except SimulatorError as e:
+            return self._json_response({"error": {"code": e.code, "message": str(e)}}, status=e.code)
+        return self._json_response(result, status=201)
+
+    @staticmethod
+    def _json_response(data, status=200):
+        return web.Response(text=json_codec.dumps_str(data), status=status, content_type="application/json")
+
+    async def _handle_websocket(self, request):
+        printer = request.app["printer"]
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._connection_ids += 1
+        connection = SimulatedConnection(ws, self._connection_ids)
+        connections = self._connections[printer.index]
+        connections.append(connection)
+        try:
+            async for message in ws:
+                if message.type != web.WSMsgType.TEXT:
+                    continue
+                response = self._handle_rpc(printer, connection, message.data)
+                if response is not None:
+                    await self._send(connection, json_codec.dumps_str(response))
+        finally:
+            connections.remove(connection)
+        return ws
+
+    def _handle_rpc(self, printer, connection, data):
+        try:
+            request = json_codec.loads(data)
+        except json_codec.JSONDecodeError:
+            return {"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error"}}
+        request_id = request.get("id")
+        method = request.get("method")
+        params = request.get("params") or {}
+        try:
+            if method == "printer.objects.subscribe":
+                connection.objects = params.get("objects", {})
+                connection.subscription = json_codec.dumps_str(connection.objects)
+                result = printer.query(connection.objects)
+            elif method == "server.connection.identify":
+                result = {"connection_id": connection.connection_id}
+            else:
+                result = self.call(printer, method, params)
+        except SimulatorError as e:
+            code = -32601 if method not in self._methods else e.code
+            return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": str(e)}}
+        if request_id is None:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Имитатор Moonraker для проверок без принтеров")
+    parser.add_argument("--count", type=int, default=1, help="Число принтеров (по умолчанию: 1)")
+    parser.add_argument("--host", default="127.0.0.1", help="Адрес (по умолчанию: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=7125,
+                        help="Порт первого принтера, следующие - по порядку (по умолчанию: 7125)")
+    parser.add_argument("--rate", type=float, default=4.0,
+                        help="Частота обновления состояния, раз в секунду (по умолчанию: 4)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Ускорение имитируемого времени (по умолчанию: 1)")
+    parser.add_argument("--printing", type=float, default=0.0,
+                        help="Доля принтеров, которые сразу начинают печать (по умолчанию: 0)")
+    parser.add_argument("--no-repeat", action="store_true", help="Не начинать печать заново после завершения")
+    parser.add_argument("--seed", type=int, help="Зерно генератора для воспроизводимости")
+    args = parser.parse_args()
+
+    simulator = MoonrakerSimulator(args.count, args.host, args.port, rate=args.rate, speed=args.speed,
+                                   printing=args.printing, repeat=not args.no_repeat, seed=args.seed)
+    print(f"Имитация {args.count} принтеров на {args.host}:{args.port}-{args.port + args.count - 1}")
+    print(" ".join(f"--host {host}:{port}" for host, port in simulator.addresses[:5])
+          + (" ..." if args.count > 5 else ""))
+    simulator.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
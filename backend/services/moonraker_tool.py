@@ -9,6 +9,10 @@ import os
 import argparse
 from datetime import datetime
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.services import tracing
+
 # Цвета для вывода
 GREEN = "\033[92m"
 RED = "\033[91m"
@@ -53,13 +57,14 @@ class MoonrakerClient:
         """Выполняет HTTP-запрос к API Moonraker"""
         url = f"{self.base_url}/{endpoint}"
         try:
-            if method == "GET":
-                response = self.session.get(url, params=params, timeout=10)
-            elif method == "POST":
-                response = self.session.post(url, params=params, json=json_data, timeout=10)
-            
-            response.raise_for_status()
-            return response.json()
+            with tracing.span("moonraker.request", url=self.base_url, endpoint=endpoint, method=method):
+                if method == "GET":
+                    response = self.session.get(url, params=params, timeout=10)
+                elif method == "POST":
+                    response = self.session.post(url, params=params, json=json_data, timeout=10)
+
+                response.raise_for_status()
+                return response.json()
         except requests.exceptions.RequestException as e:
             print_error(f"Ошибка HTTP-запроса: {e}")
             return None
@@ -447,6 +452,7 @@ def main():
     parser.add_argument("--port", type=int, default=7125, help="Порт Moonraker (по умолчанию: 7125)")
     
     args = parser.parse_args()
+    tracing.configure_from_env("moonraker-tool")
     
     print_info("=========================================")
     print_info("         MOONRAKER API TOOL              ")
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Типизированная модель живого состояния принтера.
+
+Объекты Moonraker, которые читает весь бэкенд (extruder, heater_bed, toolhead,
+print_stats, virtual_sdcard), хранятся в классах со __slots__: поля обновляются
+на месте, без пересборки вложенных словарей, и занимают меньше памяти.
+Поля, которых нет в модели, и прочие объекты (webhooks, display_status,
+gcode_move, ...) хранятся как обычные словари.
+"""
+
+
+class StateObject:
+    """Объект Moonraker с фиксированным набором полей"""
+
+    __slots__ = ('extra',)
+    FIELDS = ()
+    _FIELD_SET = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_SET = frozenset(cls.FIELDS)
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            setattr(self, name, None)
+        # Поля, которых нет в FIELDS; словарь создается при первом таком поле
+        self.extra = None
+        if fields:
+            self.update(fields)
+
+    def update(self, fields):
+        """Обновляет поля на месте и возвращает только изменившиеся"""
+        diff = {}
+        field_set = self._FIELD_SET
+        for key, value in fields.items():
+            if key in field_set:
+                if getattr(self, key) != value:
+                    setattr(self, key, value)
+                    diff[key] = value
+            else:
+                extra = self.extra
+                if extra is None:
+                    extra = self.extra = {}
+                if key not in extra or extra[key] != value:
+                    extra[key] = value
+                    diff[key] = value
+        return diff
+
+    def retain(self, names):
+        """Сбрасывает поля, которых нет в names, и возвращает сброшенные (со значением None)"""
+        names = frozenset(names)
+        diff = {}
+        for name in self.FIELDS:
+            if name not in names and getattr(self, name) is not None:
+                setattr(self, name, None)
+                diff[name] = None
+        if self.extra:
+            for key in [key for key in self.extra if key not in names]:
+                del self.extra[key]
+                diff[key] = None
+        return diff
+
+    def get(self, key, default=None):
+        if key in self._FIELD_SET:
+            value = getattr(self, key)
+            return default if value is None else value
+        if self.extra is None:
+            return default
+        return self.extra.get(key, default)
+
+    def copy(self):
+        new = object.__new__(type(self))
+        for name in self.FIELDS:
+            setattr(new, name, getattr(self, name))
+        new.extra = None if self.extra is None else dict(self.extra)
+        return new
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.FIELDS}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        fields = ', '.join(f'{key}={value!r}' for key, value in self.to_dict().items())
+        return f'{type(self).__name__}({fields})'
+
+
+class Extruder(StateObject):
+    __slots__ = FIELDS = ('temperature', 'target', 'power', 'pressure_advance', 'smooth_time', 'can_extrude')
+
+
+class HeaterBed(StateObject):
+    __slots__ = FIELDS = ('temperature', 'target', 'power')
+
+
+class Toolhead(StateObject):
+    __slots__ = FIELDS = ('position', 'homed_axes', 'print_time', 'estimated_print_time',
+                          'max_velocity', 'max_accel', 'axis_minimum', 'axis_maximum')
+
+
+class PrintStats(StateObject):
+    __slots__ = FIELDS = ('state', 'filename', 'total_duration', 'print_duration', 'filament_used',
+                          'message', 'info')
+
+
+class VirtualSdcard(StateObject):
+    __slots__ = FIELDS = ('progress', 'is_active', 'file_position', 'file_path', 'file_size')
+
+
+# Имя объекта Moonraker -> класс модели
+OBJECT_TYPES = {
+    'extruder': Extruder,
+    'heater_bed': HeaterBed,
+    'toolhead': Toolhead,
+    'print_stats': PrintStats,
+    'virtual_sdcard': VirtualSdcard,
+}
+
+
+class PrinterState:
+    """Состояние одного принтера: типизированные объекты, meta и прочие объекты"""
+
+    __slots__ = tuple(OBJECT_TYPES) + ('meta', 'objects')
+
+    def __init__(self):
+        for name, cls in OBJECT_TYPES.items():
+            setattr(self, name, cls())
+        # Служебные сведения: host, port, online, version, last_update, ...
+        self.meta = {}
+        # Объекты без модели: имя -> словарь полей (или значение)
+        self.objects = {}
+
+    def apply(self, status):
+        """Сливает изменение вида {объект: {поле: значение}} и возвращает изменившиеся поля"""
+        changed = {}
+        for name, fields in status.items():
+            if name in OBJECT_TYPES:
+                if not isinstance(fields, dict):
+                    continue
+                diff = getattr(self, name).update(fields)
+            elif isinstance(fields, dict):
+                current = self.meta if name == 'meta' else self.objects.setdefault(name, {})
+                diff = {key: value for key, value in fields.items()
+                        if key not in current or current[key] != value}
+                current.update(diff)
+            else:
+                if name in self.objects and self.objects[name] == fields:
+                    continue
+                self.objects[name] = changed[name] = fields
+                continue
+            if diff:
+                changed[name] = diff
+        return changed
+
+    def retain(self, objects):
+        """Оставляет только поля подписки {объект: [поля] или None - все поля}; meta не трогает.
+
+        Возвращает сброшенные поля в виде изменения: {объект: {поле: None}}
+        или {объект: None} для объекта без модели, удаленного целиком.
+        """
+        changed = {}
+        for name in OBJECT_TYPES:
+            names = objects.get(name, ())
+            if names is not None:
+                diff = getattr(self, name).retain(names)
+                if diff:
+                    changed[name] = diff
+        for name in list(self.objects):
+            if name not in objects:
+                del self.objects[name]
+                changed[name] = None
+                continue
+            names, fields = objects[name], self.objects[name]
+            if names is None or not isinstance(fields, dict):
+                continue
+            diff = {key: None for key in fields if key not in names}
+            for key in diff:
+                del fields[key]
+            if diff:
+                changed[name] = diff
+        return changed
+
+    def get(self, name, default=None):
+        """Объект по имени Moonraker: модель, meta или словарь полей"""
+        if name in OBJECT_TYPES:
+            return getattr(self, name)
+        if name == 'meta':
+            return self.meta
+        return self.objects.get(name, default)
+
+    def value(self, name, field, default=None):
+        """Значение поля объекта, например value('extruder', 'temperature')"""
+        obj = self.get(name)
+        if obj is None:
+            return default
+        return obj.get(field, default)
+
+    def copy(self):
+        """Снимок состояния; списки и вложенные значения не копируются, т.к. заменяются целиком"""
+        new = object.__new__(PrinterState)
+        for name in OBJECT_TYPES:
+            setattr(new, name, getattr(self, name).copy())
+        new.meta = dict(self.meta)
+        new.objects = {name: dict(fields) if isinstance(fields, dict) else fields
+                       for name, fields in self.objects.items()}
+        return new
+
+    def to_dict(self):
+        data = {name: getattr(self, name).to_dict() for name in OBJECT_TYPES}
+        data.update(self.objects)
+        data['meta'] = self.meta
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.apply(data)
+        return state
+
+    def __repr__(self):
+        return f'PrinterState({self.to_dict()!r})'
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Профилирование работающего процесса по запросу: снимок флеймграфа за N секунд.
+
+Встроенный сэмплер раз в несколько миллисекунд снимает стеки всех потоков
+(sys._current_frames) и складывает их в «свернутом» формате
+(folded stacks: «поток;модуль:функция;... число»), который открывают
+flamegraph.pl, speedscope.app и inferno. Остановки процесса и сторонних
+пакетов не нужно; стоимость - один проход по стекам за отсчет в одном
+фоновом потоке, пока идет снимок. Если установлен py-spy, можно снять
+профиль им (tool=py-spy) - он видит и код на C, но требует прав ptrace.
+
+Одновременно снимается только один профиль (ProfilerBusy). Эндпоинты
+снимка включаются переменной окружения PRINTERS_PROFILER=1
+(web_interface.py - /debug/profile, ingest.py - на порту --metrics-port).
+"""
+
+import collections
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_INTERVAL = 0.005
+MAX_SECONDS = 120
+
+_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Профиль уже снимается"""
+
+
+def enabled():
+    return os.environ.get("PRINTERS_PROFILER", "").lower() in ("1", "true", "yes")
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    # Без номера строки: все отсчеты функции сливаются в один прямоугольник флеймграфа
+    return f"{module}:{code.co_name}"
+
+
+def sample(seconds, interval=DEFAULT_INTERVAL):
+    """Снимает стеки всех потоков, кроме своего, seconds секунд: Counter {свернутый стек: отсчеты}"""
+    own = threading.get_ident()
+    stacks = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def folded(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def py_spy(seconds, rate=200):
+    """Профиль текущего процесса через py-spy record в свернутом формате"""
+    executable = shutil.which("py-spy")
+    if executable is None:
+        raise RuntimeError("py-spy не установлен (pip install py-spy)")
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "profile.txt")
+        subprocess.run([executable, "record", "--pid", str(os.getpid()), "--duration", str(int(seconds)),
+                        "--rate", str(rate), "--format", "raw", "--output", output, "--nonblocking"],
+                       check=True, capture_output=True, timeout=seconds + 30)
+        with open(output, encoding="utf-8") as f:
+            return f.read()
+
+
+def profile(seconds, tool="sample"):
+    """Снимок профиля в свернутом формате; ProfilerBusy, если другой снимок еще идет"""
+    seconds = min(max(float(seconds), 0.1), MAX_SECONDS)
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy("профиль уже снимается")
+    try:
+        if tool == "py-spy":
+            return py_spy(seconds)
+        if tool != "sample":
+            raise ValueError(f"неизвестный профилировщик: {tool}")
+        return folded(sample(seconds))
+    finally:
+        _lock.release()
+
+
+def handle_request(query):
+    """Общий обработчик эндпоинта профиля: query - {параметр: значение}; (статус, текст)"""
+    try:
+        return 200, profile(query.get("seconds", 10), query.get("tool", "sample"))
+    except ProfilerBusy as e:
+        return 409, str(e)
+    except (ValueError, RuntimeError, subprocess.SubprocessError) as e:
+        return 400, str(e)
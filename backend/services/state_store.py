@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш живого состояния принтеров парка.
+
+Хранит для каждого принтера последние значения объектов Moonraker
+(print_stats, extruder, heater_bed, toolhead, virtual_sdcard, webhooks, ...)
+в типизированной модели PrinterState и оповещает подписчиков о каждом
+изменении. Подписчики вызываются в потоке, который применил изменение,
+поэтому они должны быть быстрыми.
+
+Для работы в несколько процессов (процесс сбора данных и HTTP-воркеры)
+StateFileWriter публикует снимок кеша в файл, а StateFileReader читает его
+с тем же интерфейсом чтения, что и у PrinterStateStore, а DashboardPresence
+сообщает процессу сбора, какие панели веб-интерфейса сейчас открыты.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from backend.services import json_codec, logs, tracing
+from backend.services.metrics import CACHE_REQUESTS
+from backend.services.printer_state import PrinterState
+
+log = logs.get_logger("state_store")
+
+# Файл общего снимка состояния по умолчанию
+DEFAULT_STATE_FILE = os.path.join(tempfile.gettempdir(), 'printers_state.json')
+
+_COPY_HITS = CACHE_REQUESTS.labels('state_copy', 'hit')
+_COPY_MISSES = CACHE_REQUESTS.labels('state_copy', 'miss')
+_FILE_HITS = CACHE_REQUESTS.labels('state_file', 'hit')
+_FILE_MISSES = CACHE_REQUESTS.labels('state_file', 'miss')
+
+
+class PrinterStateStore:
+    def __init__(self):
+        self._states = {}
+        # printer_id -> снимок для читателей; сбрасывается при изменении принтера
+        self._copies = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        # Растет при каждом фактическом изменении любого принтера
+        self.version = 0
+        # Эпоха хранилища: версия начинается с нуля в каждом процессе, и только
+        # пара (epoch, version) однозначно определяет содержимое (ETag в API)
+        self.epoch = time.time_ns() // 1000000
+
+    def apply(self, printer_id, status):
+        """Применяет изменение состояния вида {объект: {поле: значение}}.
+
+        Это может быть как полный ответ printer/objects/query, так и дельта
+        notify_status_update - поля сливаются с уже известными. Подписчики
+        получают только действительно изменившиеся поля; если ничего не
+        изменилось, версия не растет и подписчики не вызываются.
+
+        В объекте meta хранилище само ведет version (версия последнего
+        изменения принтера) и last_update (время этого изменения).
+        Возвращает изменившиеся поля.
+        """
+        with tracing.span("state.apply", printer=printer_id) as span:
+            return self._change(printer_id, lambda state: state.apply(status), span)
+
+    def retain(self, printer_id, objects):
+        """Удаляет поля, которых нет в подписке objects (см. PrinterState.retain).
+
+        Подписчики получают сброшенные поля со значением None. Возвращает
+        сброшенные поля.
+        """
+        with tracing.span("state.retain", printer=printer_id) as span:
+            return self._change(printer_id, lambda state: state.retain(objects), span, create=False)
+
+    def _change(self, printer_id, update, span, create=True):
+        """Изменяет состояние принтера под блокировкой и оповещает подписчиков"""
+        with self._lock:
+            state = self._states.get(printer_id)
+            if state is None:
+                if not create:
+                    return {}
+                state = self._states[printer_id] = PrinterState()
+            changed = update(state)
+            if not changed:
+                return changed
+            self.version += 1
+            state.meta['version'] = self.version
+            state.meta['last_update'] = datetime.now().strftime("%H:%M:%S")
+            self._copies.pop(printer_id, None)
+            listeners = list(self._listeners)
+        span.set_attribute("changed", len(changed))
+        for listener in listeners:
+            try:
+                listener(printer_id, changed, state)
+            except Exception as e:
+                log.exception("Ошибка обработчика состояния принтера %s", printer_id, extra={"printer_id": printer_id})
+        return changed
+
+    def _copy(self, printer_id):
+        copy = self._copies.get(printer_id)
+        if copy is None:
+            _COPY_MISSES.inc()
+            copy = self._copies[printer_id] = self._states[printer_id].copy()
+        else:
+            _COPY_HITS.inc()
+        return copy
+
+    def get(self, printer_id):
+        """Снимок состояния принтера (PrinterState) или None.
+
+        Снимок только для чтения: пока принтер не изменился, все читатели
+        получают один и тот же объект.
+        """
+        with self._lock:
+            if printer_id not in self._states:
+                return None
+            return self._copy(printer_id)
+
+    def printers(self):
+        with self._lock:
+            return list(self._states)
+
+    def items(self):
+        """Пары (printer_id, живой PrinterState) без блокировки - для метрик.
+
+        Состояния читаются на ходу, поэтому поля могут относиться к разным
+        обновлениям; изменять состояния нельзя.
+        """
+        return list(self._states.items())
+
+    def snapshot(self):
+        """Согласованный снимок: (version, {printer_id: PrinterState только для чтения})"""
+        with self._lock:
+            return self.version, {printer_id: self._copy(printer_id) for printer_id in self._states}
+
+    def remove(self, printer_id):
+        with self._lock:
+            self._states.pop(printer_id, None)
+            self._copies.pop(printer_id, None)
+            self.version += 1
+
+    def subscribe(self, listener):
+        """listener(printer_id, delta, state) вызывается после каждого изменения.
+
+        delta - словарь изменившихся полей, state - живой PrinterState
+        принтера, подписчик не должен его изменять.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+
+class StateFileWriter:
+    """Публикует снимок кеша в файл не чаще раза в interval секунд.
+
+    Файл заменяется атомарно, поэтому читатели никогда не видят его частично записанным.
+    notifier - источник уведомлений об изменениях с интерфейсом подписки
+    хранилища (по умолчанию сам store), например StatusFanout: тогда снимок
+    переписывается только при значимых изменениях.
+    """
+
+    def __init__(self, store, path=DEFAULT_STATE_FILE, interval=0.5, notifier=None):
+        self.store = store
+        self.notifier = notifier or store
+        self.path = path
+        self.interval = interval
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.notifier.subscribe(self._on_change)
+        self._dirty.set()
+        self._thread = threading.Thread(target=self._run, name='state-file-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.notifier.unsubscribe(self._on_change)
+        self._stop.set()
+        self._dirty.set()
+        if self._thread:
+            self._thread.join()
+
+    def _on_change(self, printer_id, delta, state):
+        self._dirty.set()
+
+    def write(self):
+        version, states = self.store.snapshot()
+        data = {
+            'epoch': self.store.epoch,
+            'version': version,
+            'written_at': time.time(),
+            'printers': [[printer_id, state] for printer_id, state in states.items()],
+        }
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.printers_state', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json_codec.dumps(data))
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._dirty.wait()
+            if self._stop.is_set():
+                break
+            self._dirty.clear()
+            try:
+                self.write()
+            except Exception as e:
+                log.error("Ошибка записи снимка состояния в %s: %s", self.path, e)
+            self._stop.wait(self.interval)
+
+
+class StateFileReader:
+    """Чтение снимка, опубликованного StateFileWriter, в другом процессе.
+
+    Файл перечитывается, только если изменились время модификации или размер,
+    так что обращение к неизменившемуся снимку стоит одного stat().
+    """
+
+    def __init__(self, path=DEFAULT_STATE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stat_key = None
+        self._states = {}
+        self._version = 0
+        self.epoch = 0
+        self.written_at = None
+
+    @property
+    def version(self):
+        self._refresh()
+        return self._version
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if key == self._stat_key:
+            _FILE_HITS.inc()
+            return
+        _FILE_MISSES.inc()
+        with self._lock:
+            if key == self._stat_key:
+                return
+            try:
+                with open(self.path, 'rb') as f:
+                    data = json_codec.loads(f.read())
+            except (OSError, ValueError) as e:
+                log.error("Ошибка чтения снимка состояния %s: %s", self.path, e)
+                return
+            self._states = {printer_id: PrinterState.from_dict(state) for printer_id, state in data['printers']}
+            self._version = data['version']
+            self.epoch = data.get('epoch', 0)
+            self.written_at = data.get('written_at')
+            self._stat_key = key
+
+    def get(self, printer_id):
+        self._refresh()
+        return self._states.get(printer_id)
+
+    def printers(self):
+        self._refresh()
+        return list(self._states)
+
+    def items(self):
+        self._refresh()
+        return list(self._states.items())
+
+    def snapshot(self):
+        self._refresh()
+        return self._version, dict(self._states)
+
+
+class DashboardPresence:
+    """Отметки открытых панелей веб-интерфейса для процесса сбора данных.
+
+    Подписки Moonraker живут в процессе сбора, и HTTP-воркер не может
+    объявить поля панели в WebSocketHub напрямую. Вместо этого обработчик API
+    обновляет время модификации файла-отметки панели в каталоге рядом со
+    снимком (<файл снимка>.watch/<панель>), а процесс сбора читает отметки
+    (active) и продлевает по ним объявления полей. Закрытая панель перестает
+    отмечаться, и через ttl секунд ее поля снимаются с подписки.
+    """
+
+    def __init__(self, state_file=DEFAULT_STATE_FILE, ttl=30.0):
+        self.directory = state_file + '.watch'
+        self.ttl = ttl
+        # панель -> время последней отметки этим процессом
+        self._touched = {}
+
+    def touch(self, name):
+        """Отмечает, что панель name открыта; файл обновляется не чаще раза в ttl/4"""
+        now = time.monotonic()
+        last = self._touched.get(name)
+        if last is not None and now - last < self.ttl / 4:
+            return
+        self._touched[name] = now
+        path = os.path.join(self.directory, name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, 'ab'):
+                pass
+            os.utime(path)
+        except OSError as e:
+            log.warning("Не удалось отметить панель %s в %s: %s", name, self.directory, e)
+
+    def active(self):
+        """Открытые панели: {имя: сколько секунд еще действует отметка}"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return {}
+        now = time.time()
+        panels = {}
+        for name in names:
+            try:
+                left = os.stat(os.path.join(self.directory, name)).st_mtime + self.ttl - now
+            except FileNotFoundError:
+                continue
+            if left > 0:
+                panels[name] = left
+        return panels
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Отложенная запись прогресса задач из живого состояния принтеров в таблицу Task.
+
+Прогресс (virtual_sdcard.progress) копится в памяти и пишется пачкой раз в
+flush_interval секунд, причем только если значение изменилось. Переходы
+print_stats.state (старт, завершение, ошибка, отмена) записываются сразу и
+автоматически заполняют time_start/time_end и статус задачи. Если печать
+уже шла к первому наблюдению (например, после перезапуска сбора), время
+старта восстанавливается по print_stats.print_duration.
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+from backend.services import logs
+
+log = logs.get_logger("task_progress")
+
+# Состояния print_stats, означающие окончание печати, и статус задачи для них
+FINISHED_STATES = {
+    'complete': 'done',
+    'error': 'error',
+    'cancelled': 'error',
+}
+
+
+class TaskProgressWriter:
+    # Поля Moonraker, которые нужны для записи прогресса
+    FIELDS = {'print_stats': ['state', 'print_duration'], 'virtual_sdcard': ['progress']}
+
+    def __init__(self, db, store, flush_interval=10.0):
+        self.db = db
+        self.store = store
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        # printer_id -> id задачи, которую сейчас печатает принтер
+        self._tasks = {}
+        # printer_id -> последнее известное print_stats.state
+        self._print_states = {}
+        # task_id -> последний записанный прогресс
+        self._written_progress = {}
+        # task_id -> накопленные изменения для записи
+        self._pending = {}
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.store.subscribe(self.on_state_change)
+        self._thread = threading.Thread(target=self._run, name='task-progress', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.store.unsubscribe(self.on_state_change)
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def bind(self, printer_id, task_id):
+        """Явно указывает, какую задачу печатает принтер"""
+        with self._lock:
+            self._tasks[printer_id] = task_id
+
+    def on_state_change(self, printer_id, delta, state):
+        print_stats = delta.get('print_stats')
+        if print_stats and 'state' in print_stats:
+            self._on_print_state(printer_id, print_stats['state'], state)
+
+        sdcard = delta.get('virtual_sdcard')
+        if sdcard and 'progress' in sdcard:
+            with self._lock:
+                task_id = self._tasks.get(printer_id)
+                if task_id is None:
+                    return
+                progress = int(sdcard['progress'] * 100)
+                if self._written_progress.get(task_id) != progress:
+                    self._pending.setdefault(task_id, {})['progress'] = progress
+
+    def _on_print_state(self, printer_id, new_state, state=None):
+        with self._lock:
+            old_state = self._print_states.get(printer_id)
+            self._print_states[printer_id] = new_state
+            task_id = self._tasks.get(printer_id)
+        if new_state == old_state:
+            return
+
+        now = datetime.now()
+        if new_state == 'printing' and old_state != 'paused':
+            if task_id is None:
+                # Поиск задачи - запрос к базе, но только на старте печати
+                task_id = self.db.find_task_for_printer(printer_id)
+                if task_id is None:
+                    return
+            with self._lock:
+                self._tasks[printer_id] = task_id
+                changes = self._pending.setdefault(task_id, {})
+                changes['status'] = 'active'
+                if old_state is not None:
+                    changes.update(time_start=now, time_end=None)
+                else:
+                    # Печать шла до первого наблюдения: старт - столько секунд печати назад
+                    duration = state.print_stats.print_duration if state is not None else None
+                    if duration is not None:
+                        changes.update(time_start=now - timedelta(seconds=duration), time_end=None)
+            self.flush()
+        elif new_state in FINISHED_STATES and task_id is not None:
+            with self._lock:
+                changes = self._pending.setdefault(task_id, {})
+                changes.update(status=FINISHED_STATES[new_state], time_end=now)
+                if new_state == 'complete':
+                    changes['progress'] = 100
+                self._tasks.pop(printer_id, None)
+            self.flush()
+
+    def flush(self):
+        """Передает накопленные изменения в очередь записи базы"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for task_id, changes in pending.items():
+                if 'progress' in changes:
+                    self._written_progress[task_id] = changes['progress']
+                if changes.get('status') in ('done', 'error'):
+                    self._written_progress.pop(task_id, None)
+        for task_id, changes in pending.items():
+            self.db.update_task(task_id, **changes)
+        return len(pending)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                log.exception("Ошибка записи прогресса задач")
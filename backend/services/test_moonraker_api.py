@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
 import requests
 import json
 import time
@@ -8,9 +9,9 @@ import websocket
 import threading
 import sys
 
-# Конфигурация
-MOONRAKER_URL = "http://192.168.10.14:7125"
-WEBSOCKET_URL = "ws://192.168.10.14:7125/websocket"
+# Конфигурация; MOONRAKER_URL=http://127.0.0.1:7125 - проверка на имитаторе moonraker_sim.py
+MOONRAKER_URL = os.environ.get("MOONRAKER_URL", "http://192.168.10.14:7125")
+WEBSOCKET_URL = MOONRAKER_URL.replace("http", "ws", 1) + "/websocket"
 
 # Цвета для вывода
 GREEN = "\033[92m"
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Трассировка горячих путей: интервалы (spans) вокруг запросов к Moonraker,
+обработки сообщений WebSocket, слияния состояния, коммитов базы и
+обработчиков API.
+
+Выключена по умолчанию; включается в процессе вызовом configure() или
+переменными окружения (configure_from_env):
+    PRINTERS_TRACE_FILE=/tmp/printers-trace.jsonl - файл, по строке OTLP/JSON на пачку интервалов;
+    PRINTERS_TRACE_OTLP=http://localhost:4318 - OTLP/HTTP-коллектор (Jaeger, Tempo, otel-collector);
+    PRINTERS_TRACE_SAMPLE=0.1 - доля трассируемых запросов верхнего уровня (по умолчанию 1).
+
+Пока трассировка выключена, span() возвращает общий пустой контекст -
+это одна проверка флага. Законченные интервалы копятся в ограниченном
+буфере и выгружаются фоновым потоком раз в секунду; при переполнении
+старые интервалы отбрасываются, так что трассировка не тормозит сбор.
+"""
+
+import atexit
+import collections
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+
+from backend.services import json_codec, logs
+
+log = logs.get_logger("tracing")
+
+# Размер буфера законченных интервалов и период выгрузки
+BUFFER_SIZE = 20000
+EXPORT_INTERVAL = 1.0
+
+_enabled = False
+_sample = 1.0
+_service = "printers"
+_sinks = []
+_buffer = collections.deque(maxlen=BUFFER_SIZE)
+_exporter = None
+_stop = threading.Event()
+_current = contextvars.ContextVar("printers_span", default=None)
+# Метка в контексте: запрос верхнего уровня не попал в выборку, вложенные интервалы тоже не пишутся
+_UNSAMPLED = object()
+
+dropped = 0
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error",
+                 "_started", "_token")
+
+    def __init__(self, name, attributes, parent):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else random.getrandbits(128)
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+        self._started = time.perf_counter_ns()
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        # Длительность по монотонным часам, время начала - по системным
+        self.end_ns = self.start_ns + time.perf_counter_ns() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+        _record(self)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc)
+        return False
+
+
+class _NoopSpan:
+    """Интервал, который ничего не пишет: трассировка выключена или запрос не в выборке"""
+
+    __slots__ = ("_token",)
+
+    def __init__(self):
+        self._token = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def end(self, error=None):
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end()
+        return False
+
+
+class _UnsampledSpan(_NoopSpan):
+    __slots__ = ()
+
+    def __enter__(self):
+        self._token = _current.set(_UNSAMPLED)
+        return self
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, **attributes):
+    """Интервал для with: with tracing.span("db.commit", operations=10): ..."""
+    if not _enabled:
+        return _NOOP
+    parent = _current.get()
+    if parent is _UNSAMPLED:
+        return _NOOP
+    if parent is None and _sample < 1.0 and random.random() >= _sample:
+        return _UnsampledSpan()
+    return Span(name, attributes, parent)
+
+
+def start_span(name, **attributes):
+    """Интервал, который заканчивается явным вызовом end() - для хуков до и после запроса"""
+    current = span(name, **attributes)
+    current.__enter__()
+    return current
+
+
+def traced(name=None):
+    """Декоратор: каждый вызов функции - интервал с именем name (по умолчанию - имя функции)"""
+
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enabled():
+    return _enabled
+
+
+def _record(finished):
+    global dropped
+    if len(_buffer) == BUFFER_SIZE:
+        dropped += 1
+    _buffer.append(finished)
+
+
+# --- выгрузка ---
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def otlp_payload(spans, service=None):
+    """Пачка интервалов в формате OTLP/JSON (ExportTraceServiceRequest)"""
+    items = []
+    for finished in spans:
+        item = {
+            "traceId": f"{finished.trace_id:032x}",
+            "spanId": f"{finished.span_id:016x}",
+            "name": finished.name,
+            "kind": 1,
+            "startTimeUnixNano": str(finished.start_ns),
+            "endTimeUnixNano": str(finished.end_ns),
+            "attributes": [_attribute(key, value) for key, value in finished.attributes.items()],
+            "status": {"code": 2, "message": finished.error} if finished.error else {"code": 1},
+        }
+        if finished.parent_id is not None:
+            item["parentSpanId"] = f"{finished.parent_id:016x}"
+        items.append(item)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", service or _service),
+                                    _attribute("process.pid", os.getpid())]},
+        "scopeSpans": [{"scope": {"name": "printers"}, "spans": items}],
+    }]}
+
+
+class FileSink:
+    """Дописывает пачки в файл JSON Lines (формат файлового экспортера OpenTelemetry)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, payload):
+        with open(self.path, "ab") as f:
+            f.write(json_codec.dumps(payload) + b"\n")
+
+
+class OTLPSink:
+    """Отправляет пачки в OTLP/HTTP-коллектор (endpoint/v1/traces, JSON)"""
+
+    def __init__(self, endpoint, timeout=5.0):
+        import requests
+
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def export(self, payload):
+        response = self.session.post(self.url, data=json_codec.dumps(payload),
+                                     headers={"Content-Type": "application/json"}, timeout=self.timeout)
+        response.raise_for_status()
+
+
+def flush():
+    """Выгружает накопленные интервалы во все приемники"""
+    spans = []
+    while _buffer and len(spans) < BUFFER_SIZE:
+        spans.append(_buffer.popleft())
+    if not spans:
+        return 0
+    payload = otlp_payload(spans)
+    for sink in _sinks:
+        try:
+            sink.export(payload)
+        except Exception as e:
+            log.error("Ошибка выгрузки трассировки (%s): %s", type(sink).__name__, e)
+    return len(spans)
+
+
+def _run_exporter():
+    while not _stop.wait(EXPORT_INTERVAL):
+        flush()
+
+
+def configure(service="printers", file=None, otlp=None, sample=1.0):
+    """Включает трассировку с указанными приемниками; без приемников - выключает"""
+    global _enabled, _sample, _service, _sinks, _exporter
+    _service = service
+    _sample = sample
+    _sinks = []
+    if file:
+        _sinks.append(FileSink(file))
+    if otlp:
+        _sinks.append(OTLPSink(otlp))
+    _enabled = bool(_sinks)
+    if _enabled and _exporter is None:
+        _exporter = threading.Thread(target=_run_exporter, name="trace-exporter", daemon=True)
+        _exporter.start()
+        atexit.register(flush)
+    return _enabled
+
+
+def configure_from_env(service):
+    """Включает трассировку по переменным окружения; без них уже сделанную настройку не трогает"""
+    file = os.environ.get("PRINTERS_TRACE_FILE")
+    otlp = os.environ.get("PRINTERS_TRACE_OTLP")
+    if not (file or otlp):
+        return _enabled
+    return configure(service, file=file, otlp=otlp, sample=float(os.environ.get("PRINTERS_TRACE_SAMPLE", 1.0)))
+
+
+def init_flask(app):
+    """Интервал на каждый запрос Flask: имя - метод и шаблон маршрута"""
+    from flask import request
+
+    @app.before_request
+    def start_request_span():
+        if _enabled:
+            rule = request.url_rule.rule if request.url_rule is not None else request.path
+            request.environ["printers.span"] = start_span(f"{request.method} {rule}", http_method=request.method,
+                                                          http_target=request.full_path.rstrip("?"))
+
+    @app.teardown_request
+    def end_request_span(error=None):
+        current = request.environ.pop("printers.span", None)
+        if current is not None:
+            current.end(error)
@@ -2,49 +2,61 @@
 # -*- coding: utf-8 -*-
 
 import websocket
-import json
+import concurrent.futures
+import random
 import threading
 import time
 import argparse
+import logging
+import os
 import sys
-from datetime import datetime
 
-# Цвета для вывода
-GREEN = "\033[92m"
-RED = "\033[91m"
-BLUE = "\033[94m"
-YELLOW = "\033[93m"
-CYAN = "\033[96m"
-MAGENTA = "\033[95m"
-RESET = "\033[0m"
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-def print_colored(color, prefix, message):
-    print(f"{color}[{prefix}]{RESET} {message}")
+from backend.services import json_codec, logs, tracing
+from backend.services.printer_state import PrinterState
 
-def print_success(message):
-    print_colored(GREEN, "УСПЕХ", message)
+log = logs.get_logger("websocket_listener")
 
-def print_error(message):
-    print_colored(RED, "ОШИБКА", message)
+def backoff_delay(attempt, initial=1.0, maximum=60.0):
+    """Задержка перед попыткой переподключения: экспонента с потолком и джиттером"""
+    delay = min(maximum, initial * 2 ** attempt)
+    # Джиттер разводит переподключения принтеров, перезагруженных одновременно
+    return random.uniform(delay / 2, delay)
 
-def print_info(message):
-    print_colored(BLUE, "ИНФО", message)
 
-def print_warning(message):
-    print_colored(YELLOW, "ВНИМАНИЕ", message)
+class MoonrakerRPCError(Exception):
+    """Ошибка, которую Moonraker вернул в ответ на JSON-RPC запрос"""
 
-def print_status(message):
-    print_colored(CYAN, "СТАТУС", message)
-
-def print_event(message):
-    print_colored(MAGENTA, "СОБЫТИЕ", message)
 
 class MoonrakerWebsocket:
-    def __init__(self, host, port=7125):
+    def __init__(self, host, port=7125, store=None, printer_id=None, verbose=True,
+                 reconnect=True, backoff_initial=1.0, backoff_max=60.0, request_timeout=10.0, objects=None):
+        self.host = host
+        self.port = port
         self.ws_url = f"ws://{host}:{port}/websocket"
         self.ws = None
         self.connected = False
         self.request_id = 0
+        self._id_lock = threading.Lock()
+        # id запроса -> Future с результатом ответа; запросы регистрируют потоки
+        # вызывающих, а сбрасывает поток WebSocket при закрытии соединения
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self.request_timeout = request_timeout
+
+        # Кеш состояния парка, в который пишутся обновления (необязательно)
+        self.store = store
+        self.printer_id = printer_id
+        # Писать в журнал каждое обновление статуса (режим слушателя из командной строки)
+        self.verbose = verbose
+        self.log = logs.printer_logger(log, printer_id, host, port)
+
+        # Переподключение с экспоненциальной задержкой и джиттером
+        self.reconnect = reconnect
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.reconnects = 0
         
         # События для контроля подключения и инициализации
         self.connection_event = threading.Event()
@@ -52,12 +64,14 @@ class MoonrakerWebsocket:
         
         # Флаг для остановки потоков
         self.running = True
+        self._stop = threading.Event()
         
         # Состояние принтера
-        self.printer_state = {"klippy_state": "disconnected"}
+        self.printer_state = PrinterState()
+        self.printer_state.meta["klippy_state"] = "disconnected"
         
-        # Список объектов для подписки
-        self.subscribe_objects = {
+        # Список объектов для подписки: объект -> список полей или None (все поля)
+        self.subscribe_objects = dict(objects) if objects is not None else {
             "toolhead": None,
             "extruder": None,
             "heater_bed": None,
@@ -68,234 +82,316 @@ class MoonrakerWebsocket:
         }
         
     def connect(self):
-        """Устанавливает соединение с сервером"""
-        print_info(f"Подключение к {self.ws_url}...")
-        
-        try:
-            # Настройка обработчиков WebSocket
-            websocket.enableTrace(False)
-            self.ws = websocket.WebSocketApp(
-                self.ws_url,
-                on_open=self.on_open,
-                on_message=self.on_message,
-                on_error=self.on_error,
-                on_close=self.on_close
-            )
-            
-            # Запуск соединения в отдельном потоке
-            self.wst = threading.Thread(target=self.ws.run_forever)
-            self.wst.daemon = True
-            self.wst.start()
-            
-            # Ожидаем установки соединения
-            if not self.connection_event.wait(timeout=10):
-                print_error("Таймаут подключения к WebSocket")
-                return False
-                
-            return True
-        except Exception as e:
-            print_error(f"Ошибка подключения: {e}")
+        """Запускает поток соединения и ждет первого подключения.
+
+        Дальше соединение поддерживается само: после обрыва поток
+        переподключается, заново подписывается и синхронизирует состояние.
+        """
+        self.log.info("Подключение к %s...", self.ws_url)
+        websocket.enableTrace(False)
+        self.wst = threading.Thread(target=self._run, name=f"moonraker-ws-{self.host}", daemon=True)
+        self.wst.start()
+
+        # Ожидаем установки соединения
+        if not self.connection_event.wait(timeout=10):
+            self.log.error("Таймаут подключения к WebSocket")
             return False
-    
+        return True
+
+    def _run(self):
+        """Цикл соединения: run_forever, а после обрыва - пауза и новое подключение"""
+        attempt = 0
+        while self.running:
+            self._opened = False
+            try:
+                self.ws = websocket.WebSocketApp(
+                    self.ws_url,
+                    on_open=self.on_open,
+                    on_message=self.on_message,
+                    on_error=self.on_error,
+                    on_close=self.on_close
+                )
+                # Пинги обнаруживают «зависшее» соединение, например после перезагрузки принтера
+                self.ws.run_forever(ping_interval=20, ping_timeout=10)
+            except Exception as e:
+                self.log.error("Ошибка соединения: %s", e)
+            if not self.running or not self.reconnect:
+                break
+            if self._opened:
+                attempt = 0
+            delay = self.backoff_delay(attempt)
+            attempt += 1
+            self.log.warning("Переподключение к %s через %.1f сек...", self.ws_url, delay)
+            self._stop.wait(delay)
+
+    def backoff_delay(self, attempt):
+        return backoff_delay(attempt, self.backoff_initial, self.backoff_max)
+
     def wait_for_klippy_ready(self, timeout=30):
         """Ожидает, пока Klippy не будет готов"""
-        print_info(f"Ожидание готовности Klippy (таймаут: {timeout} сек)...")
-        
-        # Запрашиваем информацию о сервере
-        self.get_server_info()
+        self.log.info("Ожидание готовности Klippy (таймаут: %s сек)...", timeout)
         
         # Ожидаем, пока Klippy не будет готов
         if not self.klippy_ready_event.wait(timeout=timeout):
-            print_error("Таймаут ожидания готовности Klippy")
+            self.log.error("Таймаут ожидания готовности Klippy")
             return False
         
         return True
-    
+
+    def get_next_id(self):
+        """Возвращает уникальный ID для запроса"""
+        with self._id_lock:
+            self.request_id += 1
+            return self.request_id
+
+    def send_request(self, method, params=None):
+        """Отправляет JSON-RPC запрос и возвращает Future с результатом ответа.
+
+        id запроса сохраняется в future.request_id.
+        """
+        future = concurrent.futures.Future()
+        request_id = future.request_id = self.get_next_id()
+        request = {"jsonrpc": "2.0", "method": method, "id": request_id}
+        if params is not None:
+            request["params"] = params
+        with self._pending_lock:
+            # Проверка и регистрация под одной блокировкой с _fail_pending: запрос,
+            # отправленный в момент закрытия, сразу получает ошибку, а не ждет таймаута
+            if not self.connected:
+                future.set_exception(ConnectionError(f"Нет соединения для {method}"))
+                return future
+            self._pending[request_id] = future
+        try:
+            self.ws.send(json_codec.dumps_str(request))
+        except Exception as e:
+            # Future завершает тот, кто забрал его из _pending (здесь или _fail_pending)
+            with self._pending_lock:
+                owned = self._pending.pop(request_id, None) is future
+            if owned:
+                future.set_exception(ConnectionError(f"Не удалось отправить {method}: {e}"))
+        return future
+
+    def call(self, method, params=None, timeout=None):
+        """Выполняет JSON-RPC запрос и ждет результат.
+
+        Нельзя вызывать из обработчиков сообщений: ответ читается тем же потоком.
+        """
+        future = self.send_request(method, params)
+        try:
+            return future.result(timeout or self.request_timeout)
+        except concurrent.futures.TimeoutError:
+            with self._pending_lock:
+                self._pending.pop(future.request_id, None)
+            raise
+
+    def _fail_pending(self, error):
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _spawn(self, target):
+        """Запускает блокирующую операцию вне потока чтения сообщений"""
+        threading.Thread(target=target, daemon=True).start()
+
+    def _initialize(self):
+        """После (пере)подключения: состояние Klippy, подписка и полная синхронизация"""
+        try:
+            info = self.call("server.info")
+        except Exception as e:
+            self.log.error("Ошибка запроса информации о сервере: %s", e)
+            return
+        klippy_state = info.get("klippy_state")
+        self.log.info("Состояние Klippy: %s", klippy_state)
+        self._set_klippy_state(klippy_state)
+
+        # Если Klippy еще запускается, подписка произойдет по notify_klippy_ready
+        if klippy_state == "ready":
+            self.subscribe_objects_status()
+
     def subscribe_objects_status(self):
-        """Подписка на обновления объектов принтера"""
+        """Подписка на обновления объектов принтера.
+
+        Ответ на подписку содержит текущие значения всех объектов, ими
+        состояние синхронизируется целиком - важно после переподключения.
+        """
         if not self.connected or not self.klippy_ready_event.is_set():
-            print_error("Невозможно подписаться: соединение не установлено или Klippy не готов")
+            self.log.error("Невозможно подписаться: соединение не установлено или Klippy не готов")
             return False
         
-        print_info("Подписка на обновления объектов принтера...")
-        
-        request = {
-            "jsonrpc": "2.0",
-            "method": "printer.objects.subscribe",
-            "params": {
-                "objects": self.subscribe_objects
-            },
-            "id": self.get_next_id()
-        }
-        
-        self.ws.send(json.dumps(request))
+        self.log.info("Подписка на обновления объектов принтера...")
+        try:
+            result = self.call("printer.objects.subscribe", {"objects": self.subscribe_objects})
+        except Exception as e:
+            self.log.error("Ошибка подписки: %s", e)
+            return False
+        self._apply_status(result.get("status", {}))
         return True
-    
-    def get_next_id(self):
-        """Возвращает уникальный ID для запроса"""
-        self.request_id += 1
-        return self.request_id
-    
+
+    def _apply_status(self, status):
+        self.printer_state.apply(status)
+        if self.store is not None:
+            self.store.apply(self.printer_id, status)
+
+    def _set_klippy_state(self, klippy_state, online=True):
+        self.printer_state.meta["klippy_state"] = klippy_state
+        if klippy_state == "ready":
+            self.klippy_ready_event.set()
+        else:
+            self.klippy_ready_event.clear()
+        if self.store is not None:
+            self.store.apply(self.printer_id, {"meta": {"host": self.host, "port": self.port,
+                                                        "online": online, "klippy_state": klippy_state}})
+
     def on_open(self, ws):
         """Обработчик открытия соединения"""
-        print_success("WebSocket соединение установлено")
+        if self.reconnects or self.connection_event.is_set():
+            self.reconnects += 1
+            self.log.info("WebSocket соединение восстановлено (переподключений: %d)", self.reconnects)
+        else:
+            self.log.info("WebSocket соединение установлено")
+        self._opened = True
         self.connected = True
         self.connection_event.set()
+        # Запросы ждут ответов, которые читает этот же поток, поэтому - в отдельном
+        self._spawn(self._initialize)
     
     def on_message(self, ws, message):
         """Обработчик полученных сообщений"""
         try:
-            data = json.loads(message)
-            
-            # Обрабатываем ответы на запросы
-            if "id" in data:
-                self.handle_response(data)
-            # Обрабатываем уведомления
-            elif "method" in data and data["method"] == "notify_status_update":
-                self.handle_status_update(data["params"][0])
-            # Обрабатываем события Klippy
-            elif "method" in data and data["method"].startswith("notify_"):
-                self.handle_notification(data)
-        except json.JSONDecodeError:
-            print_error(f"Ошибка декодирования JSON: {message}")
+            with tracing.span("ws.message", url=self.ws_url, bytes=len(message)):
+                data = json_codec.loads(message)
+
+                # Обрабатываем ответы на запросы
+                if "id" in data:
+                    self.handle_response(data)
+                # Обрабатываем уведомления
+                elif "method" in data and data["method"] == "notify_status_update":
+                    self.handle_status_update(data["params"][0])
+                # Обрабатываем события Klippy
+                elif "method" in data and data["method"].startswith("notify_"):
+                    self.handle_notification(data)
+        except json_codec.JSONDecodeError:
+            self.log.error("Ошибка декодирования JSON: %s", message)
         except Exception as e:
-            print_error(f"Ошибка обработки сообщения: {e}")
+            self.log.error("Ошибка обработки сообщения: %s", e)
     
     def on_error(self, ws, error):
         """Обработчик ошибок соединения"""
-        print_error(f"WebSocket ошибка: {error}")
+        self.log.error("WebSocket ошибка: %s", error)
     
     def on_close(self, ws, close_status_code, close_msg):
         """Обработчик закрытия соединения"""
-        print_info(f"WebSocket соединение закрыто: {close_status_code} - {close_msg}")
+        self.log.info("WebSocket соединение закрыто: %s - %s", close_status_code, close_msg)
         self.connected = False
+        self._fail_pending(ConnectionError("WebSocket соединение закрыто"))
+        # Пока соединения нет, панель должна видеть принтер недоступным, а не устаревшие данные
+        self._set_klippy_state("disconnected", online=False)
     
     def handle_response(self, data):
-        """Обрабатывает ответы на запросы"""
-        if "error" in data:
-            print_error(f"Ошибка запроса #{data['id']}: {data['error']['message']}")
+        """Передает ответ на запрос ожидающему его Future"""
+        with self._pending_lock:
+            future = self._pending.pop(data["id"], None)
+        if future is None or future.done():
+            # Ответ на запрос, который уже никто не ждет (например, по таймауту)
             return
-        
-        # Обработка ответа на запрос информации о сервере
-        if data.get("id") in [1, 2] and "result" in data:
-            if "klippy_state" in data["result"]:
-                klippy_state = data["result"]["klippy_state"]
-                print_info(f"Состояние Klippy: {klippy_state}")
-                
-                self.printer_state["klippy_state"] = klippy_state
-                
-                if klippy_state == "ready":
-                    self.klippy_ready_event.set()
-                    
-                    # Как только Klippy готов, подписываемся на обновления
-                    self.subscribe_objects_status()
+        if "error" in data:
+            message = data["error"].get("message")
+            self.log.error("Ошибка запроса #%s: %s", data['id'], message)
+            future.set_exception(MoonrakerRPCError(message))
+        else:
+            future.set_result(data.get("result"))
     
     def handle_status_update(self, status_data):
         """Обрабатывает обновления статуса объектов"""
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-        print_event(f"[{timestamp}] Получено обновление статуса:")
-        
-        # Проверяем основные компоненты
-        if "print_stats" in status_data:
-            state = status_data["print_stats"].get("state")
-            if state:
-                print_status(f"Состояние печати: {state}")
-        
-        if "extruder" in status_data:
-            ext_data = status_data["extruder"]
-            if "temperature" in ext_data:
-                temp = ext_data["temperature"]
-                target = ext_data.get("target", 0)
-                print_status(f"Экструдер: {temp:.1f}°C / {target:.1f}°C")
-        
-        if "heater_bed" in status_data:
-            bed_data = status_data["heater_bed"]
-            if "temperature" in bed_data:
-                temp = bed_data["temperature"]
-                target = bed_data.get("target", 0)
-                print_status(f"Стол: {temp:.1f}°C / {target:.1f}°C")
-        
-        if "virtual_sdcard" in status_data:
-            vsd = status_data["virtual_sdcard"]
-            if "progress" in vsd:
-                progress = vsd["progress"] * 100
-                print_status(f"Прогресс: {progress:.1f}%")
-        
-        if "toolhead" in status_data:
-            th = status_data["toolhead"]
-            if "position" in th:
-                pos = th["position"]
-                print_status(f"Позиция: X={pos[0]:.2f} Y={pos[1]:.2f} Z={pos[2]:.2f}")
-        
-        if "gcode_move" in status_data:
-            gm = status_data["gcode_move"]
-            if "speed_factor" in gm:
-                speed = gm["speed_factor"] * 60 * 100
-                print_status(f"Скорость: {speed:.0f}%")
+        self._apply_status(status_data)
+        if not self.verbose or not self.log.isEnabledFor(logging.INFO):
+            return
+        # Одна запись на обновление: основные поля в тексте, сама дельта - в поле status
+        parts = []
+        state = status_data.get("print_stats", {}).get("state")
+        if state:
+            parts.append(f"печать: {state}")
+        for name, label in (("extruder", "экструдер"), ("heater_bed", "стол")):
+            if "temperature" in status_data.get(name, {}):
+                target = getattr(self.printer_state, name).get("target", 0)
+                parts.append(f"{label}: {status_data[name]['temperature']:.1f}°C / {target:.1f}°C")
+        if "progress" in status_data.get("virtual_sdcard", {}):
+            parts.append(f"прогресс: {status_data['virtual_sdcard']['progress'] * 100:.1f}%")
+        if "position" in status_data.get("toolhead", {}):
+            pos = status_data["toolhead"]["position"]
+            parts.append(f"позиция: X={pos[0]:.2f} Y={pos[1]:.2f} Z={pos[2]:.2f}")
+        if "speed_factor" in status_data.get("gcode_move", {}):
+            parts.append(f"скорость: {status_data['gcode_move']['speed_factor'] * 100:.0f}%")
+        self.log.info("Обновление статуса: %s", "; ".join(parts) or "-", extra={"status": status_data})
     
     def handle_notification(self, data):
         """Обрабатывает уведомления от сервера"""
         method = data["method"]
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
         
-        if method == "notify_klippy_disconnected":
-            print_event(f"[{timestamp}] KLIPPY ОТКЛЮЧЕН")
-            self.printer_state["klippy_state"] = "disconnected"
-            self.klippy_ready_event.clear()
+        if method in ("notify_klippy_disconnected", "notify_klippy_shutdown"):
+            self.log.warning("Klippy отключен (%s)", method)
+            self._set_klippy_state("shutdown" if method == "notify_klippy_shutdown" else "disconnected")
         
         elif method == "notify_klippy_ready":
-            print_event(f"[{timestamp}] KLIPPY ГОТОВ")
-            self.printer_state["klippy_state"] = "ready"
-            self.klippy_ready_event.set()
+            self.log.info("Klippy готов")
+            self._set_klippy_state("ready")
             
-            # Подписываемся на обновления объектов
-            self.subscribe_objects_status()
+            # Klippy перезапустился: подписка сбросилась, подписываемся заново
+            self._spawn(self.subscribe_objects_status)
         
         elif method == "notify_gcode_response":
             message = data["params"][0]
-            print_event(f"[{timestamp}] G-CODE: {message}")
+            self.log.info("G-CODE: %s", message)
         
         else:
-            print_event(f"[{timestamp}] {method}")
+            self.log.debug("Уведомление %s", method)
     
     def get_server_info(self):
-        """Запрашивает информацию о сервере"""
+        """Запрашивает информацию о сервере; возвращает Future с ответом"""
         if not self.connected:
-            print_error("Невозможно запросить: WebSocket соединение не установлено")
-            return
+            self.log.error("Невозможно запросить: WebSocket соединение не установлено")
+            return None
         
-        print_info("Запрос информации о сервере...")
-        
-        request = {
-            "jsonrpc": "2.0",
-            "method": "server.info",
-            "id": self.get_next_id()
-        }
-        
-        self.ws.send(json.dumps(request))
+        self.log.info("Запрос информации о сервере...")
+        return self.send_request("server.info")
     
     def close(self):
         """Закрывает соединение с сервером"""
         self.running = False
-        if self.connected and self.ws:
+        self._stop.set()
+        self.connected = False
+        if self.ws:
             self.ws.close()
+        self._fail_pending(ConnectionError("WebSocket клиент закрыт"))
 
 def main():
     parser = argparse.ArgumentParser(description="WebSocket слушатель для Moonraker API")
     parser.add_argument("--host", default="192.168.10.14", help="Хост Moonraker (по умолчанию: 192.168.10.14)")
     parser.add_argument("--port", type=int, default=7125, help="Порт Moonraker (по умолчанию: 7125)")
     parser.add_argument("--timeout", type=int, default=30, help="Таймаут ожидания готовности Klippy (по умолчанию: 30 сек)")
+    parser.add_argument("--object", action="append", dest="objects",
+                        help="Объект подписки: имя или имя=поле1,поле2 (можно несколько; по умолчанию - основные объекты целиком)")
     
     args = parser.parse_args()
+    logs.setup_logging()
+    tracing.configure_from_env("websocket-listener")
+    objects = None
+    if args.objects:
+        objects = {}
+        for item in args.objects:
+            name, _, fields = item.partition("=")
+            objects[name] = fields.split(",") if fields else None
     
-    print_info("=====================================")
-    print_info("    MOONRAKER WEBSOCKET СЛУШАТЕЛЬ    ")
-    print_info("=====================================")
-    print_info(f"Хост: {args.host}")
-    print_info(f"Порт: {args.port}")
+    log.info("=====================================")
+    log.info("    MOONRAKER WEBSOCKET СЛУШАТЕЛЬ    ")
+    log.info("=====================================")
+    log.info("Хост: %s", args.host)
+    log.info("Порт: %s", args.port)
     
     # Создаем WebSocket клиент
-    client = MoonrakerWebsocket(args.host, args.port)
+    client = MoonrakerWebsocket(args.host, args.port, objects=objects)
     
     try:
         # Подключаемся к серверу
@@ -304,23 +400,23 @@ def main():
         
         # Ожидаем готовности Klippy
         if not client.wait_for_klippy_ready(args.timeout):
-            print_warning("Klippy не готов, но продолжаем слушать...")
+            log.warning("Klippy не готов, но продолжаем слушать...")
         
-        print_info("\nСлушаем события принтера... (Нажмите Ctrl+C для выхода)")
-        print_info("---------------------------------------")
+        log.info("Слушаем события принтера... (Нажмите Ctrl+C для выхода)")
+        log.info("---------------------------------------")
         
         # Просто держим основной поток запущенным
         while client.running:
             time.sleep(1)
     
     except KeyboardInterrupt:
-        print_info("\nПрерывание пользователем")
+        log.info("Прерывание пользователем")
     except Exception as e:
-        print_error(f"Неожиданная ошибка: {e}")
+        log.error("Неожиданная ошибка: %s", e)
     finally:
         # Закрываем соединение
         client.close()
-        print_info("Соединение закрыто")
+        log.info("Соединение закрыто")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Мультиплексор WebSocket-соединений Moonraker на одном цикле asyncio.
+
+Все подписки парка живут в одном потоке: каждое соединение - корутина со
+своим переподключением, а входящие обновления идут в общую очередь. Один
+диспетчер вычерпывает очередь, сливает накопившиеся дельты каждого
+принтера и применяет их к PrinterStateStore в отдельном потоке, чтобы
+медленные подписчики хранилища не тормозили чтение сокетов.
+
+Каждый потребитель объявляет, какие поля объектов ему нужны
+(subscribe_fields), и каждый принтер подписан только на объединение этих
+полей. Когда потребители приходят и уходят, подписка пересчитывается и
+соединения переподписываются; поля, на которые принтер больше не подписан,
+удаляются из хранилища, чтобы в нем не оставались устаревшие значения.
+
+По каждому соединению ведутся метрики здоровья (см. WebSocketHub.health).
+"""
+
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import threading
+import time
+
+import aiohttp
+
+from backend.services import json_codec, logs, tracing
+from backend.services.ingest import API_FIELDS, merge_fields
+from backend.services.websocket_listener import MoonrakerRPCError, backoff_delay
+
+log = logs.get_logger("ws_hub")
+
+# Потребитель полей, которые нужны самому веб-интерфейсу
+BASE_CONSUMER = "api"
+
+
+def retained_status(status, objects):
+    """Изменение status только с полями подписки objects; meta сохраняется"""
+    retained = {}
+    for name, fields in status.items():
+        if name != "meta" and name not in objects:
+            continue
+        names = objects.get(name)
+        if names is not None and isinstance(fields, dict):
+            fields = {key: value for key, value in fields.items() if key in names}
+        retained[name] = fields
+    return retained
+
+
+class PrinterConnection:
+    """WebSocket-соединение с Moonraker одного принтера и его метрики"""
+
+    def __init__(self, printer_id, host, port):
+        self.printer_id = printer_id
+        self.host = host
+        self.port = port
+        self.url = f"ws://{host}:{port}/websocket"
+        self.ws = None
+        self.task = None
+        # id запроса -> asyncio.Future ответа
+        self.pending = {}
+        # Подписка, действующая на этом соединении
+        self.objects = None
+
+        self.connected = False
+        self.subscribed = False
+        self.klippy_state = None
+        self.connected_since = None
+        self.connects = 0
+        self.messages = 0
+        self.bytes_received = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_message_at = None
+        # Время ответа на server.info при последнем подключении, с
+        self.rtt = None
+        self.log = logs.printer_logger(log, printer_id, host, port)
+
+    def fail_pending(self, error):
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def health(self, now=None):
+        now = time.monotonic() if now is None else now
+        return {
+            "host": self.host,
+            "port": self.port,
+            "connected": self.connected,
+            "subscribed": self.subscribed,
+            "klippy_state": self.klippy_state,
+            "uptime": now - self.connected_since if self.connected else 0.0,
+            "reconnects": max(0, self.connects - 1),
+            "messages": self.messages,
+            "bytes_received": self.bytes_received,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "idle": now - self.last_message_at if self.last_message_at is not None else None,
+            "rtt": self.rtt,
+            "subscription": self.objects,
+        }
+
+
+class WebSocketHub:
+    """Подписки Moonraker всех принтеров на одном цикле событий.
+
+    Интерфейс как у PrinterPoller: start(), stop() и словарь printers
+    {printer_id: (host, port)}; принтеры можно добавлять и убирать на ходу.
+    objects - поля, нужные всегда (по умолчанию - поля веб-интерфейса).
+    """
+
+    def __init__(self, store, printers=None, objects=None, heartbeat=20.0, request_timeout=10.0,
+                 backoff_initial=1.0, backoff_max=60.0, resubscribe_delay=0.2):
+        self.store = store
+        self.printers = dict(printers or {})
+        self.heartbeat = heartbeat
+        self.request_timeout = request_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        # Переподписка откладывается, чтобы несколько изменений ушли одним запросом
+        self.resubscribe_delay = resubscribe_delay
+
+        # потребитель -> (поля, принтеры или None - все, срок действия или None)
+        self._consumers = {}
+        self._consumers_lock = threading.Lock()
+        self._resubscribe_handle = None
+
+        self.connections = {}
+        self._ids = itertools.count(1)
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._queue = None
+        self._closing = False
+        self._started = threading.Event()
+        # Подписчики хранилища могут ходить в базу, поэтому применение - вне цикла событий
+        self._apply_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                     thread_name_prefix="ws-hub-apply")
+
+        # Метрики диспетчера
+        self.frames = 0
+        self.batches = 0
+        self.applied = 0
+        self.dispatch_lag = 0.0
+
+        self.subscribe_fields(BASE_CONSUMER, API_FIELDS if objects is None else objects)
+
+    # --- управление из других потоков ---
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_loop, name="ws-hub", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._thread.join()
+        self._apply_executor.shutdown(wait=True)
+
+    def add_printer(self, printer_id, host, port):
+        self.printers[printer_id] = (host, port)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._open, printer_id, host, port)
+
+    def remove_printer(self, printer_id):
+        self.printers.pop(printer_id, None)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._close, printer_id)
+
+    def subscribe_fields(self, consumer, fields, printers=None, ttl=None):
+        """Объявляет поля, нужные потребителю: {объект: [поля] или None - все поля}.
+
+        printers - для каких принтеров нужны поля (None - для всех). С ttl
+        объявление действует ttl секунд и должно продлеваться повторным
+        вызовом - так панели, закрытые без уведомления, перестают держать
+        подписку. Повторный вызов заменяет прежнее объявление потребителя.
+        """
+        expires = time.monotonic() + ttl if ttl else None
+        printers = frozenset(printers) if printers is not None else None
+        with self._consumers_lock:
+            self._consumers[consumer] = (fields, printers, expires)
+        self._fields_changed()
+
+    def unsubscribe_fields(self, consumer):
+        with self._consumers_lock:
+            removed = self._consumers.pop(consumer, None)
+        if removed is not None:
+            self._fields_changed()
+
+    def subscription(self, printer_id):
+        """Подписка принтера - объединение полей всех его потребителей"""
+        now = time.monotonic()
+        with self._consumers_lock:
+            declarations = [fields for fields, printers, expires in self._consumers.values()
+                            if (printers is None or printer_id in printers)
+                            and (expires is None or expires > now)]
+        return merge_fields(*declarations)
+
+    def health(self):
+        """Метрики хаба и каждого соединения"""
+        now = time.monotonic()
+        connections = {printer_id: connection.health(now)
+                       for printer_id, connection in list(self.connections.items())}
+        return {
+            "connections": len(connections),
+            "connected": sum(1 for health in connections.values() if health["connected"]),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "frames": self.frames,
+            "batches": self.batches,
+            "applied": self.applied,
+            "dispatch_lag": self.dispatch_lag,
+            "printers": connections,
+        }
+
+    # --- цикл событий ---
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        self._queue = asyncio.Queue()
+        self._stopped = asyncio.Event()
+        # По умолчанию aiohttp ограничивает сессию 100 соединениями, а WebSocket держит свое постоянно
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+        dispatcher = asyncio.ensure_future(self._dispatch())
+        expirer = asyncio.ensure_future(self._expire_consumers())
+        for printer_id, (host, port) in self.printers.items():
+            self._open(printer_id, host, port)
+        self._started.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            self._closing = True
+            tasks = [self._close(printer_id) for printer_id in list(self.connections)]
+            await asyncio.gather(*[task for task in tasks if task is not None], return_exceptions=True)
+            await self._queue.join()
+            dispatcher.cancel()
+            expirer.cancel()
+            await self._session.close()
+
+    async def _shutdown(self):
+        self._stopped.set()
+
+    def _open(self, printer_id, host, port):
+        self._close(printer_id)
+        connection = PrinterConnection(printer_id, host, port)
+        connection.task = asyncio.ensure_future(self._run_connection(connection))
+        self.connections[printer_id] = connection
+
+    def _close(self, printer_id):
+        connection = self.connections.pop(printer_id, None)
+        if connection is None or connection.task is None:
+            return None
+        connection.task.cancel()
+        return connection.task
+
+    async def _run_connection(self, connection):
+        """Соединение одного принтера: подключение, чтение, переподключение с паузой"""
+        attempt = 0
+        while not self._closing:
+            try:
+                async with self._session.ws_connect(connection.url, heartbeat=self.heartbeat,
+                                                    max_msg_size=0) as ws:
+                    attempt = 0
+                    connection.ws = ws
+                    connection.connected = True
+                    connection.connects += 1
+                    connection.connected_since = time.monotonic()
+                    connection.log.info("WebSocket соединение установлено (подключений: %d)", connection.connects)
+                    initialize = asyncio.ensure_future(self._initialize(connection))
+                    try:
+                        await self._read(connection, ws)
+                    finally:
+                        initialize.cancel()
+            except asyncio.CancelledError:
+                self._disconnected(connection, ConnectionError("Соединение закрыто хабом"))
+                raise
+            except Exception as e:
+                connection.errors += 1
+                connection.last_error = str(e) or type(e).__name__
+                # Недоступный принтер не засыпает журнал: повторные неудачи - только на уровне DEBUG
+                connection.log.log(logging.WARNING if attempt == 0 else logging.DEBUG,
+                                   "Ошибка WebSocket соединения: %s", connection.last_error)
+            self._disconnected(connection, ConnectionError("WebSocket соединение закрыто"))
+            if self._closing:
+                break
+            await asyncio.sleep(backoff_delay(attempt, self.backoff_initial, self.backoff_max))
+            attempt += 1
+
+    def _disconnected(self, connection, error):
+        was_online = connection.connected or connection.connects == 0
+        connection.ws = None
+        connection.connected = False
+        connection.subscribed = False
+        connection.klippy_state = "disconnected"
+        connection.fail_pending(error)
+        if was_online:
+            # Пока соединения нет, панель должна видеть принтер недоступным
+            self._enqueue(connection.printer_id, {"meta": {"host": connection.host, "port": connection.port,
+                                                           "online": False, "klippy_state": "disconnected"}})
+
+    async def _read(self, connection, ws):
+        async for message in ws:
+            if message.type == aiohttp.WSMsgType.TEXT:
+                connection.messages += 1
+                connection.bytes_received += len(message.data)
+                connection.last_message_at = time.monotonic()
+                with tracing.span("ws.message", printer=connection.printer_id, bytes=len(message.data)):
+                    try:
+                        data = json_codec.loads(message.data)
+                    except json_codec.JSONDecodeError:
+                        connection.errors += 1
+                        continue
+                    self._handle_message(connection, data)
+            elif message.type == aiohttp.WSMsgType.ERROR:
+                raise ws.exception() or ConnectionError("Ошибка WebSocket")
+
+    def _handle_message(self, connection, data):
+        if "id" in data:
+            future = connection.pending.pop(data["id"], None)
+            if future is None or future.done():
+                return
+            if "error" in data:
+                future.set_exception(MoonrakerRPCError(data["error"].get("message")))
+            else:
+                future.set_result(data.get("result"))
+            return
+
+        method = data.get("method")
+        if method == "notify_status_update":
+            self._enqueue(connection.printer_id, data["params"][0])
+        elif method == "notify_klippy_ready":
+            self._set_klippy_state(connection, "ready")
+            # Klippy перезапустился: подписка сбросилась, подписываемся заново
+            asyncio.ensure_future(self._subscribe(connection))
+        elif method in ("notify_klippy_disconnected", "notify_klippy_shutdown"):
+            connection.subscribed = False
+            self._set_klippy_state(connection, "shutdown" if method == "notify_klippy_shutdown" else "disconnected")
+
+    async def request(self, connection, method, params=None):
+        """JSON-RPC запрос по соединению принтера; возвращает result ответа"""
+        if connection.ws is None:
+            raise ConnectionError(f"Нет соединения с принтером {connection.printer_id}")
+        request_id = next(self._ids)
+        request = {"jsonrpc": "2.0", "method": method, "id": request_id}
+        if params is not None:
+            request["params"] = params
+        future = asyncio.get_running_loop().create_future()
+        connection.pending[request_id] = future
+        try:
+            await connection.ws.send_str(json_codec.dumps_str(request))
+            return await asyncio.wait_for(future, self.request_timeout)
+        finally:
+            connection.pending.pop(request_id, None)
+
+    async def _initialize(self, connection):
+        """После (пере)подключения: сведения о принтере, подписка и полная синхронизация"""
+        try:
+            started = time.monotonic()
+            server_info = await self.request(connection, "server.info")
+            connection.rtt = time.monotonic() - started
+            meta = {"moonraker_version": server_info.get("moonraker_version")}
+            klippy_state = server_info.get("klippy_state")
+            if klippy_state == "ready":
+                printer_info = await self.request(connection, "printer.info")
+                meta.update(hostname=printer_info.get("hostname"), model=printer_info.get("model"),
+                            software_version=printer_info.get("software_version"))
+            self._set_klippy_state(connection, klippy_state, meta)
+            if klippy_state == "ready":
+                await self._subscribe(connection)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            connection.errors += 1
+            connection.last_error = f"Инициализация: {e}"
+            connection.log.warning("%s", connection.last_error)
+
+    async def _subscribe(self, connection):
+        """Подписка на поля принтера; ответ содержит их текущие значения целиком.
+
+        Новая подписка Moonraker заменяет прежнюю на этом соединении.
+        """
+        objects = self.subscription(connection.printer_id)
+        try:
+            result = await self.request(connection, "printer.objects.subscribe", {"objects": objects})
+        except (ConnectionError, MoonrakerRPCError, asyncio.TimeoutError) as e:
+            connection.errors += 1
+            connection.last_error = f"Подписка: {e}"
+            connection.log.warning("%s", connection.last_error)
+            return
+        connection.subscribed = True
+        connection.objects = objects
+        self._enqueue(connection.printer_id, result.get("status", {}), retain=objects)
+
+    def _fields_changed(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._schedule_resubscribe)
+
+    def _schedule_resubscribe(self):
+        if self._resubscribe_handle is None:
+            self._resubscribe_handle = self._loop.call_later(self.resubscribe_delay, self._resubscribe)
+
+    def _resubscribe(self):
+        self._resubscribe_handle = None
+        for connection in self.connections.values():
+            if connection.subscribed and self.subscription(connection.printer_id) != connection.objects:
+                asyncio.ensure_future(self._subscribe(connection))
+
+    async def _expire_consumers(self):
+        """Снимает объявления полей, которые не продлили вовремя"""
+        while True:
+            await asyncio.sleep(1.0)
+            now = time.monotonic()
+            with self._consumers_lock:
+                expired = [consumer for consumer, (_, _, expires) in self._consumers.items()
+                           if expires is not None and expires <= now]
+                for consumer in expired:
+                    del self._consumers[consumer]
+            if expired:
+                self._schedule_resubscribe()
+
+    def _set_klippy_state(self, connection, klippy_state, meta=None):
+        connection.klippy_state = klippy_state
+        meta = dict(meta or {}, host=connection.host, port=connection.port, online=True,
+                    klippy_state=klippy_state)
+        self._enqueue(connection.printer_id, {"meta": meta})
+
+    # --- диспетчер ---
+
+    def _enqueue(self, printer_id, status, retain=None):
+        """retain - новая подписка принтера: поля вне ее удаляются из хранилища"""
+        self.frames += 1
+        self._queue.put_nowait((printer_id, status, time.monotonic(), retain))
+
+    async def _dispatch(self):
+        """Вычерпывает очередь, сливает дельты по принтерам и применяет их пачкой"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            items = [item]
+            while not self._queue.empty():
+                items.append(self._queue.get_nowait())
+
+            batch = {}
+            retains = {}
+            for printer_id, status, _, retain in items:
+                merged = batch.setdefault(printer_id, {})
+                if retain is not None:
+                    # Дельты до переподписки по снятым полям уже не нужны
+                    retains[printer_id] = retain
+                    merged = batch[printer_id] = retained_status(merged, retain)
+                for name, fields in status.items():
+                    if isinstance(fields, dict):
+                        merged.setdefault(name, {}).update(fields)
+                    else:
+                        merged[name] = fields
+            try:
+                await loop.run_in_executor(self._apply_executor, self._apply_batch, batch, retains)
+            except Exception as e:
+                log.exception("Ошибка применения обновлений состояния")
+            finally:
+                self.batches += 1
+                self.dispatch_lag = time.monotonic() - items[0][2]
+                for _ in items:
+                    self._queue.task_done()
+
+    def _apply_batch(self, batch, retains):
+        with tracing.span("ws.apply_batch", printers=len(batch)):
+            for printer_id, status in batch.items():
+                if printer_id in retains:
+                    self.store.retain(printer_id, retains[printer_id])
+                self.store.apply(printer_id, status)
+                self.applied += 1
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк движка оповещений (AlertEngine).
+
+Парк из --printers принтеров с --rules правилами на принтер (встроенные плюс
+сгенерированные пороги по разным объектам). Каждая дельта меняет одно-два
+поля; сравнивается вычисление только правил, чьи поля изменились (индекс
+по полям), с вычислением всех правил принтера на каждую дельту.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.services.alerts import AlertEngine, DEFAULT_RULES
+from backend.services.printer_state import PrinterState
+
+# Объекты, по которым генерируются дополнительные правила-пороги
+GENERATED_FIELDS = [
+    ("temperature_sensor_chamber", "temperature"),
+    ("temperature_fan_mcu", "temperature"),
+    ("fan", "speed"),
+    ("heater_bed", "power"),
+    ("extruder", "power"),
+    ("toolhead", "max_velocity"),
+]
+
+
+def make_rules(printers, per_printer):
+    """Встроенные правила для всех принтеров и пороги для каждого принтера отдельно"""
+    rules = list(DEFAULT_RULES)
+    for printer_id in range(printers):
+        for i in range(max(0, per_printer - len(DEFAULT_RULES))):
+            name, field = GENERATED_FIELDS[i % len(GENERATED_FIELDS)]
+            rules.append({"name": f"p{printer_id}_{name}_{field}_{i}", "printers": [printer_id],
+                          "when": f"{name}.{field} > {100 + i}", "for": 10})
+    return rules
+
+
+def make_delta(rng, tick):
+    delta = {"extruder": {"temperature": 210.0 + rng.uniform(-3, 3)}}
+    if tick % 4 == 0:
+        delta["virtual_sdcard"] = {"file_position": tick * 100}
+    return delta
+
+
+class FullScanEngine(AlertEngine):
+    """Без индекса: все правила принтера на каждую дельту"""
+
+    def rules_for(self, printer_id, delta):
+        return [rule for rule in self.rules if rule.printers is None or printer_id in rule.printers]
+
+
+def run(engine_cls, rules, printers, updates, seed):
+    rng = random.Random(seed)
+    engine = engine_cls(None, rules)
+    states = {}
+    for printer_id in range(printers):
+        state = states[printer_id] = PrinterState()
+        initial = {"meta": {"online": True, "klippy_state": "ready"},
+                   "print_stats": {"state": "printing"},
+                   "extruder": {"temperature": 210.0, "target": 210.0},
+                   "heater_bed": {"temperature": 60.0, "target": 60.0}}
+        engine.on_state_change(printer_id, state.apply(initial), state)
+
+    started = time.perf_counter()
+    for tick in range(updates):
+        printer_id = tick % printers
+        state = states[printer_id]
+        delta = state.apply(make_delta(rng, tick))
+        engine.on_state_change(printer_id, delta, state)
+    elapsed = time.perf_counter() - started
+    return {"rules": len(engine.rules), "updates": updates, "evaluations": engine.evaluations,
+            "seconds": elapsed, "updates_per_second": updates / elapsed if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк движка оповещений")
+    parser.add_argument("--printers", type=int, default=200, help="Число принтеров (по умолчанию: 200)")
+    parser.add_argument("--rules", type=int, default=20, help="Правил на принтер (по умолчанию: 20)")
+    parser.add_argument("--updates", type=int, default=50000, help="Число дельт (по умолчанию: 50000)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    args = parser.parse_args()
+
+    rules = make_rules(args.printers, args.rules)
+    results = {
+        "indexed": run(AlertEngine, rules, args.printers, args.updates, args.seed),
+        "full_scan": run(FullScanEngine, rules, args.printers, args.updates, args.seed),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, values in results.items():
+        print(f"{name:9s} правил: {values['rules']:>6d}   вычислений: {values['evaluations']:>9d}   "
+              f"дельт/с: {values['updates_per_second']:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
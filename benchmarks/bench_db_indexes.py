@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк запросов планировщика и истории задач до и после миграции схемы.
+
+Создает базу в старой схеме (строковые даты, без индексов), замеряет запросы и
+план их выполнения, затем прогоняет миграцию DBModel и повторяет замеры.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.db.data_model import DBModel
+
+LEGACY_SCHEMA = """
+CREATE TABLE printers (id INTEGER PRIMARY KEY, name VARCHAR, last_service VARCHAR);
+CREATE TABLE materials (id INTEGER PRIMARY KEY, name VARCHAR, nozzle_tmp VARCHAR, table_tmp VARCHAR);
+CREATE TABLE coils (id INTEGER PRIMARY KEY, name VARCHAR, material_id INTEGER REFERENCES materials(id), remains FLOAT);
+CREATE TABLE projects (id INTEGER PRIMARY KEY, name VARCHAR, "desc" TEXT);
+CREATE TABLE tasks (id INTEGER PRIMARY KEY, printer_id INTEGER REFERENCES printers(id),
+    coil_id INTEGER REFERENCES coils(id), material_amount FLOAT, project_id INTEGER REFERENCES projects(id),
+    time_start VARCHAR, time_end VARCHAR, progress INTEGER, model_gcode TEXT);
+"""
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Запросы в том виде, в котором их строит DBModel; {queued} отличается между схемами
+QUERIES = {
+    "printer_queue": (
+        "SELECT id, printer_id, coil_id, time_start FROM tasks "
+        "WHERE printer_id = :printer_id AND {queued} ORDER BY id DESC LIMIT 50"
+    ),
+    "printer_history": (
+        "SELECT id, printer_id, time_start, time_end FROM tasks "
+        "WHERE printer_id = :printer_id AND time_start >= :since AND time_start < :until "
+        "ORDER BY id DESC LIMIT 50"
+    ),
+    "fleet_time_range": (
+        "SELECT id, printer_id, time_start, time_end FROM tasks "
+        "WHERE time_start >= :since AND time_start < :until ORDER BY id DESC LIMIT 50"
+    ),
+    "coil_usage": (
+        "SELECT SUM(material_amount) FROM tasks WHERE coil_id = :coil_id"
+    ),
+}
+
+QUEUED_CONDITION = {
+    "legacy": "time_start IS NULL",
+    "migrated": "status = 'queued'",
+}
+
+
+def populate_legacy(path, tasks, printers, seed=42):
+    """Заполняет базу старой схемы случайной историей задач"""
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.executemany("INSERT INTO printers (id, name) VALUES (?, ?)",
+                     [(i, f"Принтер {i}") for i in range(1, printers + 1)])
+    conn.execute("INSERT INTO materials (id, name, nozzle_tmp, table_tmp) VALUES (1, 'PLA', '210', '60')")
+    conn.executemany("INSERT INTO coils (id, name, material_id, remains) VALUES (?, ?, 1, 1000)",
+                     [(i, f"Катушка {i}") for i in range(1, printers + 1)])
+    conn.execute("INSERT INTO projects (id, name) VALUES (1, 'Проект')")
+
+    start = datetime(2023, 1, 1)
+    rows = []
+    for task_id in range(1, tasks + 1):
+        printer_id = rnd.randint(1, printers)
+        queued = rnd.random() < 0.02
+        time_start = start + timedelta(minutes=task_id * 7)
+        time_end = time_start + timedelta(hours=rnd.randint(1, 12))
+        rows.append((task_id, printer_id, printer_id, rnd.uniform(5, 200), 1,
+                     None if queued else time_start.strftime(TIME_FORMAT),
+                     None if queued else time_end.strftime(TIME_FORMAT),
+                     0 if queued else 100, "G1 X0 Y0\n" * 20))
+    conn.executemany("INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return start, start + timedelta(minutes=tasks * 7)
+
+
+def run_queries(path, schema, params, repeat):
+    conn = sqlite3.connect(path)
+    results = {}
+    for name, sql in QUERIES.items():
+        sql = sql.format(queued=QUEUED_CONDITION[schema])
+        plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        started = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(sql, params).fetchall()
+        elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+        results[name] = {"ms": round(elapsed_ms, 3), "plan": plan}
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк индексов и типизированных колонок базы задач")
+    parser.add_argument("--tasks", type=int, default=100000, help="Количество задач (по умолчанию: 100000)")
+    parser.add_argument("--printers", type=int, default=50, help="Количество принтеров (по умолчанию: 50)")
+    parser.add_argument("--repeat", type=int, default=20, help="Повторов каждого запроса (по умолчанию: 20)")
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        first, last = populate_legacy(path, args.tasks, args.printers)
+        middle = first + (last - first) / 2
+        params = {
+            "printer_id": 7,
+            "coil_id": 7,
+            "since": middle.strftime(TIME_FORMAT),
+            "until": (middle + timedelta(days=3)).strftime(TIME_FORMAT),
+        }
+
+        before = run_queries(path, "legacy", params, args.repeat)
+        started = time.perf_counter()
+        DBModel(path)
+        migration_s = time.perf_counter() - started
+        after = run_queries(path, "migrated", params, args.repeat)
+
+    report = {
+        "tasks": args.tasks,
+        "printers": args.printers,
+        "migration_s": round(migration_s, 3),
+        "queries": {name: {"before": before[name], "after": after[name]} for name in QUERIES},
+    }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"Задач: {args.tasks}, принтеров: {args.printers}, миграция: {migration_s:.2f} с")
+    for name in QUERIES:
+        b, a = before[name], after[name]
+        speedup = b["ms"] / a["ms"] if a["ms"] else float("inf")
+        print(f"\n{name}: {b['ms']:.3f} мс -> {a['ms']:.3f} мс (x{speedup:.1f})")
+        print(f"  до:    {'; '.join(b['plan'])}")
+        print(f"  после: {'; '.join(a['plan'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк прореживания изменений состояния (StatusFanout).
+
+Имитирует парк, где каждый принтер присылает обновления с частотой --rate:
+шум температуры и дрожание позиции, изредка - значимые изменения. Сравнивает
+число вызовов потребителя при прямой подписке на хранилище и через StatusFanout.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.services.fanout import StatusFanout
+from backend.services.state_store import PrinterStateStore
+
+
+def make_delta(rng, tick, rate):
+    delta = {
+        "extruder": {"temperature": 210.0 + rng.uniform(-0.05, 0.05)},
+        "heater_bed": {"temperature": 60.0 + rng.uniform(-0.05, 0.05)},
+        "toolhead": {"position": [100.0 + rng.uniform(-0.02, 0.02), 100.0 + rng.uniform(-0.02, 0.02), 2.4]},
+    }
+    # Раз в 10 секунд - значимое изменение (смена слоя, рост прогресса)
+    if tick % (rate * 10) == 0:
+        delta["toolhead"]["position"][2] += 0.2 * (tick // (rate * 10))
+        delta["virtual_sdcard"] = {"progress": tick / 100000}
+    return delta
+
+
+def run(printers, seconds, rate, window, use_fanout, seed):
+    rng = random.Random(seed)
+    store = PrinterStateStore()
+    calls = [0]
+
+    def consumer(printer_id, delta, state):
+        calls[0] += 1
+
+    fanout = None
+    if use_fanout:
+        fanout = StatusFanout(store, window=window)
+        fanout.subscribe(consumer)
+        store.subscribe(fanout._on_change)
+    else:
+        store.subscribe(consumer)
+
+    ticks = seconds * rate
+    started = time.perf_counter()
+    for tick in range(ticks):
+        for printer_id in range(printers):
+            store.apply(printer_id, make_delta(rng, tick, rate))
+        if fanout is not None:
+            # Имитируемое время: окна раздачи и max_hold без ожидания реального времени
+            fanout.flush(now=tick / rate)
+    if fanout is not None:
+        fanout.flush(force=True, now=seconds)
+    elapsed = time.perf_counter() - started
+    return {"updates": ticks * printers, "consumer_calls": calls[0], "seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк прореживания изменений состояния")
+    parser.add_argument("--printers", type=int, default=200, help="Число принтеров (по умолчанию: 200)")
+    parser.add_argument("--seconds", type=int, default=60, help="Имитируемая длительность, с (по умолчанию: 60)")
+    parser.add_argument("--rate", type=int, default=4, help="Обновлений в секунду на принтер (по умолчанию: 4)")
+    parser.add_argument("--window", type=float, default=0.25, help="Окно раздачи, с (по умолчанию: 0.25)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    args = parser.parse_args()
+
+    results = {
+        "direct": run(args.printers, args.seconds, args.rate, args.window, False, args.seed),
+        "fanout": run(args.printers, args.seconds, args.rate, args.window, True, args.seed),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, values in results.items():
+        print(f"{name:7s} обновлений: {values['updates']:>8d}   вызовов потребителя: {values['consumer_calls']:>8d}   "
+              f"время: {values['seconds']:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
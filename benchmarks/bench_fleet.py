@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Набор бенчмарков сбора данных с парка на имитаторе Moonraker (moonraker_sim.py).
+
+Замеры:
+- poll: длительность цикла HTTP-опроса (PrinterPoller) в зависимости от числа принтеров;
+- subscribe: подписки WebSocket (WebSocketHub) на том же числе принтеров -
+  время подключения, сообщений в секунду и сообщений на секунду процессора;
+- api: задержки /api/state и /api/printers (p50/p99) при параллельных клиентах;
+- db: скорость записи телеметрии через очередь записи и массовой загрузкой.
+
+Имитатор и веб-сервер запускаются отдельными процессами, чтобы процессорное
+время сбора и клиентов мерилось без них. Результат с параметрами прогона
+выводится в JSON (--json или --output) для сравнения между версиями:
+
+    python benchmarks/bench_fleet.py --printers 10,50,100,200 --output fleet.json
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from backend.services.ingest import Ingest, PrinterPoller
+from backend.services.state_store import PrinterStateStore
+from backend.services.ws_hub import WebSocketHub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SIMULATOR = os.path.join(ROOT, "backend", "services", "moonraker_sim.py")
+SECTIONS = ("poll", "subscribe", "api", "db")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def wait_port(host, port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"{host}:{port} не открылся за {timeout} с")
+
+
+def start_simulator(count, port, rate, printing):
+    process = subprocess.Popen([sys.executable, SIMULATOR, "--count", str(count), "--port", str(port),
+                                "--rate", str(rate), "--printing", str(printing), "--seed", "1"],
+                               stdout=subprocess.DEVNULL)
+    try:
+        wait_port("127.0.0.1", port + count - 1)
+    except Exception:
+        process.kill()
+        raise
+    return process
+
+
+def fleet(port, count):
+    return {printer_id: ("127.0.0.1", port + printer_id - 1) for printer_id in range(1, count + 1)}
+
+
+def bench_poll(port, counts, cycles, workers):
+    """Длительность цикла опроса всех принтеров и процессорное время на цикл"""
+    results = []
+    for count in counts:
+        poller = PrinterPoller(PrinterStateStore(), fleet(port, count), max_workers=workers)
+        # Первый цикл прогревает соединения и запрашивает сведения о принтерах
+        list(poller.executor.map(poller.poll_printer, list(poller.printers)))
+        durations = []
+        cpu_started = time.process_time()
+        for _ in range(cycles):
+            started = time.perf_counter()
+            list(poller.executor.map(poller.poll_printer, list(poller.printers)))
+            durations.append(time.perf_counter() - started)
+        cpu = time.process_time() - cpu_started
+        poller.stop()
+        results.append({"printers": count, "cycle_p50_ms": round(percentile(durations, 0.5) * 1000, 2),
+                        "cycle_max_ms": round(max(durations) * 1000, 2),
+                        "cpu_ms_per_cycle": round(cpu * 1000 / cycles, 2)})
+    return results
+
+
+def bench_subscribe(port, counts, seconds):
+    """Подписки WebSocket: подключение парка и поток обновлений на одном цикле asyncio"""
+    results = []
+    for count in counts:
+        hub = WebSocketHub(PrinterStateStore(), fleet(port, count))
+        started = time.perf_counter()
+        hub.start()
+        while hub.health()["connected"] < count and time.perf_counter() - started < 30:
+            time.sleep(0.05)
+        connect_s = time.perf_counter() - started
+
+        messages = sum(c["messages"] for c in hub.health()["printers"].values())
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        time.sleep(seconds)
+        cpu = time.process_time() - cpu_started
+        wall = time.perf_counter() - wall_started
+        health = hub.health()
+        messages = sum(c["messages"] for c in health["printers"].values()) - messages
+        hub.stop()
+        results.append({"printers": count, "connected": health["connected"], "connect_s": round(connect_s, 3),
+                        "messages_per_s": round(messages / wall, 1),
+                        "cpu_percent": round(cpu / wall * 100, 1),
+                        "messages_per_cpu_s": round(messages / cpu) if cpu else None})
+    return results
+
+
+def _serve_api(port, sim_port, count, ready):
+    """Процесс веб-сервера: сбор с имитатора в процессе и многопоточный werkzeug"""
+    import logging
+    from werkzeug.serving import make_server
+    from backend.api import web_interface
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    ingest = Ingest(fleet(sim_port, count), store=web_interface.state_source, transport="websocket")
+    ingest.start()
+    server = make_server("127.0.0.1", port, web_interface.app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+def bench_api(sim_port, count, clients, requests_per_client, api_port):
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=_serve_api, args=(api_port, sim_port, count, ready), daemon=True)
+    server.start()
+    try:
+        if not ready.wait(30):
+            raise TimeoutError("веб-сервер не запустился")
+        wait_port("127.0.0.1", api_port)
+        # Состояние парка успевает собраться до замера
+        time.sleep(2)
+        results = {}
+        for endpoint in ("/api/state", "/api/printers"):
+            results[endpoint] = _load(f"http://127.0.0.1:{api_port}{endpoint}", clients, requests_per_client)
+        return results
+    finally:
+        server.terminate()
+        server.join()
+
+
+def _load(url, clients, requests_per_client):
+    """Параллельные клиенты без кеша (без If-None-Match): задержка полного ответа"""
+    latencies = []
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        local = []
+        for _ in range(requests_per_client):
+            started = time.perf_counter()
+            response = session.get(url, timeout=10)
+            response.raise_for_status()
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=clients) as executor:
+        for future in [executor.submit(client) for _ in range(clients)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    return {"clients": clients, "requests": len(latencies),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "requests_per_s": round(len(latencies) / elapsed, 1)}
+
+
+def bench_db(samples):
+    from backend.db.data_model import DBModel
+    from benchmarks.bench_storage_backends import bench_ingest
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DBModel(url=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        try:
+            printer_id = db.add_printer("Бенчмарк").id
+            result = {"backend": db.backend, "samples": samples}
+            result.update(bench_ingest(db, printer_id, samples))
+            return result
+        finally:
+            db.close()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки сбора данных с парка на имитаторе Moonraker")
+    parser.add_argument("--printers", default="10,50,100,200",
+                        help="Число принтеров через запятую (по умолчанию: 10,50,100,200)")
+    parser.add_argument("--only", action="append", choices=SECTIONS, help="Только указанные замеры (можно несколько)")
+    parser.add_argument("--sim-port", type=int, default=17125, help="Порт первого имитируемого принтера")
+    parser.add_argument("--rate", type=float, default=4.0, help="Частота обновлений имитатора (по умолчанию: 4)")
+    parser.add_argument("--cycles", type=int, default=10, help="Циклов опроса на замер (по умолчанию: 10)")
+    parser.add_argument("--workers", type=int, default=16, help="Потоков опроса (по умолчанию: 16)")
+    parser.add_argument("--seconds", type=float, default=10.0,
+                        help="Длительность замера подписок, с (по умолчанию: 10)")
+    parser.add_argument("--clients", type=int, default=16, help="Параллельных клиентов API (по умолчанию: 16)")
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на клиента (по умолчанию: 200)")
+    parser.add_argument("--api-port", type=int, default=18080, help="Порт веб-сервера для замера API")
+    parser.add_argument("--samples", type=int, default=50000, help="Отсчетов телеметрии для db (по умолчанию: 50000)")
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    parser.add_argument("--output", help="Сохранить результат в JSON-файл")
+    args = parser.parse_args()
+
+    counts = sorted(int(count) for count in args.printers.split(","))
+    sections = args.only or SECTIONS
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("json", "output")},
+    }
+
+    simulator = None
+    if {"poll", "subscribe", "api"} & set(sections):
+        simulator = start_simulator(counts[-1], args.sim_port, args.rate, printing=0.5)
+    try:
+        if "poll" in sections:
+            results["poll"] = bench_poll(args.sim_port, counts, args.cycles, args.workers)
+        if "subscribe" in sections:
+            results["subscribe"] = bench_subscribe(args.sim_port, counts, args.seconds)
+        if "api" in sections:
+            results["api"] = bench_api(args.sim_port, counts[-1], args.clients, args.requests, args.api_port)
+    finally:
+        if simulator is not None:
+            simulator.terminate()
+            simulator.wait()
+    if "db" in sections:
+        results["db"] = bench_db(args.samples)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    for row in results.get("poll", []):
+        print(f"опрос     {row['printers']:>4d} принтеров: цикл p50 {row['cycle_p50_ms']:>8.1f} мс, "
+              f"max {row['cycle_max_ms']:>8.1f} мс, процессор {row['cpu_ms_per_cycle']:>7.1f} мс/цикл")
+    for row in results.get("subscribe", []):
+        print(f"подписки  {row['printers']:>4d} принтеров: подключение {row['connect_s']:.2f} с, "
+              f"{row['messages_per_s']:>8.1f} сообщ./с, процессор {row['cpu_percent']:>5.1f}%, "
+              f"{row['messages_per_cpu_s']} сообщ./с на ядро")
+    for endpoint, row in results.get("api", {}).items():
+        print(f"{endpoint:15s} {row['clients']} клиентов: p50 {row['p50_ms']} мс, p99 {row['p99_ms']} мс, "
+              f"{row['requests_per_s']} запр./с")
+    if "db" in results:
+        db = results["db"]
+        print(f"база [{db['backend']}]: очередь записи {db['write_queue_rows_per_s']} строк/с, "
+              f"массовая загрузка {db['bulk_load_rows_per_s']} строк/с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк JSON-кодека: стандартный json против json_codec (orjson).
+
+Замеряет разбор входящих кадров Moonraker (notify_status_update и полный
+ответ objects/query), сериализацию снимка состояния парка и ответ /api/state
+через Flask со стандартным и быстрым JSON-провайдером.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask.json.provider import DefaultJSONProvider
+
+from backend.services import json_codec
+
+STATUS_UPDATE = {
+    "jsonrpc": "2.0",
+    "method": "notify_status_update",
+    "params": [{
+        "extruder": {"temperature": 209.87, "power": 0.43},
+        "heater_bed": {"temperature": 60.02},
+        "toolhead": {"position": [112.45, 98.13, 2.4, 1532.77]},
+        "gcode_move": {"speed_factor": 1.0, "gcode_position": [112.45, 98.13, 2.4, 1532.77]},
+        "virtual_sdcard": {"progress": 0.4231, "file_position": 1834221},
+        "print_stats": {"print_duration": 3121.4, "filament_used": 1532.77},
+    }, 1718000000.123],
+}
+
+FULL_QUERY = {
+    "result": {
+        "eventtime": 1718000000.123,
+        "status": {
+            "webhooks": {"state": "ready", "state_message": "Printer is ready"},
+            "print_stats": {"filename": "benchy.gcode", "total_duration": 3200.1, "print_duration": 3121.4,
+                            "filament_used": 1532.77, "state": "printing", "message": "",
+                            "info": {"total_layer": 120, "current_layer": 12}},
+            "extruder": {"temperature": 209.87, "target": 210.0, "power": 0.43, "pressure_advance": 0.04,
+                         "smooth_time": 0.04, "can_extrude": True},
+            "heater_bed": {"temperature": 60.02, "target": 60.0, "power": 0.21},
+            "toolhead": {"position": [112.45, 98.13, 2.4, 1532.77], "homed_axes": "xyz", "print_time": 3200.4,
+                         "estimated_print_time": 3199.9, "max_velocity": 300.0, "max_accel": 3000.0,
+                         "axis_minimum": [0.0, 0.0, -2.0, 0.0], "axis_maximum": [235.0, 235.0, 250.0, 0.0]},
+            "virtual_sdcard": {"progress": 0.4231, "is_active": True, "file_position": 1834221,
+                               "file_path": "/home/pi/printer_data/gcodes/benchy.gcode", "file_size": 4335521},
+            "display_status": {"progress": 0.42, "message": None},
+        },
+    },
+}
+
+
+def ops_per_sec(fn, number):
+    elapsed = timeit.timeit(fn, number=number)
+    return number / elapsed
+
+
+def bench_api_state(provider_cls, number):
+    from backend.api import web_interface
+    app = web_interface.app
+    original = app.json
+    app.json = provider_cls(app)
+    try:
+        web_interface.state_source.apply(web_interface.PRINTER_ID, dict(FULL_QUERY["result"]["status"]))
+        client = app.test_client()
+        client.get("/api/state")
+        started = time.perf_counter()
+        for _ in range(number):
+            client.get("/api/state")
+        return number / (time.perf_counter() - started)
+    finally:
+        app.json = original
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк JSON-кодека")
+    parser.add_argument("--number", type=int, default=50000, help="Итераций на замер (по умолчанию: 50000)")
+    parser.add_argument("--printers", type=int, default=200, help="Принтеров в снимке состояния (по умолчанию: 200)")
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    args = parser.parse_args()
+    n = args.number
+
+    frame = json.dumps(STATUS_UPDATE)
+    frame_bytes = frame.encode()
+    full = json.dumps(FULL_QUERY)
+    snapshot = {"version": 1, "printers": [[i, FULL_QUERY["result"]["status"]] for i in range(args.printers)]}
+    snapshot_n = max(1, n // args.printers)
+
+    from backend.api.schemas import CodecJSONProvider
+    results = {
+        "codec": json_codec.BACKEND,
+        "status_update_loads": {
+            "json": ops_per_sec(lambda: json.loads(frame), n),
+            "codec": ops_per_sec(lambda: json_codec.loads(frame_bytes), n),
+        },
+        "objects_query_loads": {
+            "json": ops_per_sec(lambda: json.loads(full), n),
+            "codec": ops_per_sec(lambda: json_codec.loads(full), n),
+        },
+        "snapshot_dumps": {
+            "json": ops_per_sec(lambda: json.dumps(snapshot, ensure_ascii=False).encode(), snapshot_n),
+            "codec": ops_per_sec(lambda: json_codec.dumps(snapshot), snapshot_n),
+        },
+        "api_state_requests": {
+            "json": bench_api_state(DefaultJSONProvider, n // 10),
+            "codec": bench_api_state(CodecJSONProvider, n // 10),
+        },
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"Кодек: {results['codec']}")
+    for name, values in results.items():
+        if name == "codec":
+            continue
+        speedup = values["codec"] / values["json"]
+        print(f"{name:22s} json: {values['json']:>12.0f} оп/с   codec: {values['codec']:>12.0f} оп/с   x{speedup:.1f}")
+
+
+if __name__ == "__main__":
+    main()
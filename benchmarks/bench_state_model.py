@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк модели состояния: вложенные словари против PrinterState.
+
+Для N принтеров замеряет память на принтер (tracemalloc), скорость
+применения дельт notify_status_update и стоимость снимка всего парка,
+когда за тик меняется лишь часть принтеров.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.services.printer_state import PrinterState
+from backend.services.state_store import PrinterStateStore
+
+FULL_STATUS = {
+    "webhooks": {"state": "ready", "state_message": "Printer is ready"},
+    "print_stats": {"filename": "benchy.gcode", "total_duration": 3200.1, "print_duration": 3121.4,
+                    "filament_used": 1532.77, "state": "printing", "message": "",
+                    "info": {"total_layer": 120, "current_layer": 12}},
+    "extruder": {"temperature": 209.87, "target": 210.0, "power": 0.43, "pressure_advance": 0.04,
+                 "smooth_time": 0.04, "can_extrude": True},
+    "heater_bed": {"temperature": 60.02, "target": 60.0, "power": 0.21},
+    "toolhead": {"position": [112.45, 98.13, 2.4, 1532.77], "homed_axes": "xyz", "print_time": 3200.4,
+                 "estimated_print_time": 3199.9, "max_velocity": 300.0, "max_accel": 3000.0,
+                 "axis_minimum": [0.0, 0.0, -2.0, 0.0], "axis_maximum": [235.0, 235.0, 250.0, 0.0]},
+    "virtual_sdcard": {"progress": 0.4231, "is_active": True, "file_position": 1834221,
+                       "file_path": "/home/pi/printer_data/gcodes/benchy.gcode", "file_size": 4335521},
+    "display_status": {"progress": 0.42, "message": None},
+}
+
+
+class DictStateStore:
+    """Прежняя реализация кеша на вложенных словарях (для сравнения)"""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.version = 0
+
+    def apply(self, printer_id, status):
+        with self._lock:
+            state = self._states.setdefault(printer_id, {})
+            changed = {}
+            for name, fields in status.items():
+                current = state.setdefault(name, {})
+                diff = {key: value for key, value in fields.items()
+                        if key not in current or current[key] != value}
+                if diff:
+                    current.update(diff)
+                    changed[name] = diff
+            if not changed:
+                return changed
+            self.version += 1
+            meta = state.setdefault('meta', {})
+            meta['version'] = self.version
+            meta['last_update'] = datetime.now().strftime("%H:%M:%S")
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(printer_id, changed, state)
+        return changed
+
+    def snapshot(self):
+        with self._lock:
+            return self.version, {printer_id: {name: dict(fields) for name, fields in state.items()}
+                                  for printer_id, state in self._states.items()}
+
+
+def make_delta(rng, tick):
+    return {
+        "extruder": {"temperature": 209.5 + rng.random()},
+        "heater_bed": {"temperature": 59.8 + rng.random() * 0.4},
+        "toolhead": {"position": [rng.uniform(0, 235), rng.uniform(0, 235), 2.4, 1532.77 + tick]},
+        "virtual_sdcard": {"progress": min(1.0, 0.4231 + tick / 10000), "file_position": 1834221 + tick},
+        "print_stats": {"print_duration": 3121.4 + tick, "filament_used": 1532.77 + tick},
+    }
+
+
+def measure_memory(printers, factory):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    states = [factory() for _ in range(printers)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del states
+    return total / printers
+
+
+def dict_state():
+    state = {}
+    for name, fields in FULL_STATUS.items():
+        state[name] = dict(fields)
+    state["meta"] = {"version": 1, "last_update": "00:00:00"}
+    return state
+
+
+def model_state():
+    state = PrinterState.from_dict(FULL_STATUS)
+    state.meta.update(version=1, last_update="00:00:00")
+    return state
+
+
+def bench_store(store, printers, ticks, changed_share, seed):
+    rng = random.Random(seed)
+    for printer_id in range(printers):
+        store.apply(printer_id, FULL_STATUS)
+    deltas = [make_delta(rng, tick) for tick in range(ticks)]
+
+    started = time.perf_counter()
+    applied = 0
+    for tick in range(ticks):
+        for printer_id in range(printers):
+            store.apply(printer_id, deltas[(tick + printer_id) % ticks])
+            applied += 1
+    apply_rate = applied / (time.perf_counter() - started)
+
+    active = max(1, int(printers * changed_share))
+    started = time.perf_counter()
+    for tick in range(ticks):
+        for printer_id in range(active):
+            store.apply(printer_id, deltas[(tick + printer_id + 1) % ticks])
+        store.snapshot()
+    snapshot_ms = (time.perf_counter() - started) * 1000 / ticks
+    return apply_rate, snapshot_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк модели состояния принтеров")
+    parser.add_argument("--printers", type=int, default=300, help="Число принтеров (по умолчанию: 300)")
+    parser.add_argument("--ticks", type=int, default=200, help="Тиков обновлений (по умолчанию: 200)")
+    parser.add_argument("--changed-share", type=float, default=0.1,
+                        help="Доля принтеров, меняющихся за тик при замере снимка (по умолчанию: 0.1)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Вывести результат в JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name, factory, store_cls in (("dict", dict_state, DictStateStore),
+                                     ("model", model_state, PrinterStateStore)):
+        apply_rate, snapshot_ms = bench_store(store_cls(), args.printers, args.ticks,
+                                              args.changed_share, args.seed)
+        results[name] = {
+            "bytes_per_printer": measure_memory(args.printers, factory),
+            "apply_per_sec": apply_rate,
+            "snapshot_ms": snapshot_ms,
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"Принтеров: {args.printers}, тиков: {args.ticks}")
+    for name, values in results.items():
+        print(f"{name:6s} память: {values['bytes_per_printer']:>7.0f} Б/принтер   "
+              f"дельт: {values['apply_per_sec']:>9.0f}/с   снимок парка: {values['snapshot_ms']:.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Постоянный кеш найденных принтеров: быстрый старт без сканирования подсетей.
+
+При запуске сначала параллельно проверяются уже известные адреса
+(опознание discovery.fingerprint в пределах бюджета времени) - это доли
+секунды вместо перебора подсетей. Остальное адресное пространство сетей
+(discovery.network) досматривается в фоне с ограниченной частотой
+подключений; каждый найденный принтер сразу сохраняется в кеш и передается
+вызывающему (например, в опрос ingest.py).
+
+id принтера хранится в кеше и не меняется между перезапусками: по нему
+принтер связан с записями в базе данных.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+from discovery.fingerprint import DEFAULT_PORT, fingerprint, fingerprint_hosts
+from discovery.network import neighbor_hints, scan, target_addresses
+from discovery.utils import load_discovered_printers, save_discovered_printers
+
+DEFAULT_CACHE_FILE = os.environ.get(
+    "PRINTERS_DISCOVERY_CACHE",
+    os.path.join(os.path.expanduser("~"), ".printers_base", "discovered_printers.json"))
+# Принтеры, которых не видели дольше, забываются
+EXPIRE_DAYS = 30
+
+
+def _info(record):
+    """Сведения для кеша из записи fingerprint (адрес и порт - ключ записи, не сведения)"""
+    return {key: value for key, value in record.items() if key not in ("ip", "port")}
+
+
+def probe(ip, port=DEFAULT_PORT, timeout=1.0):
+    """Проверка Moonraker по адресу: сведения для кеша или None, если это не Moonraker"""
+    record = fingerprint(ip, port, timeout)
+    return None if record is None else _info(record)
+
+
+class PrinterCache:
+    """Реестр известных принтеров {id: {ip, port, last_seen, hostname, klippy_state, macs, ...}} в JSON-файле"""
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, timeout=1.0, workers=32, budget=2.0):
+        self.path = path
+        self.timeout = timeout
+        self.workers = workers
+        # Бюджет времени на проверку всех известных принтеров при старте
+        self.budget = budget
+        self._lock = threading.Lock()
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        entries = {}
+        for key, value in load_discovered_printers(self.path).items():
+            # Старый формат utils.save_discovered_printers: {имя: ip}
+            entry = {"ip": value, "port": DEFAULT_PORT} if isinstance(value, str) else dict(value)
+            printer_id = int(key) if str(key).isdigit() else None
+            if printer_id is None or printer_id in entries:
+                printer_id = max(entries, default=0) + 1
+            entries[printer_id] = entry
+        with self._lock:
+            self.entries = entries
+        return entries
+
+    def save(self):
+        with self._lock:
+            data = {str(printer_id): entry for printer_id, entry in sorted(self.entries.items())}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return save_discovered_printers(data, self.path)
+
+    def find(self, ip, port=DEFAULT_PORT, macs=()):
+        """id принтера по адресу, а если адрес новый - по MAC-адресу (хост получил другой IP)"""
+        with self._lock:
+            for printer_id, entry in self.entries.items():
+                if entry.get("port", DEFAULT_PORT) == port and (
+                        entry["ip"] == ip or ip in entry.get("addresses", ())):
+                    return printer_id
+            for printer_id, entry in self.entries.items():
+                if entry.get("port", DEFAULT_PORT) == port and set(macs) & set(entry.get("macs", ())):
+                    return printer_id
+        return None
+
+    def merge(self, ip, port=DEFAULT_PORT, info=None, save=True):
+        """Добавляет или обновляет принтер; возвращает его id (новый - следующий свободный)"""
+        info = info or {}
+        printer_id = self.find(ip, port, info.get("macs", ()))
+        with self._lock:
+            if printer_id is None:
+                printer_id = max(self.entries, default=0) + 1
+                self.entries[printer_id] = {"ip": ip, "port": port}
+            entry = self.entries[printer_id]
+            previous = [entry["ip"], *entry.get("addresses", ())]
+            entry["ip"] = ip
+            entry["last_seen"] = datetime.now().isoformat(timespec="seconds")
+            for key, value in info.items():
+                if value is not None:
+                    entry[key] = value
+            if "addresses" in entry or "addresses" in info:
+                # Адреса хоста накапливаются: интерфейс, не ответивший сейчас, может ответить потом
+                entry["addresses"] = list(dict.fromkeys([ip, *info.get("addresses", ()), *previous]))
+        if save:
+            self.save()
+        return printer_id
+
+    def expire(self, days=EXPIRE_DAYS):
+        """Забывает принтеры, которых не видели дольше days дней"""
+        threshold = datetime.now().timestamp() - days * 86400
+        with self._lock:
+            stale = [printer_id for printer_id, entry in self.entries.items()
+                     if entry.get("last_seen") and datetime.fromisoformat(entry["last_seen"]).timestamp() < threshold]
+            for printer_id in stale:
+                del self.entries[printer_id]
+        return stale
+
+    def verify(self):
+        """Опознает известные принтеры в пределах бюджета; {id: (ip, port)} ответивших"""
+        with self._lock:
+            known = dict(self.entries)
+        alive = {}
+        # Все адреса хоста: если основной не ответил, принтер доступен по другому интерфейсу
+        candidates = list(dict.fromkeys(
+            (ip, entry.get("port", DEFAULT_PORT))
+            for entry in known.values() for ip in [entry["ip"], *entry.get("addresses", ())]))
+        for record in fingerprint_hosts(candidates, budget=self.budget, timeout=self.timeout, workers=self.workers):
+            printer_id = self.merge(record["ip"], record["port"], _info(record), save=False)
+            alive[printer_id] = (record["ip"], record["port"])
+        self.expire()
+        self.save()
+        return dict(sorted(alive.items()))
+
+    def printers(self):
+        with self._lock:
+            return {printer_id: (entry["ip"], entry.get("port", DEFAULT_PORT))
+                    for printer_id, entry in sorted(self.entries.items())}
+
+
+def subnet_addresses():
+    """Адреса всех локальных сетей с их маской (или PRINTERS_DISCOVERY_INCLUDE) без исключенных"""
+    return target_addresses()
+
+
+class BackgroundSweep:
+    """Фоновый досмотр адресов, не проверенных при старте.
+
+    Невысокая частота подключений и пауза между пачками: досмотр не
+    конкурирует с опросом принтеров за сеть и процессор: 32 потока при
+    таймауте 0.3 с - около 100 молчащих адресов в секунду, /20 - около 40 с.
+    Адреса с открытым портом опознаются (discovery.fingerprint), и
+    on_found(printer_id, ip, port) вызывается для каждого нового (или
+    сменившего адрес) принтера сразу после того, как он сохранен в кеш.
+    """
+
+    def __init__(self, cache, skip=(), port=DEFAULT_PORT, addresses=None, on_found=None, workers=32, rate=200.0,
+                 batch=256, pause=0.2, interval=None):
+        self.cache = cache
+        self.skip = set(skip)
+        self.port = port
+        self.addresses = addresses
+        self.on_found = on_found
+        self.workers = workers
+        # Попыток подключения в секунду и адресов в пачке
+        self.rate = rate
+        self.batch = batch
+        self.pause = pause
+        # Повтор досмотра через interval секунд (None - один проход)
+        self.interval = interval
+        self.found = []
+        self.checked = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="discovery-sweep", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def wait(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _targets(self):
+        addresses = self.addresses if self.addresses is not None else subnet_addresses()
+        known = {ip for ip, _ in self.cache.printers().values()}
+        neighbors = set(neighbor_hints())
+        targets = [(ip, self.port) for ip in addresses if (ip, self.port) not in self.skip]
+        # Известные, но не ответившие при старте адреса - первыми: принтер мог просто загружаться;
+        # за ними - хосты из таблицы соседей, с которыми недавно был обмен
+        targets.sort(key=lambda target: (target[0] not in known, target[0] not in neighbors))
+        return targets
+
+    def sweep(self):
+        """Один проход по адресам пачками по batch; возвращает найденные id"""
+        found = []
+        targets = self._targets()
+        for offset in range(0, len(targets), self.batch):
+            if self._stop.is_set():
+                break
+            batch = targets[offset:offset + self.batch]
+            # Соседей уже поставил вперед _targets, отдельный проход по ним не нужен
+            candidates = scan([ip for ip, _ in batch], self.port, hints=[], rate=self.rate, workers=self.workers)
+            for record in fingerprint_hosts(candidates, self.port, budget=self.cache.timeout + 1.0,
+                                            timeout=self.cache.timeout, workers=self.workers):
+                ip, port = record["ip"], record["port"]
+                self.skip.update((address, port) for address in record["addresses"])
+                printer_id = self.cache.merge(ip, port, _info(record))
+                found.append(printer_id)
+                if self.on_found:
+                    self.on_found(printer_id, ip, port)
+            self.checked += len(batch)
+            self._stop.wait(self.pause)
+        self.found.extend(found)
+        return found
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠ Ошибка фонового поиска принтеров: {e}")
+            if self.interval is None or self._stop.wait(self.interval):
+                break
+
+
+def discover(cache=None, port=DEFAULT_PORT, addresses=None):
+    """Принтеры для запуска: известные и ответившие сразу, иначе - полное сканирование.
+
+    Возвращает ({id: (ip, port)}, BackgroundSweep или None). Досмотр остальных
+    адресов нужен, только если при старте кто-то ответил из кеша (иначе полное
+    сканирование уже прошло); он возвращается незапущенным, чтобы вызывающий
+    успел задать on_found.
+    """
+    cache = cache or PrinterCache()
+    started = time.monotonic()
+    printers = cache.verify()
+    if printers:
+        print(f"✓ Из кеша ответили {len(printers)} принтеров за {time.monotonic() - started:.2f} с")
+        skip = {(ip, entry.get("port", DEFAULT_PORT)) for printer_id, entry in cache.entries.items()
+                if printer_id in printers for ip in [entry["ip"], *entry.get("addresses", ())]}
+        return printers, BackgroundSweep(cache, skip=skip, port=port, addresses=addresses)
+
+    from discovery.pi_discover import scan_no_cli
+
+    # Открытый порт - только кандидат: в реестр попадают хосты, где действительно отвечает Moonraker
+    candidates = scan_no_cli()
+    for record in fingerprint_hosts(candidates, port, budget=cache.budget, timeout=cache.timeout,
+                                    workers=cache.workers):
+        printer_id = cache.merge(record["ip"], record["port"], _info(record), save=False)
+        printers[printer_id] = (record["ip"], record["port"])
+    cache.save()
+    if len(printers) != len(candidates):
+        print(f"⚠ Открытый порт {port} у {len(candidates)} хостов, Moonraker опознан на {len(printers)}")
+    return printers, None
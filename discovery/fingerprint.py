@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Второй этап поиска: опознание Moonraker на хостах с открытым портом.
+
+Открытый порт 7125 еще не принтер. Для каждого кандидата параллельно
+запрашиваются server/info, printer/info и machine/system_info через общий
+пул HTTP-соединений; все запросы всех хостов укладываются в один бюджет
+времени, а не ответившие к его концу хосты отбрасываются.
+
+Один хост с несколькими сетевыми интерфейсами (Ethernet и Wi-Fi) отвечает
+на нескольких адресах - такие ответы одного порта склеиваются по MAC-адресам
+из machine/system_info; без MAC-адресов ответы не склеиваются.
+"""
+
+import concurrent.futures
+import time
+
+import requests
+
+DEFAULT_PORT = 7125
+ENDPOINTS = ("server/info", "printer/info", "machine/system_info")
+# Таймаут подключения: пустой адрес не должен занимать поток весь бюджет
+CONNECT_TIMEOUT = 0.3
+
+
+def _session(pool_size):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=len(ENDPOINTS), max_retries=0)
+    session.mount("http://", adapter)
+    return session
+
+
+def _get(session, url, timeout):
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+    return response.json()["result"]
+
+
+def _record(ip, port, answers):
+    """Запись о принтере из ответов; None, если server/info не ответил - это не Moonraker"""
+    server_info = answers.get("server/info")
+    if not isinstance(server_info, dict) or "klippy_state" not in server_info:
+        return None
+    printer_info = answers.get("printer/info") or {}
+    network = (answers.get("machine/system_info") or {}).get("system_info", {}).get("network", {})
+    macs = sorted({interface.get("mac_address") for interface in network.values()
+                   if interface.get("mac_address") and interface.get("mac_address") != "00:00:00:00:00:00"})
+    return {
+        "ip": ip,
+        "port": port,
+        "hostname": printer_info.get("hostname"),
+        "klippy_state": server_info.get("klippy_state"),
+        "moonraker_version": server_info.get("moonraker_version"),
+        "software_version": printer_info.get("software_version"),
+        "macs": macs,
+        "addresses": [ip],
+    }
+
+
+def dedupe(records):
+    """Склеивает ответы одного экземпляра Moonraker с разных адресов; первый адрес - основной.
+
+    Ключ - MAC и порт: несколько экземпляров на одном Pi (7125, 7126) - разные
+    принтеры. Без MAC (machine/system_info не успел ответить) записи не
+    склеиваются: одинаковое имя хоста из образа (mainsailos) не значит один хост.
+    """
+    merged = []
+    by_key = {}
+    for record in records:
+        keys = [("mac", mac, record["port"]) for mac in record["macs"]]
+        existing = next((by_key[key] for key in keys if key in by_key), None)
+        if existing is None:
+            existing = dict(record, addresses=list(record["addresses"]))
+            merged.append(existing)
+        else:
+            existing["addresses"].extend(ip for ip in record["addresses"] if ip not in existing["addresses"])
+        for key in keys:
+            by_key[key] = existing
+    return merged
+
+
+def fingerprint_hosts(candidates, port=DEFAULT_PORT, budget=2.0, timeout=1.0, workers=64):
+    """Опознает кандидатов [ip или (ip, port)] за budget секунд.
+
+    Возвращает список записей {ip, port, hostname, klippy_state, moonraker_version,
+    software_version, macs, addresses} только для хостов, где отвечает Moonraker,
+    без повторов одного хоста на разных адресах, в порядке кандидатов.
+    """
+    targets = [candidate if isinstance(candidate, tuple) else (candidate, port) for candidate in candidates]
+    if not targets:
+        return []
+    deadline = time.monotonic() + budget
+    session = _session(min(len(targets), workers))
+    answers = {target: {} for target in targets}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fingerprint")
+    try:
+        futures = {executor.submit(_get, session, f"http://{ip}:{target_port}/{endpoint}",
+                                   (CONNECT_TIMEOUT, min(timeout, budget))): ((ip, target_port), endpoint)
+                   for ip, target_port in targets for endpoint in ENDPOINTS}
+        done, not_done = concurrent.futures.wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        for future in not_done:
+            future.cancel()
+        for future in done:
+            target, endpoint = futures[future]
+            if future.exception() is None:
+                answers[target][endpoint] = future.result()
+    finally:
+        # Не ждем запросы, не уложившиеся в бюджет: их таймаут не больше timeout
+        executor.shutdown(wait=False, cancel_futures=True)
+        session.close()
+    records = [_record(ip, target_port, answers[(ip, target_port)]) for ip, target_port in targets]
+    return dedupe([record for record in records if record is not None])
+
+
+def fingerprint(ip, port=DEFAULT_PORT, timeout=1.0):
+    """Опознание одного хоста; запись или None"""
+    records = fingerprint_hosts([(ip, port)], budget=timeout, timeout=timeout)
+    return records[0] if records else None
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Обслуживание парка принтеров по SSH: сбор журналов, перезапуск Klipper и
+Moonraker, загрузка конфигурации, произвольные команды.
+
+Команда выполняется на всех хостах параллельно (не больше concurrency
+одновременно), подключения открываются один раз и переиспользуются всеми
+операциями FleetSSH. Вывод каждого хоста печатается построчно по мере
+поступления, в конце - сводка: статус, код завершения и время по хостам.
+
+Вход - по ключу: ssh-agent, ~/.ssh/id_* или ключ из --identity; пароль
+можно передать явно (как pi/pi в pi_discover --try-ssh), но по умолчанию он
+не используется.
+
+    python -m discovery.fleet_ssh logs --dest ./fleet-logs
+    python -m discovery.fleet_ssh restart klipper moonraker
+    python -m discovery.fleet_ssh push-config printer.cfg
+    python -m discovery.fleet_ssh --hosts 10.20.0.11,10.20.0.12 run "uptime"
+
+Без --hosts берутся принтеры из кеша поиска (discovery/cache.py).
+"""
+
+import argparse
+import concurrent.futures
+import os
+import shlex
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+DEFAULT_USER = "pi"
+DEFAULT_CONCURRENCY = 32
+# Пути на Pi относительно домашнего каталога (так их понимает и SFTP)
+LOG_FILES = ("printer_data/logs/klippy.log", "printer_data/logs/moonraker.log")
+CONFIG_FILE = "printer_data/config/printer.cfg"
+SERVICES = ("klipper", "moonraker")
+
+
+@dataclass
+class HostResult:
+    host: str
+    ok: bool = False
+    exit_status: int = None
+    duration: float = 0.0
+    output: list = field(default_factory=list)
+    error: str = None
+
+
+class FleetSSH:
+    """Пул SSH-подключений к хостам парка и параллельные операции над ними"""
+
+    def __init__(self, hosts, username=DEFAULT_USER, key_filename=None, password=None, port=22,
+                 concurrency=DEFAULT_CONCURRENCY, connect_timeout=5.0, command_timeout=120.0, on_output=None):
+        self.hosts = list(dict.fromkeys(hosts))
+        self.username = username
+        self.key_filename = key_filename
+        self.password = password
+        self.port = port
+        self.concurrency = concurrency
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        # on_output(host, line) - для каждой строки вывода; по умолчанию печать с префиксом хоста
+        self.on_output = on_output or self._print_line
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._print_lock = threading.Lock()
+
+    def _print_line(self, host, line):
+        with self._print_lock:
+            print(f"[{host}] {line}", flush=True)
+
+    def _client(self, host):
+        import paramiko
+
+        with self._lock:
+            client = self._clients.get(host)
+        if client is not None and client.get_transport() is not None and client.get_transport().is_active():
+            return client
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(host, port=self.port, username=self.username, key_filename=self.key_filename,
+                       password=self.password, timeout=self.connect_timeout, banner_timeout=self.connect_timeout,
+                       auth_timeout=self.connect_timeout, allow_agent=self.password is None,
+                       look_for_keys=self.password is None)
+        # Keepalive: подключение живет между операциями, его не должен закрыть NAT или сервер
+        client.get_transport().set_keepalive(30)
+        with self._lock:
+            self._clients[host] = client
+        return client
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _exec(self, host, command, result):
+        channel = self._client(host).get_transport().open_session()
+        try:
+            channel.set_combine_stderr(True)
+            channel.settimeout(self.command_timeout)
+            channel.exec_command(command)
+            # Channel.makefile не принимает encoding: строки читаются байтами и декодируются здесь
+            for raw in channel.makefile("rb"):
+                line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                result.output.append(line)
+                self.on_output(host, line)
+            return channel.recv_exit_status()
+        finally:
+            channel.close()
+
+    def each(self, operation):
+        """operation(host, result) на всех хостах параллельно; [HostResult] в порядке хостов.
+
+        Исключение операции не прерывает остальные хосты, а попадает в result.error;
+        ok - операция завершилась без исключения и с нулевым кодом (если он есть).
+        """
+
+        def call(host):
+            result = HostResult(host)
+            started = time.monotonic()
+            try:
+                result.exit_status = operation(host, result)
+                result.ok = result.exit_status in (None, 0)
+            except Exception as e:
+                result.error = f"{type(e).__name__}: {e}"
+            result.duration = time.monotonic() - started
+            return result
+
+        if not self.hosts:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.concurrency, len(self.hosts)),
+                                                   thread_name_prefix="fleet-ssh") as executor:
+            return list(executor.map(call, self.hosts))
+
+    def run(self, command):
+        """Команда оболочки на всех хостах"""
+        return self.each(lambda host, result: self._exec(host, command, result))
+
+    def restart(self, services=SERVICES):
+        """Перезапуск служб systemd; sudo без пароля (-n), иначе - ошибка, а не ожидание ввода"""
+        command = "sudo -n systemctl restart " + " ".join(shlex.quote(service) for service in services)
+        return self.run(command)
+
+    def collect_logs(self, dest, files=LOG_FILES):
+        """Скачивает журналы в dest/<хост>/; отсутствующий файл - ошибка хоста"""
+
+        def fetch(host, result):
+            directory = os.path.join(dest, host)
+            os.makedirs(directory, exist_ok=True)
+            with self._client(host).open_sftp() as sftp:
+                missing = []
+                for remote in files:
+                    local = os.path.join(directory, os.path.basename(remote))
+                    try:
+                        sftp.get(remote, local)
+                    except FileNotFoundError:
+                        missing.append(remote)
+                        continue
+                    line = f"{remote} -> {local} ({os.path.getsize(local)} байт)"
+                    result.output.append(line)
+                    self.on_output(host, line)
+            if missing:
+                raise FileNotFoundError(f"нет файлов: {', '.join(missing)}")
+
+        return self.each(fetch)
+
+    def push_config(self, local_path, remote_path=CONFIG_FILE, restart=True):
+        """Загружает конфигурацию: старая сохраняется рядом с меткой времени, новая заменяет ее целиком.
+
+        Файл сначала пишется во временный и переименовывается - Klipper не
+        увидит недописанную конфигурацию. restart - перезапустить klipper.
+        """
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        remote = shlex.quote(remote_path)
+        command = (f"(test ! -e {remote} || cp -p {remote} {shlex.quote(f'{remote_path}.bak-{stamp}')}) "
+                   f"&& mv {shlex.quote(remote_path + '.new')} {remote}")
+        if restart:
+            command += " && sudo -n systemctl restart klipper"
+
+        def push(host, result):
+            with self._client(host).open_sftp() as sftp:
+                sftp.put(local_path, remote_path + ".new")
+            return self._exec(host, command, result)
+
+        return self.each(push)
+
+
+def print_summary(results, title):
+    ok = sum(result.ok for result in results)
+    print(f"\n{title}: успешно {ok} из {len(results)}")
+    for result in results:
+        mark = "✓" if result.ok else "✗"
+        status = f"код {result.exit_status}" if result.exit_status is not None else ""
+        if result.error:
+            status = result.error
+        print(f"  {mark} {result.host:<16} {result.duration:6.2f} с  {status}")
+    if results:
+        slowest = max(results, key=lambda result: result.duration)
+        print(f"Самый долгий хост: {slowest.host} ({slowest.duration:.2f} с)")
+
+
+def fleet_hosts(hosts=None, cache_file=None):
+    """Хосты из --hosts или адреса принтеров из кеша поиска"""
+    if hosts:
+        return [host.strip() for host in hosts.split(",") if host.strip()]
+    from discovery.cache import PrinterCache
+
+    cache = PrinterCache(cache_file) if cache_file else PrinterCache()
+    return list(dict.fromkeys(ip for ip, _ in cache.printers().values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Параллельные операции по SSH на принтерах парка")
+    parser.add_argument("--hosts", help="Адреса через запятую (по умолчанию: принтеры из кеша поиска)")
+    parser.add_argument("--discovery-cache", help="Файл кеша найденных принтеров")
+    parser.add_argument("-u", "--user", default=DEFAULT_USER, help=f"Пользователь SSH (по умолчанию: {DEFAULT_USER})")
+    parser.add_argument("-i", "--identity", help="Закрытый ключ (по умолчанию: ssh-agent и ~/.ssh/id_*)")
+    parser.add_argument("-j", "--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Хостов одновременно (по умолчанию: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Таймаут команды, с (по умолчанию: 120)")
+    commands = parser.add_subparsers(dest="operation", required=True)
+    run_parser = commands.add_parser("run", help="Выполнить команду оболочки")
+    run_parser.add_argument("command", nargs="+")
+    logs_parser = commands.add_parser("logs", help="Скачать klippy.log и moonraker.log")
+    logs_parser.add_argument("--dest", default="fleet-logs", help="Каталог (по умолчанию: fleet-logs)")
+    restart_parser = commands.add_parser("restart", help="Перезапустить службы")
+    restart_parser.add_argument("services", nargs="*", default=list(SERVICES))
+    push_parser = commands.add_parser("push-config", help="Загрузить printer.cfg и перезапустить klipper")
+    push_parser.add_argument("file")
+    push_parser.add_argument("--remote", default=CONFIG_FILE, help=f"Путь на Pi (по умолчанию: ~/{CONFIG_FILE})")
+    push_parser.add_argument("--no-restart", action="store_true", help="Не перезапускать klipper")
+    args = parser.parse_args()
+
+    hosts = fleet_hosts(args.hosts, args.discovery_cache)
+    if not hosts:
+        print("✗ Нет хостов: задайте --hosts или выполните поиск принтеров")
+        return 1
+    started = time.monotonic()
+    with FleetSSH(hosts, username=args.user, key_filename=args.identity, concurrency=args.concurrency,
+                  command_timeout=args.timeout) as fleet:
+        if args.operation == "run":
+            results = fleet.run(" ".join(args.command))
+        elif args.operation == "logs":
+            results = fleet.collect_logs(args.dest)
+        elif args.operation == "restart":
+            results = fleet.restart(args.services)
+        else:
+            results = fleet.push_config(args.file, args.remote, restart=not args.no_restart)
+    print_summary(results, f"{args.operation} на {len(hosts)} хостах за {time.monotonic() - started:.1f} с")
+    return 0 if all(result.ok for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Адресное пространство поиска принтеров и быстрая проверка порта по нему.
+
+Сети берутся с настоящей маской интерфейса (netifaces), а не усечением
+адреса до /24: в сетях /22 и /20 принтеры стоят и за пределами своей
+третьего октета. Сеть шире /20 сужается до /20 вокруг своего адреса, а
+виртуальные интерфейсы (docker0, br-*, veth*, virbr*, VPN) не
+просматриваются: это тысячи адресов, где принтеров нет. Диапазоны можно
+задать явно или исключить:
+    PRINTERS_DISCOVERY_INCLUDE=10.20.0.0/20,10.30.1.10-10.30.1.99
+    PRINTERS_DISCOVERY_EXCLUDE=10.20.0.0/24,10.20.15.1
+    PRINTERS_DISCOVERY_RATE=2000 - попыток подключения в секунду.
+    PRINTERS_DISCOVERY_MIN_PREFIX=20 - до какой маски сужаются широкие сети.
+
+Порядок проверки адаптивный: сначала адреса из таблицы соседей (ARP),
+то есть хосты, с которыми уже был обмен, - принтеры обычно среди них и
+находятся за доли секунды. Затем - остальные адреса параллельно с
+ограничением частоты; при нехватке сокетов или буферов частота снижается,
+а при успешной работе понемногу возвращается.
+
+Молчащий адрес держит поток весь таймаут подключения, поэтому пропускная
+способность ограничена потоками: 256 / 0.3 с - около 850 адресов в секунду,
+/20 (4094 адреса) - около 5 с, /16 - больше минуты.
+"""
+
+import concurrent.futures
+import errno
+import ipaddress
+import os
+import re
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+DEFAULT_PORT = 7125
+# Сеть интерфейса шире этой маски сужается до нее вокруг своего адреса (/20 - 4094 адреса)
+MIN_PREFIX = int(os.environ.get("PRINTERS_DISCOVERY_MIN_PREFIX", 20))
+# Префиксы имен виртуальных интерфейсов: мосты контейнеров и ВМ, туннели VPN
+VIRTUAL_INTERFACES = ("docker", "br-", "veth", "virbr", "vnet", "vmnet", "vboxnet", "lxcbr", "lxdbr", "podman",
+                      "cni", "flannel", "cali", "vxlan", "kube", "tun", "tap", "wg", "tailscale", "zt")
+DEFAULT_RATE = float(os.environ.get("PRINTERS_DISCOVERY_RATE", 2000))
+DEFAULT_WORKERS = 256
+CONNECT_TIMEOUT = 0.3
+# Ошибки нехватки ресурсов: адрес не проверен, нужно притормозить и повторить
+# (EAGAIN сюда не входит: так connect_ex сообщает о таймауте)
+_RESOURCE_ERRORS = {errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM}
+
+
+def local_networks(min_prefix=MIN_PREFIX, skip_interfaces=VIRTUAL_INTERFACES):
+    """Локальные IPv4-сети с настоящей маской: [(IPv4Network, свой ip, интерфейс)].
+
+    Интерфейсы, имя которых начинается с одного из skip_interfaces, пропускаются.
+    """
+    import netifaces
+
+    networks = []
+    for iface in netifaces.interfaces():
+        if iface.startswith(tuple(skip_interfaces)):
+            continue
+        for addr_info in netifaces.ifaddresses(iface).get(netifaces.AF_INET, []):
+            ip = addr_info.get("addr")
+            if not ip or ip.startswith("127.") or ip.startswith("169.254."):
+                continue
+            interface = ipaddress.IPv4Interface(f"{ip}/{addr_info.get('netmask') or '255.255.255.0'}")
+            network = interface.network
+            if network.prefixlen < min_prefix:
+                network = ipaddress.IPv4Interface(f"{ip}/{min_prefix}").network
+            networks.append((network, ip, iface))
+    return networks
+
+
+def parse_ranges(spec):
+    """Диапазоны из строки "10.0.0.0/22,10.0.8.5-10.0.8.40,10.0.9.7" -> [IPv4Network]"""
+    if isinstance(spec, str):
+        spec = spec.split(",")
+    networks = []
+    for item in spec or ():
+        item = str(item).strip()
+        if not item:
+            continue
+        if "-" in item:
+            first, last = (ipaddress.IPv4Address(part.strip()) for part in item.split("-", 1))
+            networks.extend(ipaddress.summarize_address_range(first, last))
+        else:
+            networks.append(ipaddress.IPv4Network(item, strict=False))
+    return networks
+
+
+def _hosts(network):
+    # У /31 и /32 нет адресов сети и широковещания
+    return network.hosts() if network.prefixlen < 31 else iter(network)
+
+
+def target_addresses(include=None, exclude=None):
+    """Адреса для проверки по порядку сетей: include (по умолчанию - локальные сети) без exclude и своих адресов"""
+    include = include if include is not None else os.environ.get("PRINTERS_DISCOVERY_INCLUDE")
+    exclude = exclude if exclude is not None else os.environ.get("PRINTERS_DISCOVERY_EXCLUDE")
+    own = set()
+    if include:
+        networks = parse_ranges(include)
+    else:
+        local = local_networks()
+        networks = [network for network, _, _ in local]
+        own = {ipaddress.IPv4Address(ip) for _, ip, _ in local}
+    excluded = parse_ranges(exclude)
+    seen = set()
+    addresses = []
+    for network in networks:
+        for address in _hosts(network):
+            if address in own or address in seen or any(address in skipped for skipped in excluded):
+                continue
+            seen.add(address)
+            addresses.append(str(address))
+    return addresses
+
+
+# --- таблица соседей ---
+
+_IP_RE = re.compile(r"\b(\d{1,3}(?:\.\d{1,3}){3})\b")
+
+
+def _proc_arp():
+    with open("/proc/net/arp") as f:
+        lines = f.read().splitlines()[1:]
+    # Флаг 0x0 - незавершенная запись: хост на ARP не ответил
+    return [line.split()[0] for line in lines if len(line.split()) >= 4 and line.split()[2] != "0x0"]
+
+
+def _command_neighbors(command):
+    output = subprocess.run(command, capture_output=True, text=True, timeout=2).stdout
+    addresses = []
+    for line in output.splitlines():
+        if "FAILED" in line or "INCOMPLETE" in line or "incomplete" in line:
+            continue
+        match = _IP_RE.search(line)
+        if match:
+            addresses.append(match.group(1))
+    return addresses
+
+
+def neighbor_hints():
+    """Адреса из таблицы соседей ОС: /proc/net/arp, `ip neigh` или `arp -a` (Windows, macOS)"""
+    sources = [_proc_arp]
+    if shutil.which("ip"):
+        sources.append(lambda: _command_neighbors(["ip", "-4", "neigh"]))
+    if shutil.which("arp"):
+        sources.append(lambda: _command_neighbors(["arp", "-a"]))
+    for source in sources:
+        try:
+            addresses = source()
+        except (OSError, subprocess.SubprocessError):
+            continue
+        if addresses:
+            return list(dict.fromkeys(addresses))
+    return []
+
+
+# --- проверка порта ---
+
+class RateLimiter:
+    """Ограничение частоты (token bucket) с понижением при перегрузке и плавным возвратом"""
+
+    def __init__(self, rate=DEFAULT_RATE, minimum=50.0):
+        self.max_rate = rate
+        self.minimum = min(minimum, rate)
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def slow_down(self):
+        with self._lock:
+            self.rate = max(self.minimum, self.rate / 2)
+
+    def speed_up(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate * 1.01)
+
+
+def check_port(ip, port=DEFAULT_PORT, timeout=CONNECT_TIMEOUT):
+    """True - порт открыт, False - закрыт или хоста нет, None - не хватило ресурсов (повторить)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        result = sock.connect_ex((ip, port))
+    except socket.timeout:
+        return False
+    except OSError as e:
+        return None if e.errno in _RESOURCE_ERRORS else False
+    finally:
+        sock.close()
+    if result in _RESOURCE_ERRORS:
+        return None
+    return result == 0
+
+
+def scan(addresses, port=DEFAULT_PORT, hints=None, rate=DEFAULT_RATE, workers=DEFAULT_WORKERS,
+         timeout=CONNECT_TIMEOUT, on_found=None):
+    """Адреса из addresses с открытым портом: сначала соседи из hints, затем остальные.
+
+    hints=None - взять таблицу соседей ОС. on_found(ip) вызывается сразу для
+    каждого найденного адреса. Возвращает найденные адреса в порядке нахождения.
+    """
+    addresses = list(addresses)
+    hints = neighbor_hints() if hints is None else hints
+    wanted = set(addresses)
+    first = [ip for ip in dict.fromkeys(hints) if ip in wanted]
+    hinted = set(first)
+    rest = [ip for ip in addresses if ip not in hinted]
+    limiter = RateLimiter(rate)
+    found = []
+    lock = threading.Lock()
+
+    def check(ip):
+        for _ in range(5):
+            limiter.acquire()
+            result = check_port(ip, port, timeout)
+            if result is not None:
+                limiter.speed_up()
+                break
+            limiter.slow_down()
+        if result:
+            with lock:
+                found.append(ip)
+            if on_found:
+                on_found(ip)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="port-scan") as executor:
+        # Соседи - отдельным первым проходом: пока они не проверены, остальные адреса не занимают потоки
+        for batch in (first, rest):
+            list(executor.map(check, batch))
+    return found
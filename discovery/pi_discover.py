@@ -4,28 +4,22 @@
 Автоматический поиск Raspberry Pi с Moonraker и попытка подключения по SSH
 """
 
+import os
 import socket
-import concurrent.futures
+import time
 import argparse
-import netifaces
 import paramiko
 
+from discovery import network
+from discovery.fleet_ssh import FleetSSH
+
 def get_all_local_subnets():
-    """Получить все локальные подсети на устройстве"""
-    subnets = []
+    """Получить все локальные подсети на устройстве с настоящей маской: [(сеть, свой IP, интерфейс)]"""
     try:
-        interfaces = netifaces.interfaces()
-        for iface in interfaces:
-            addrs = netifaces.ifaddresses(iface)
-            if netifaces.AF_INET in addrs:
-                for addr_info in addrs[netifaces.AF_INET]:
-                    ip = addr_info.get('addr')
-                    if ip and not ip.startswith('127.'):
-                        subnet = '.'.join(ip.split('.')[:3])
-                        subnets.append((subnet, ip, iface))
+        return network.local_networks()
     except Exception as e:
         print(f"⚠ Ошибка определения подсетей: {e}")
-    return subnets
+        return []
 
 def check_moonraker(ip, port=7125, timeout=0.3):
     try:
@@ -50,27 +44,22 @@ def try_ssh(ip, username="pi", password="pi", timeout=3):
     except Exception as e:
         return False, str(e)
 
-def scan_subnet_for_printers(subnet=None, start=1, end=254, max_workers=50):
+def scan_subnet_for_printers(subnet=None, start=1, end=254, max_workers=50, exclude=None, rate=network.DEFAULT_RATE):
+    """Адреса с открытым портом Moonraker в подсети.
+
+    subnet - сеть ("10.20.0.0/20", IPv4Network) или, как раньше, три октета
+    ("192.168.1") - тогда проверяются хосты start..end.
+    """
     if subnet is None:
         print("✗ Нет подсети для сканирования")
         return []
 
-    print(f"Сканируем подсеть {subnet}.{start}-{end} на порт 7125 (Moonraker)")
-    found_printers = []
-    def check_host(host_num):
-        ip = f"{subnet}.{host_num}"
-        if check_moonraker(ip):
-            return ip
-        return None
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(check_host, i) for i in range(start, end + 1)]
-        for future in concurrent.futures.as_completed(futures):
-            ip = future.result()
-            if ip:
-                found_printers.append(ip)
-                print(f"✓ Найден принтер на {ip}")
-
+    if isinstance(subnet, str) and subnet.count(".") == 2:
+        subnet = f"{subnet}.{start}-{subnet}.{end}"
+    addresses = network.target_addresses(include=[subnet], exclude=exclude or "")
+    print(f"Сканируем {subnet} ({len(addresses)} адресов) на порт 7125 (Moonraker)")
+    found_printers = network.scan(addresses, rate=rate, workers=max_workers,
+                                  on_found=lambda ip: print(f"✓ Найден принтер на {ip}"))
     print(f"Всего найдено: {len(found_printers)}")
     return found_printers
 
@@ -78,26 +67,20 @@ def main():
     parser = argparse.ArgumentParser(
         description='Автоматический поиск Raspberry Pi принтеров во всех локальных подсетях с подключением по SSH'
     )
-    parser.add_argument('--start', type=int, default=1,
-        help='Начальный хост для сканирования (default: 1)')
-    parser.add_argument('--end', type=int, default=254,
-        help='Конечный хост для сканирования (default: 254)')
-    parser.add_argument('-w', '--workers', type=int, default=50,
-        help='Число потоков (default: 50)')
+    parser.add_argument('--include', default=None,
+        help='Диапазоны через запятую вместо локальных сетей: 10.20.0.0/20,10.30.1.10-10.30.1.99 '
+             '(default: PRINTERS_DISCOVERY_INCLUDE или сети интерфейсов с их маской)')
+    parser.add_argument('--exclude', default=None,
+        help='Исключаемые диапазоны через запятую (default: PRINTERS_DISCOVERY_EXCLUDE)')
+    parser.add_argument('--rate', type=float, default=network.DEFAULT_RATE,
+        help=f'Попыток подключения в секунду (default: {network.DEFAULT_RATE:g})')
+    parser.add_argument('-w', '--workers', type=int, default=network.DEFAULT_WORKERS,
+        help=f'Число потоков (default: {network.DEFAULT_WORKERS})')
     parser.add_argument('--try-ssh', action='store_true',
         help='Пробовать подключиться по SSH к найденным устройствам')
     args = parser.parse_args()
 
-    subnets = get_all_local_subnets()
-    if not subnets:
-        print("✗ Не найдены сетевые интерфейсы с IPv4 адресами")
-        return
-
-    all_found = []
-    for subnet, ip, iface in subnets:
-        print(f"\nСканируем подсеть {subnet}.x через интерфейс {iface} (IP {ip})")
-        found = scan_subnet_for_printers(subnet, args.start, args.end, args.workers)
-        all_found.extend(found)
+    all_found = scan_no_cli(args.include, args.exclude, args.workers, args.rate)
 
     if all_found:
         print("\nОбнаружены Raspberry Pi принтеры по адресам:")
@@ -105,25 +88,36 @@ def main():
             print(f"  [{i}] {ip}")
         if args.try_ssh:
             print("\nПРОБА ПОДКЛЮЧЕНИЯ ПО SSH (user/password pi/pi):")
-            for ip in all_found:
-                ok, info = try_ssh(ip)
-                if ok:
-                    print(f"✓ {ip} — SSH: {ok}, hostname: {info}")
-                else:
-                    print(f"✗ {ip} — SSH: FAILED [{info}]")
+            # Все хосты параллельно, а не по очереди (discovery/fleet_ssh.py)
+            with FleetSSH(all_found, username="pi", password="pi", connect_timeout=3,
+                          on_output=lambda host, line: None) as fleet:
+                for result in fleet.run("hostname"):
+                    if result.ok:
+                        print(f"✓ {result.host} — SSH: True, hostname: {' '.join(result.output)}")
+                    else:
+                        print(f"✗ {result.host} — SSH: FAILED [{result.error or result.exit_status}]")
     else:
         print("\nНе найдено ни одного принтера во всех локальных подсетях.")
         
 
-def scan_no_cli(start=1, end=254, workers=50) -> list:
-    moonraker_hosts = []
-    subnets = get_all_local_subnets()
-    if subnets:
+def scan_no_cli(include=None, exclude=None, workers=network.DEFAULT_WORKERS, rate=network.DEFAULT_RATE) -> list:
+    """Адреса с открытым портом Moonraker во всех локальных сетях (или в include) без exclude"""
+    if include is None and not os.environ.get("PRINTERS_DISCOVERY_INCLUDE"):
+        subnets = get_all_local_subnets()
+        if not subnets:
+            print("✗ Не найдены сетевые интерфейсы с IPv4 адресами")
+            return []
         for subnet, ip, iface in subnets:
-            print(f"\nСканируем подсеть {subnet}.x через интерфейс {iface} (IP {ip})")
-            found = scan_subnet_for_printers(subnet, start, end, workers)
-            moonraker_hosts.extend(found)
-    return moonraker_hosts 
+            print(f"Подсеть {subnet} через интерфейс {iface} (IP {ip})")
+    addresses = network.target_addresses(include, exclude)
+    hints = network.neighbor_hints()
+    print(f"\nСканируем {len(addresses)} адресов на порт 7125 (Moonraker), из таблицы соседей - "
+          f"{len(set(hints) & set(addresses))}")
+    started = time.monotonic()
+    moonraker_hosts = network.scan(addresses, hints=hints, rate=rate, workers=workers,
+                                   on_found=lambda ip: print(f"✓ Найден принтер на {ip}"))
+    print(f"Всего найдено: {len(moonraker_hosts)} за {time.monotonic() - started:.1f} с")
+    return moonraker_hosts
 
 # if __name__ == '__main__':
 #     main()
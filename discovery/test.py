@@ -2,12 +2,19 @@
 # -*- coding: utf-8 -*-
 """
 Fast Port Scanner для поиска Moonraker и других сервисов
-Использует многопоточность для быстрого сканирования
+Использует многопоточность для быстрого сканирования, а для полного
+сканирования подсети - asyncio (async_port_scan): тысячи одновременных
+подключений в одном потоке с общим ограничением частоты
 """
 
+import asyncio
+import errno
+import ipaddress
+import itertools
 import socket
+import struct
 import concurrent.futures
-from typing import List, Dict
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional
 import time
 
 # Стандартные порты для 3D принтеров
@@ -119,6 +126,257 @@ def fast_port_scan(ip: str, ports: List[int] = None,
     return open_ports
 
 
+def parse_hosts(spec: str) -> List[str]:
+    """
+    Адреса из строки: "172.22.112.5", "172.22.112.0/24", "172.22.112.10-172.22.112.50",
+    несколько - через запятую
+    """
+    hosts = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '-' in item:
+            first, last = (ipaddress.IPv4Address(part.strip()) for part in item.split('-', 1))
+            networks = ipaddress.summarize_address_range(first, last)
+            hosts.extend(str(ip) for network in networks for ip in network)
+        elif '/' in item:
+            network = ipaddress.IPv4Network(item, strict=False)
+            hosts.extend(str(ip) for ip in (network.hosts() if network.prefixlen < 31 else network))
+        else:
+            hosts.append(item)
+    return list(dict.fromkeys(hosts))
+
+
+def parse_ports(spec: str) -> List[int]:
+    """Порты из строки "22,80,7000-8000"; "fast" и "full" - стандартные наборы"""
+    if spec == 'fast':
+        return list(COMMON_PRINTER_PORTS)
+    if spec == 'full':
+        return list(EXTENDED_PORTS)
+    ports = []
+    for item in spec.split(','):
+        first, _, last = item.strip().partition('-')
+        ports.extend(range(int(first), int(last or first) + 1))
+    return list(dict.fromkeys(ports))
+
+
+def _raise_open_files_limit(wanted: int) -> int:
+    """Поднимает мягкий лимит открытых файлов до wanted (не выше жесткого); возвращает доступный"""
+    try:
+        import resource
+    except ImportError:
+        # Windows: лимита RLIMIT_NOFILE нет
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        new_soft = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+            soft = new_soft
+        except (ValueError, OSError):
+            pass
+    return wanted if soft == resource.RLIM_INFINITY else soft
+
+
+class _AsyncRateLimiter:
+    """Общий для всех задач лимит частоты: каждая попытка получает свой момент старта"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(self._next, now)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# Закрытие сбросом (RST) вместо FIN: сокеты не копятся в TIME_WAIT и не съедают локальные порты
+_LINGER_RESET = struct.pack('ii', 1, 0)
+
+
+def _resolve(future: asyncio.Future, writable: bool):
+    if not future.done():
+        future.set_result(writable)
+
+
+async def _probe(loop: asyncio.AbstractEventLoop, ip: str, port: int, timeout: float) -> str:
+    """
+    Одно неблокирующее подключение: готовность сокета к записи ждет цикл событий (epoll/kqueue)
+
+    Без sock_connect и wait_for: на каждую попытку - один Future и один таймер,
+    а не отдельная задача, иначе на тысячах попыток цикл событий упирается в процессор
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RESET)
+        error = sock.connect_ex((ip, port))
+        if error in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            future = loop.create_future()
+            fd = sock.fileno()
+            loop.add_writer(fd, _resolve, future, True)
+            timer = loop.call_later(timeout, _resolve, future, False)
+            try:
+                writable = await future
+            finally:
+                loop.remove_writer(fd)
+                timer.cancel()
+            if not writable:
+                return 'filtered'
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    except OSError:
+        return 'error'
+    finally:
+        sock.close()
+    if error == 0:
+        return 'open'
+    if error == errno.ECONNREFUSED:
+        return 'closed'
+    if error in (errno.ETIMEDOUT, errno.EHOSTUNREACH, errno.ENETUNREACH):
+        return 'filtered'
+    return 'error'
+
+
+async def _probe_connect(loop: asyncio.AbstractEventLoop, ip: str, port: int, timeout: float) -> str:
+    """
+    То же подключение через loop.sock_connect - для циклов без add_writer
+    (ProactorEventLoop, по умолчанию на Windows); медленнее _probe примерно вдвое
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RESET)
+        await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+        return 'open'
+    except asyncio.TimeoutError:
+        return 'filtered'
+    except ConnectionRefusedError:
+        return 'closed'
+    except OSError as e:
+        if e.errno in (errno.ETIMEDOUT, errno.EHOSTUNREACH, errno.ENETUNREACH):
+            return 'filtered'
+        return 'error'
+    finally:
+        sock.close()
+
+
+def _probe_for(loop: asyncio.AbstractEventLoop):
+    """Проверка, подходящая циклу событий: у ProactorEventLoop нет add_writer"""
+    proactor = getattr(asyncio, 'ProactorEventLoop', None)
+    return _probe_connect if proactor is not None and isinstance(loop, proactor) else _probe
+
+
+async def async_port_scan(hosts: Iterable[str], ports: Iterable[int], timeout: float = 0.5,
+                          concurrency: int = 4000, rate: float = 20000,
+                          stats: Optional[Dict] = None) -> AsyncIterator[Dict]:
+    """
+    Асинхронное сканирование hosts x ports; открытые порты выдаются по мере нахождения
+
+    Args:
+        hosts: IP адреса
+        ports: Порты
+        timeout: Таймаут подключения (секунды)
+        concurrency: Одновременных подключений (не больше лимита открытых файлов)
+        rate: Общий лимит попыток подключения в секунду (0 - без лимита)
+        stats: Словарь, в который пишутся счетчики open/closed/filtered/error
+
+    Yields:
+        Dict с результатом для каждого открытого порта: ip, port, status, service
+
+    Raises:
+        Первое исключение задачи проверки (остальные задачи при этом отменяются)
+    """
+    hosts = list(hosts)
+    ports = list(ports)
+    # Порты снаружи, хосты внутри: соседние попытки идут на разные хосты, и ни один не получает весь поток
+    targets = iter(itertools.product(ports, hosts))
+    concurrency = max(1, min(concurrency, len(hosts) * len(ports),
+                             _raise_open_files_limit(concurrency + 64) - 64))
+    limiter = _AsyncRateLimiter(rate)
+    results: asyncio.Queue = asyncio.Queue()
+    counters = stats if stats is not None else {}
+    for status in ('open', 'closed', 'filtered', 'error'):
+        counters.setdefault(status, 0)
+
+    loop = asyncio.get_running_loop()
+    probe = _probe_for(loop)
+
+    async def worker():
+        # Цели берутся из общего итератора: задач столько, сколько одновременных подключений, а не целей
+        try:
+            for port, ip in targets:
+                await limiter.acquire()
+                status = await probe(loop, ip, port, timeout)
+                counters[status] += 1
+                if status == 'open':
+                    results.put_nowait({'ip': ip, 'port': port, 'status': status,
+                                        'service': identify_service(port)})
+        except Exception as e:
+            # Ошибка передается вызывающему, а не теряется вместе с задачей
+            results.put_nowait(e)
+        finally:
+            # Метка завершения ставится всегда, иначе потребитель ждал бы ее вечно
+            results.put_nowait(None)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        finished = 0
+        while finished < len(workers):
+            result = await results.get()
+            if result is None:
+                finished += 1
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                yield result
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+def full_scan(hosts: List[str], ports: List[int], timeout: float = 0.5, concurrency: int = 4000,
+              rate: float = 20000, on_result: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """
+    Синхронная обертка над async_port_scan с печатью результатов по мере поступления
+
+    Returns:
+        Список открытых портов в порядке нахождения
+    """
+    total = len(hosts) * len(ports)
+    print(f"Хостов: {len(hosts)}, портов: {len(ports)}, попыток: {total}")
+    print(f"Одновременно: {concurrency}, лимит: {rate:g}/s, Таймаут: {timeout}s")
+    print("-" * 60)
+
+    def show(result):
+        print(f"✓ {result['ip']}:{result['port']:<5d} открыт - {result['service']}", flush=True)
+
+    on_result = on_result or show
+    stats = {}
+
+    async def run():
+        found = []
+        async for result in async_port_scan(hosts, ports, timeout, concurrency, rate, stats):
+            found.append(result)
+            on_result(result)
+        return found
+
+    start_time = time.time()
+    open_ports = asyncio.run(run())
+    elapsed = time.time() - start_time
+    print(f"\nСканирование завершено за {elapsed:.2f}s ({total / elapsed:.0f} попыток/s)")
+    print(f"Открыто: {stats['open']}, закрыто: {stats['closed']}, нет ответа: {stats['filtered']}, "
+          f"ошибок: {stats['error']}")
+    return open_ports
+
+
 def scan_subnet_for_printers(subnet: str = "172.22.112",
                              start_host: int = 1,
                              end_host: int = 254) -> List[Dict]:
@@ -162,15 +420,26 @@ if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser(description='Быстрый сканер портов для принтеров')
-    parser.add_argument('-i', '--ip', required=True, help='IP адрес для сканирования')
+    parser.add_argument('-i', '--ip',
+                        help='IP адрес, сеть (172.22.112.0/24) или диапазон (a-b); несколько - через запятую')
     parser.add_argument('-m', '--mode', choices=['fast', 'full', 'subnet'],
                         default='fast', help='Режим сканирования')
     parser.add_argument('--subnet', default='172.22.112',
                         help='Подсеть для режима subnet (default: 172.22.112)')
+    parser.add_argument('-p', '--ports',
+                        help='Порты для режима full: "22,80,7000-8000" (default: 1-1023, 7000-7999, 9000-9999)')
     parser.add_argument('-w', '--workers', type=int, default=100,
-                        help='Количество потоков (default: 100)')
+                        help='Количество потоков режима fast (default: 100)')
+    parser.add_argument('-c', '--concurrency', type=int, default=4000,
+                        help='Одновременных подключений режимов full и subnet (default: 4000)')
+    parser.add_argument('-r', '--rate', type=float, default=20000,
+                        help='Лимит попыток в секунду режимов full и subnet, 0 - без лимита (default: 20000)')
+    parser.add_argument('-t', '--timeout', type=float, default=0.5,
+                        help='Таймаут подключения режимов full и subnet (default: 0.5)')
 
     args = parser.parse_args()
+    if args.mode != 'subnet' and not args.ip:
+        parser.error('для режимов fast и full нужен --ip')
 
     print("=" * 60)
     print("FAST PORT SCANNER")
@@ -178,23 +447,36 @@ if __name__ == '__main__':
 
     if args.mode == 'subnet':
         # Сканирование подсети на Moonraker
-        printers = scan_subnet_for_printers(args.subnet)
+        hosts = parse_hosts(args.ip or f"{args.subnet}.1-{args.subnet}.254")
+        printers = full_scan(hosts, [7125], args.timeout, args.concurrency, args.rate,
+                             on_result=lambda p: print(f"✓ Найден принтер: {p['ip']}", flush=True))
 
         if printers:
             print("\n" + "=" * 60)
             print("НАЙДЕННЫЕ ПРИНТЕРЫ:")
             for p in printers:
                 print(f"  {p['ip']}:{p['port']} - {p['service']}")
+    elif args.mode == 'full':
+        # Все хосты x все порты одним асинхронным проходом
+        print("Режим: Полное сканирование (asyncio)")
+        open_ports = full_scan(parse_hosts(args.ip), parse_ports(args.ports or 'full'),
+                               args.timeout, args.concurrency, args.rate)
+
+        if open_ports:
+            print("\n" + "=" * 60)
+            print("ОТКРЫТЫЕ ПОРТЫ:")
+            for p in sorted(open_ports, key=lambda p: (ipaddress.IPv4Address(p['ip']), p['port'])):
+                print(f"  {p['ip']:<15} {p['port']:5d} - {p['service']}")
+        else:
+            print("\n✗ Открытые порты не найдены")
     else:
         # Сканирование конкретного IP
-        if args.mode == 'fast':
-            ports = COMMON_PRINTER_PORTS
-            print("Режим: Быстрое сканирование (стандартные порты)")
-        else:
-            ports = EXTENDED_PORTS
-            print("Режим: Полное сканирование (1-10000)")
+        ports = COMMON_PRINTER_PORTS
+        print("Режим: Быстрое сканирование (стандартные порты)")
 
-        open_ports = fast_port_scan(args.ip, ports, max_workers=args.workers)
+        open_ports = []
+        for ip in parse_hosts(args.ip):
+            open_ports.extend(fast_port_scan(ip, ports, max_workers=args.workers))
 
         if open_ports:
             print("\n" + "=" * 60)
@@ -6,6 +6,7 @@ Cross-platform IP detection and configuration management
 """
 
 import json
+import os
 import socket
 import platform
 from typing import Optional, Dict
@@ -62,13 +63,17 @@ def save_discovered_printers(printers: Dict[str, str], filename: str = 'discover
     """
     Save discovered printers to JSON file
 
+    The file is replaced atomically, so a reader never sees a partial write.
+
     Args:
-        printers: Dictionary of {printer_id: ip_address}
+        printers: Dictionary of {printer_id: ip_address} (or of printer records)
         filename: Output filename
     """
+    tmp_filename = f"{filename}.tmp"
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
+        with open(tmp_filename, 'w', encoding='utf-8') as f:
             json.dump(printers, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_filename, filename)
         return True
     except Exception as e:
         print(f"Error saving to {filename}: {e}")